@@ -1,8 +1,9 @@
 import os
+import sys
 import requests
-import json
 import time
 import gspread
+from gestionale import TARGETS_JSON, load_targets, open_spreadsheet, open_worksheet, remember_worksheet, ensure_header_row, emit_rows, flush_output_sinks, sheets_write, run_profiled
 
 # --- CONFIGURAZIONE ---
 # Leggiamo i dati dai segreti di GitHub
@@ -75,44 +76,86 @@ def sorare_graphql_fetch(query, variables={}):
         print(f"Errore di rete durante la chiamata API: {e}")
         return None
 
+def prepare_worksheet(spreadsheet_id):
+    """Prepara il foglio: crealo se non esiste, pulisci i dati e scrivi gli header solo se cambiati."""
+    spreadsheet = open_spreadsheet(spreadsheet_id)
+    try:
+        worksheet = open_worksheet(spreadsheet, FORMAZIONI_SHEET_NAME)
+        sheets_write(worksheet.batch_clear, ['A2:G'])
+    except gspread.WorksheetNotFound:
+        worksheet = remember_worksheet(spreadsheet, sheets_write(spreadsheet.add_worksheet, title=FORMAZIONI_SHEET_NAME, rows="100", cols="20"))
+    
+    ensure_header_row(worksheet, HEADERS)
+    print(f"Foglio '{FORMAZIONI_SHEET_NAME}' preparato con successo.")
+    return worksheet
+
+def check_user_lineups(worksheet, user_slug, filtered_leaderboards):
+    """Cerca le formazioni di un utente nelle competizioni e le scrive sul suo foglio."""
+    print(f"Trovate {len(filtered_leaderboards)} competizioni valide da controllare per l'utente '{user_slug}'.")
+
+    # 4. Cerca le formazioni e aggrega i dati
+    all_formations_data = []
+    for leaderboard in filtered_leaderboards:
+        print(f"-> Cerco in: \"{leaderboard['displayName']}\"")
+        lineups_data = sorare_graphql_fetch(GET_USER_LINEUPS_QUERY, {"slug": leaderboard['slug'], "userSlug": user_slug})
+        lineups = lineups_data.get("data", {}).get("so5", {}).get("so5Leaderboard", {}).get("so5LineupsPaginated", {}).get("nodes", [])
+        
+        if lineups:
+            for lineup in lineups:
+                for appearance in lineup.get("so5Appearances", []):
+                    row = [
+                        leaderboard['displayName'],
+                        lineup.get('name', "Senza Nome"),
+                        appearance.get("player", {}).get("displayName"),
+                        appearance.get("anyCard", {}).get("slug"),
+                        appearance.get("anyCard", {}).get("rarityTyped"),
+                        appearance.get("position"),
+                        "Sì" if appearance.get("captain") else "No"
+                    ]
+                    all_formations_data.append(row)
+        time.sleep(0.5) # Pausa di cortesia
+
+    # 5. Scrivi i risultati sul foglio (e sui sink locali configurati)
+    emit_rows("lineups", [dict(zip(HEADERS, row)) for row in all_formations_data], target=f"{user_slug}@{worksheet.spreadsheet_id}")
+    if all_formations_data:
+        sheets_write(worksheet.update, 'A2', all_formations_data)
+        print(f"\nSUCCESSO! Trovate e scritte {len(all_formations_data)} carte schierate.")
+    else:
+        sheets_write(worksheet.update, 'A2', [[f"Nessuna formazione trovata per l'utente '{user_slug}' nelle competizioni attive."]])
+        print(f"\nNessuna formazione trovata per l'utente '{user_slug}'.")
+
 def main():
     """Funzione principale che esegue tutto il processo."""
     print("--- INIZIO VERIFICA FORMAZIONI SCHIERATE ---")
     start_time = time.time()
 
-    # 1. Autenticazione e preparazione del foglio Google
-    if not all([SORARE_API_KEY, USER_SLUG, GSPREAD_CREDENTIALS_JSON, SPREADSHEET_ID]):
+    # 1. Autenticazione e preparazione dei fogli Google (uno per target)
+    # Stessi target di gestionale.run_for_targets: USER_SLUG/SPREADSHEET_ID solo senza TARGETS
+    targets = load_targets()
+    if not targets and TARGETS_JSON and TARGETS_JSON.strip():
+        print("ERRORE: nessun target valido in TARGETS, esecuzione annullata.")
+        return
+    targets = targets or [{"user_slug": USER_SLUG, "spreadsheet_id": SPREADSHEET_ID}]
+    if not all([SORARE_API_KEY, GSPREAD_CREDENTIALS_JSON]) or not all(t['user_slug'] and t['spreadsheet_id'] for t in targets):
         print("ERRORE: Uno o più segreti non sono stati configurati (API_KEY, USER_SLUG, GSPREAD_CREDENTIALS, SPREADSHEET_ID).")
         return
 
     try:
         print("Autenticazione a Google Sheets...")
-        credentials = json.loads(GSPREAD_CREDENTIALS_JSON)
-        gc = gspread.service_account_from_dict(credentials)
-        spreadsheet = gc.open_by_key(SPREADSHEET_ID)
-        
-        # Prepara il foglio: crealo se non esiste, puliscilo e scrivi gli header
-        try:
-            worksheet = spreadsheet.worksheet(FORMAZIONI_SHEET_NAME)
-            worksheet.clear()
-        except gspread.WorksheetNotFound:
-            worksheet = spreadsheet.add_worksheet(title=FORMAZIONI_SHEET_NAME, rows="100", cols="20")
-        
-        worksheet.update('A1', [HEADERS])
-        worksheet.format('A1:G1', {'textFormat': {'bold': True}})
-        print(f"Foglio '{FORMAZIONI_SHEET_NAME}' preparato con successo.")
+        worksheets = [(target, prepare_worksheet(target['spreadsheet_id'])) for target in targets]
     except Exception as e:
         print(f"ERRORE CRITICO durante l'accesso a Google Sheets: {e}")
         return
 
-    # 2. Trova la Game Week in corso
+    # 2. Trova la Game Week in corso (condivisa tra tutti i target)
     print("Cerco la Game Week in corso...")
     fixture_data = sorare_graphql_fetch(GET_CURRENT_FIXTURE_QUERY)
     fixture = fixture_data.get("data", {}).get("so5", {}).get("so5Fixtures", {}).get("nodes", [None])[0]
 
     if not fixture:
         print("Nessuna Game Week di calcio attiva trovata. Fine.")
-        worksheet.update('A2', [["Nessuna formazione trovata (nessuna Game Week attiva)."]])
+        for _, worksheet in worksheets:
+            sheets_write(worksheet.update, 'A2', [["Nessuna formazione trovata (nessuna Game Week attiva)."]])
         return
     print(f"Trovata Game Week: {fixture['displayName']}")
 
@@ -125,40 +168,16 @@ def main():
         lb for lb in all_leaderboards 
         if "arena" not in lb['displayName'].lower() and "common" not in lb['displayName'].lower()
     ]
-    print(f"Trovate {len(filtered_leaderboards)} competizioni valide da controllare per l'utente '{USER_SLUG}'.")
-
-    # 4. Cerca le formazioni e aggrega i dati
-    all_formations_data = []
-    for leaderboard in filtered_leaderboards:
-        print(f"-> Cerco in: \"{leaderboard['displayName']}\"")
-        lineups_data = sorare_graphql_fetch(GET_USER_LINEUPS_QUERY, {"slug": leaderboard['slug'], "userSlug": USER_SLUG})
-        lineups = lineups_data.get("data", {}).get("so5", {}).get("so5Leaderboard", {}).get("so5LineupsPaginated", {}).get("nodes", [])
-        
-        if lineups:
-            for lineup in lineups:
-                for appearance in lineup.get("so5Appearances", []):
-                    row = [
-                        leaderboard['displayName'],
-                        lineup.get('name', "Senza Nome"),
-                        appearance.get("player", {}).get("displayName"),
-                        appearance.get("anyCard", {}).get("slug"),
-                        appearance.get("anyCard", {}).get("rarityTyped"),
-                        appearance.get("position"),
-                        "Sì" if appearance.get("captain") else "No"
-                    ]
-                    all_formations_data.append(row)
-        time.sleep(0.5) # Pausa di cortesia
 
-    # 5. Scrivi i risultati sul foglio
-    if all_formations_data:
-        worksheet.update('A2', all_formations_data)
-        print(f"\nSUCCESSO! Trovate e scritte {len(all_formations_data)} carte schierate.")
-    else:
-        worksheet.update('A2', [[f"Nessuna formazione trovata per l'utente '{USER_SLUG}' nelle competizioni attive."]])
-        print(f"\nNessuna formazione trovata per l'utente '{USER_SLUG}'.")
+    for target, worksheet in worksheets:
+        check_user_lineups(worksheet, target['user_slug'], filtered_leaderboards)
+    flush_output_sinks()
     
     end_time = time.time()
     print(f"--- ESECUZIONE COMPLETATA in {end_time - start_time:.2f} secondi ---")
 
 if __name__ == "__main__":
-    main()
+    if "--profile" in sys.argv:
+        run_profiled("check_lineups", main)
+    else:
+        main()
@@ -3,11 +3,38 @@
 # Importazioni necessari
 import os
 import sys
+import signal
+import threading
 import requests
 import json
 import time
-from datetime import datetime, timedelta
+import queue
+import asyncio
+import collections
+import atexit
+import hashlib
+import sqlite3
+import csv
+import array
+import bisect
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 import gspread
+from google.oauth2.service_account import Credentials
+try:
+    import websockets  # opzionale: serve solo al listener (python gestionale.py listen)
+except ImportError:
+    websockets = None
+try:
+    import pyarrow  # opzionale: serve solo ai sink parquet
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+try:
+    import fcntl  # lock tra processi sui file delle serie storiche (assente su Windows)
+except ImportError:
+    fcntl = None
 
 # --- 1. CONFIGURAZIONE ---
 SORARE_API_KEY = os.environ.get("SORARE_API_KEY")
@@ -16,16 +43,115 @@ GSPREAD_CREDENTIALS_JSON = os.environ.get("GSPREAD_CREDENTIALS")
 SPREADSHEET_ID = os.environ.get("SPREADSHEET_ID")
 TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHAT_ID = os.environ.get("TELEGRAM_CHAT_ID")
+# Modalità multi-utente: lista JSON di target, es. [{"user_slug": "...", "spreadsheet_id": "..."}]
+TARGETS_JSON = os.environ.get("TARGETS")
 API_URL = "https://api.sorare.com/graphql"
 MAIN_SHEET_NAME = "Foglio1"
 SALES_HISTORY_SHEET_NAME = "Cronologia Vendite"
-STATE_FILE = "state.json"
+# Layout vendite: "wide" (una riga per coppia con Sale N × 100) oppure "ledger" (una riga per vendita + riepilogo)
+SALES_LAYOUT = os.environ.get("SALES_LAYOUT", "wide").lower()
+SALES_LEDGER_SHEET_NAME = "Registro Vendite"
+SALES_SUMMARY_SHEET_NAME = "Riepilogo Vendite"
+SALES_LEDGER_HEADERS = ["Player Name", "Player API Slug", "Rarity Searched", "Sale Date", "Sale Price (EUR)", "Eligibility", "Recorded At"]
+SALES_SUMMARY_HEADERS = ["Player Name", "Player API Slug", "Rarity Searched", "Sales Today (In-Season)", "Sales Today (Classic)"] + [f"Avg Price {p}d ({kind})" for p in [3, 7, 14, 30] for kind in ("In-Season", "Classic")] + ["Last Updated"]
+SALES_SUMMARY_WINDOW_DAYS = 30
+SALES_FETCH_CONCURRENCY = 4
+SALES_PIPELINE_QUEUE_SIZE = 50
+SALES_FLUSH_EVERY_ROWS = 25
+SALES_FLUSH_INTERVAL_SECONDS = 30
+SALES_TIMEOUT_SECONDS = 480
+# Listener websocket (aggiornamenti in tempo reale di offerte e vendite); il polling resta come riconciliazione
+SORARE_WS_URL = os.environ.get("SORARE_WS_URL", "wss://ws.sorare.com/cable")
+LISTENER_FLUSH_EVERY_UPDATES = 50
+LISTENER_FLUSH_INTERVAL_SECONDS = 60
+LISTENER_RECONNECT_DELAY_SECONDS = 5
+LISTENER_MAX_RUNTIME_SECONDS = int(os.environ.get("LISTENER_MAX_RUNTIME_SECONDS", "0"))  # 0 = senza limite
+DEFAULT_STATE_FILE = "state.json"
+STATE_FILE = DEFAULT_STATE_FILE
+# Modalità shard (--shard i/N): ogni processo lavora solo sui giocatori della sua partizione
+SHARD_INDEX, SHARD_COUNT = 0, 1
+# Quota di scrittura Sheets condivisa (richieste/minuto per utente), divisa tra gli shard
+SHEETS_WRITES_PER_MINUTE = 60
+# Errori di quota (429) e temporanei: nuovi tentativi con backoff esponenziale invece di perdere la scrittura
+SHEETS_WRITE_MAX_RETRIES = 6
+SHEETS_RETRY_BASE_SECONDS = 2
+SHEETS_RETRY_STATUS_CODES = (429, 500, 503)
+# Righe di Foglio1 accumulate da update_cards prima di una batch_update (le adiacenti diventano un solo range)
+SHEETS_COALESCE_ROWS = 20
+# Journal append-only dei progressi di sessione (un file per job e target)
+JOURNAL_DIR = "journal"
+# Errori per elemento (422, errori GraphQL, anyCard vuota): backoff esponenziale tra le sessioni,
+# poi dead-letter (ritentato ogni DEAD_LETTER_RETRY_DAYS giorni)
+FAILURE_BACKOFF_BASE_MINUTES = 30
+FAILURE_BACKOFF_MAX_HOURS = 48
+DEAD_LETTER_AFTER_FAILURES = 6
+DEAD_LETTER_RETRY_DAYS = 7
+# Circuit breaker: Sorare in errore su quasi tutte le richieste -> la sessione si ferma e riprende dopo
+CIRCUIT_BREAKER_CONSECUTIVE_FAILURES = 10
+CIRCUIT_BREAKER_MIN_ATTEMPTS = 20
+CIRCUIT_BREAKER_FAILURE_RATIO = 0.8
+# Costi per elemento (secondi, richieste Sorare, scritture Sheets) misurati a ogni esecuzione e
+# mediati in state['run_costs'] (media mobile esponenziale): li usa il planner (comando plan).
+# Finché uno stage non ha misure, il tempo per elemento è quello indicativo di PLAN_DEFAULT_SECONDS_PER_ITEM
+RUN_COST_SMOOTHING = 0.3
+PLAN_DEFAULT_SECONDS_PER_ITEM = {"update_cards": 1.6, "update_sales": 0.4, "backfill_sales": 0.3, "update_floors": 0.1, "update_watchlist": 0.05}
+PLAN_SAMPLE_ITEMS = 10
+CARDS_TIMEOUT_SECONDS = 300
+# Token e metadati dei fogli tra un'esecuzione e l'altra. Nei workflow il file (senza token,
+# vedi save_sheets_session) viene ripristinato con actions/cache; il token si riusa solo in daemon/locale
+SHEETS_SESSION_FILE = ".sheets_session.json"
+SHEETS_METADATA_MAX_AGE_HOURS = 24
 BATCH_SIZE = 15
 MAX_SALES_TO_DISPLAY = 100
 MAX_SALES_FROM_API = 7
-INITIAL_SALES_FETCH_COUNT = 20
+# Backfill della cronologia profonda (python gestionale.py backfill_sales): tokenPrices ha solo "first",
+# senza cursore, quindi la storia si prende con un'unica richiesta ampia per coppia
+BACKFILL_SALES_COUNT = 500
+BACKFILL_CONCURRENCY = 8
+BACKFILL_LOAD_BATCH_PAIRS = 40
+BACKFILL_TIMEOUT_SECONDS = int(os.environ.get("BACKFILL_TIMEOUT_SECONDS", "1500"))
+# Watchlist di giocatori non posseduti: foglio "Watchlist" (colonna Player API Slug) oppure
+# WATCHLIST_FILE (uno slug per riga). Floor, forma e proiezioni a ogni ciclo con query ad alias,
+# vendite recenti al più ogni WATCHLIST_SALES_INTERVAL_MINUTES per giocatore
+WATCHLIST_SHEET_NAME = "Watchlist"
+WATCHLIST_FILE = os.environ.get("WATCHLIST_FILE")
+WATCHLIST_PLAYERS_PER_REQUEST = 20
+WATCHLIST_PAIRS_PER_REQUEST = 25
+WATCHLIST_CONCURRENCY = 6
+WATCHLIST_RARITIES = {"limited": "Limited", "rare": "Rare", "super_rare": "SR"}
+WATCHLIST_SALES_COUNT = 10
+WATCHLIST_SALES_INTERVAL_MINUTES = 60
 CARD_DATA_UPDATE_INTERVAL_HOURS = 0.5
+SHARED_CACHE_TTL_SECONDS = 600
+# Sottoinsieme di colonne dati di Foglio1 da aggiornare (lista JSON); le altre restano vuote
+SHEET_COLUMNS_JSON = os.environ.get("SHEET_COLUMNS")
+SHEET_SNAPSHOT_TTL_SECONDS = 900
+# --profile: report (testo) e dump pstats in PROFILE_DIR
+PROFILE_DIR = "profiles"
+PROFILE_TOP_FUNCTIONS = 40
+PROFILE_TOP_ALLOCATIONS = 20
+# Sink di output locali (lista JSON), es. [{"type": "sqlite", "path": "gestionale.db"}, {"type": "parquet", "dir": "export"}]
+OUTPUT_SINKS_JSON = os.environ.get("OUTPUT_SINKS")
+SINK_BATCH_ROWS = 500
+# "full": Sheets riceve tutto; "dashboard": solo il sottoinsieme compatto, il resto va ai sink locali
+SHEETS_OUTPUT = os.environ.get("SHEETS_OUTPUT", "full")
+# Serie storiche locali di floor e prezzi di listino: campioni completi per TIMESERIES_RAW_HOURS,
+# poi medie orarie fino a TIMESERIES_HOURLY_DAYS, poi giornaliere. Nei workflow la directory
+# passa da un run al successivo con actions/cache (floors e listini da due workflow distinti)
+TIMESERIES_DIR = "timeseries"
+TIMESERIES_RAW_HOURS = 48
+TIMESERIES_HOURLY_DAYS = 30
+TIMESERIES_MIN_SPACING_SECONDS = 60  # campioni più ravvicinati (es. più carte dello stesso giocatore) sostituiscono l'ultimo
+# Modalità daemon: intervallo (minuti) di ogni job, sovrascrivibile con DAEMON_INTERVALS (JSON, null disattiva il job)
+DAEMON_JOB_INTERVAL_MINUTES = {"sync_galleria": 15, "update_floors": 5, "update_cards": 30, "update_sales": 15, "update_watchlist": 15, "backfill_sales": 60, "check_lineups": 15, "create_charts": 1440}
+DAEMON_INTERVALS_JSON = os.environ.get("DAEMON_INTERVALS")
+DAEMON_TICK_SECONDS = 20
+GALLERY_RARITIES = ["limited", "rare", "super_rare", "unique"]
+GALLERY_PAGE_PAUSE_SECONDS = 0.25
+FULL_GALLERY_SYNC_INTERVAL_HOURS = 6
 MAIN_SHEET_HEADERS = ["Slug", "Rarity", "Player Name", "Player API Slug", "Position", "U23 Eligible?", "Livello", "In Season?", "XP Corrente", "XP Prox Livello", "XP Mancanti Livello", "Sale Price (EUR)", "FLOOR CLASSIC LIMITED", "FLOOR CLASSIC RARE", "FLOOR CLASSIC SR", "FLOOR IN SEASON LIMITED", "FLOOR IN SEASON RARE", "FLOOR IN SEASON SR", "L5 So5 (%)", "L15 So5 (%)", "Avg So5 Score (3)", "Avg So5 Score (5)", "Avg So5 Score (15)", "Last 15 SO5 Scores", "Partita", "Data Prossima Partita", "Next Game API ID", "Projection Grade", "Projected Score", "Projection Reliability (%)", "Starter Odds (%)", "Fee Abilitata?", "Infortunio", "Squalifica", "Ultimo Aggiornamento", "Owner Since", "Foto URL"]
+# Colonne di Foglio1 scritte in modalità dashboard (identità e colonne rilette dai job restano sempre)
+SHEETS_DASHBOARD_COLUMNS = ["Slug", "Rarity", "Player Name", "Player API Slug", "Position", "Livello", "Sale Price (EUR)", "FLOOR CLASSIC LIMITED", "FLOOR CLASSIC RARE", "FLOOR CLASSIC SR", "FLOOR IN SEASON LIMITED", "FLOOR IN SEASON RARE", "FLOOR IN SEASON SR", "L5 So5 (%)", "L15 So5 (%)", "Avg So5 Score (5)", "Last 15 SO5 Scores", "Partita", "Data Prossima Partita", "Next Game API ID", "Projection Grade", "Projected Score", "Starter Odds (%)", "Infortunio", "Squalifica", "Ultimo Aggiornamento", "Owner Since"]
 CHART_SHEET_NAME = "Grafici SO5"
 GRADIENT_STOPS = {
     0: {'r': 255, 'g': 80, 'b': 80},      # Red
@@ -47,80 +173,1299 @@ ALL_CARDS_QUERY = """
     }
 """
 
-PLAYER_TOKEN_PRICES_QUERY = """
-    query GetPlayerTokenPrices($playerSlug: String!, $rarity: Rarity!, $limit: Int!) {
-        tokens {
-            tokenPrices(playerSlug: $playerSlug, rarity: $rarity, first: $limit, includePrivateSales: true) {
-                amounts { eurCents }
-                date
-                card { inSeasonEligible }
+RECENT_CARDS_QUERY = """
+    query RecentCardsFromUser($userSlug: String!, $rarities: [Rarity!], $cursor: String) {
+        user(slug: $userSlug) {
+            cards(rarities: $rarities, after: $cursor, first: 50, sortByOwnerSince: DESC) {
+                totalCount
+                nodes { ... on Card { slug, rarity, ownerSince, player { ... on Player { displayName, slug, position, u23Eligible } } } }
+                pageInfo { endCursor, hasNextPage }
             }
         }
     }
 """
 
+TOKEN_PRICE_FIELDS = "amounts { eurCents } date card { inSeasonEligible }"
+
+PLAYER_TOKEN_PRICES_QUERY = f"""
+    query GetPlayerTokenPrices($playerSlug: String!, $rarity: Rarity!, $limit: Int!) {{
+        tokens {{
+            tokenPrices(playerSlug: $playerSlug, rarity: $rarity, first: $limit, includePrivateSales: true) {{ {TOKEN_PRICE_FIELDS} }}
+        }}
+    }}
+"""
+
 PRICE_FRAGMENT = "liveSingleSaleOffer { receiverSide { amounts { eurCents, usdCents, gbpCents, wei, referenceCurrency } } }"
 
-OPTIMIZED_CARD_DETAILS_QUERY = f"""
-    query GetOptimizedCardDetails($cardSlug: String!) {{
+GAME_FRAGMENT = "upcomingGames(first: 1) { id, date, competition { displayName }, homeTeam { ... on TeamInterface { name } }, awayTeam { ... on TeamInterface { name } } }"
+
+PROJECTION_COLUMNS = ["Projection Grade", "Projected Score", "Projection Reliability (%)", "Starter Odds (%)"]
+
+# Campi della query carta divisi per tier, ognuno con la sua cadenza di aggiornamento:
+# "market" ad ogni ciclo, "form" dopo le partite, "static" una volta al giorno.
+# Ogni voce è (livello, selezione, colonne): "card" = campo della carta, "player" = campo del
+# giocatore; il campo viene richiesto solo se almeno una delle sue colonne è attiva.
+CARD_QUERY_TIERS = {
+    "market": [
+        ("card", PRICE_FRAGMENT, ["Sale Price (EUR)"]),
+        # Solo l'ID della prossima partita: se cambia, i dati di forma vanno riscaricati
+        ("player", "nextGame: activeClub { upcomingGames(first: 1) { id } }", ["Next Game API ID"]),
+        ("player", f"L_ANY: lowestPriceAnyCard(rarity: limited, inSeason: false) {{ {PRICE_FRAGMENT} }}", ["FLOOR CLASSIC LIMITED"]),
+        ("player", f"L_IN: lowestPriceAnyCard(rarity: limited, inSeason: true) {{ {PRICE_FRAGMENT} }}", ["FLOOR IN SEASON LIMITED"]),
+        ("player", f"R_ANY: lowestPriceAnyCard(rarity: rare, inSeason: false) {{ {PRICE_FRAGMENT} }}", ["FLOOR CLASSIC RARE"]),
+        ("player", f"R_IN: lowestPriceAnyCard(rarity: rare, inSeason: true) {{ {PRICE_FRAGMENT} }}", ["FLOOR IN SEASON RARE"]),
+        ("player", f"SR_ANY: lowestPriceAnyCard(rarity: super_rare, inSeason: false) {{ {PRICE_FRAGMENT} }}", ["FLOOR CLASSIC SR"]),
+        ("player", f"SR_IN: lowestPriceAnyCard(rarity: super_rare, inSeason: true) {{ {PRICE_FRAGMENT} }}", ["FLOOR IN SEASON SR"]),
+    ],
+    "form": [
+        ("card", "grade", ["Livello"]),
+        ("card", "xp", ["XP Corrente", "XP Mancanti Livello"]),
+        ("card", "xpNeededForNextGrade", ["XP Prox Livello", "XP Mancanti Livello"]),
+        ("player", "displayName", ["Player Name"]),
+        ("player", "lastFiveSo5Appearances", ["L5 So5 (%)"]),
+        ("player", "lastFifteenSo5Appearances", ["L15 So5 (%)"]),
+        ("player", "playerGameScores(last: 15) { score }", ["Avg So5 Score (3)", "Avg So5 Score (5)", "Avg So5 Score (15)", "Last 15 SO5 Scores"]),
+        ("player", "activeInjuries { status, expectedEndDate }", ["Infortunio"]),
+        ("player", "activeSuspensions { reason, endDate }", ["Squalifica"]),
+        # La prossima partita serve anche a fetch_projection (game_id)
+        ("player", f"activeClub {{ name, {GAME_FRAGMENT} }}", ["Partita", "Data Prossima Partita", "Next Game API ID"] + PROJECTION_COLUMNS),
+    ],
+    "static": [
+        ("card", "rarity", ["Rarity"]),
+        ("card", "pictureUrl", ["Foto URL"]),
+        ("card", "inSeasonEligible", ["In Season?"]),
+        ("card", "secondaryMarketFeeEnabled", ["Fee Abilitata?"]),
+        ("player", "position", ["Position"]),
+        ("player", "u23Eligible", ["U23 Eligible?"]),
+        ("player", "activeClub { name }", ["Partita"]),
+    ],
+}
+CARD_TIER_NAMES = ("market", "form", "static")
+# Colonne FLOOR di Foglio1 e alias GraphQL corrispondenti (lowestPriceAnyCard)
+FLOOR_COLUMN_ALIASES = {
+    "FLOOR CLASSIC LIMITED": "L_ANY", "FLOOR CLASSIC RARE": "R_ANY", "FLOOR CLASSIC SR": "SR_ANY",
+    "FLOOR IN SEASON LIMITED": "L_IN", "FLOOR IN SEASON RARE": "R_IN", "FLOOR IN SEASON SR": "SR_IN",
+}
+CARD_TIER_INTERVAL_HOURS = {"form": 6, "static": 24}
+# Il tier "form" segue il calendario: si aggiorna dopo la partita nota (quando i punteggi sono
+# disponibili), a CARD_TIER_INTERVAL_HOURS nelle ore prima della partita (proiezioni, probabili
+# titolari) e comunque almeno ogni FORM_MAX_AGE_HOURS (infortuni, squalifiche)
+FORM_POST_GAME_DELAY_HOURS = 3
+FORM_PREGAME_WINDOW_HOURS = 24
+FORM_MAX_AGE_HOURS = 24
+# Colonne di Foglio1 gestite dalla sync della galleria
+CARD_IDENTITY_COLUMNS = ["Slug", "Rarity", "Player Name", "Player API Slug", "Owner Since"]
+# Colonne di Foglio1 scritte da ciascun tier; le altre vengono riprese dai valori già presenti
+CARD_TIER_COLUMNS = {
+    "market": ["Sale Price (EUR)", "FLOOR CLASSIC LIMITED", "FLOOR CLASSIC RARE", "FLOOR CLASSIC SR", "FLOOR IN SEASON LIMITED", "FLOOR IN SEASON RARE", "FLOOR IN SEASON SR"],
+    "form": ["Livello", "XP Corrente", "XP Prox Livello", "XP Mancanti Livello", "L5 So5 (%)", "L15 So5 (%)", "Avg So5 Score (3)", "Avg So5 Score (5)", "Avg So5 Score (15)", "Last 15 SO5 Scores", "Partita", "Data Prossima Partita", "Next Game API ID", "Projection Grade", "Projected Score", "Projection Reliability (%)", "Starter Odds (%)", "Infortunio", "Squalifica"],
+    "static": ["Position", "U23 Eligible?", "In Season?", "Fee Abilitata?", "Foto URL"],
+}
+
+def load_enabled_columns():
+    """
+    Colonne dati attive da SHEET_COLUMNS (lista JSON); senza configurazione sono attive tutte.
+    Le colonne di identità (Slug, Player API Slug, ...) restano sempre gestite dalla sync.
+    """
+    data_columns = [header for tier in CARD_TIER_NAMES for header in CARD_TIER_COLUMNS[tier]]
+    if not SHEET_COLUMNS_JSON or not SHEET_COLUMNS_JSON.strip():
+        return set(data_columns)
+    try:
+        requested = set(json.loads(SHEET_COLUMNS_JSON))
+    except (json.JSONDecodeError, TypeError) as e:
+        print(f"ERRORE: SHEET_COLUMNS non è un JSON valido, uso tutte le colonne: {e}")
+        return set(data_columns)
+    unknown = requested - set(MAIN_SHEET_HEADERS)
+    if unknown:
+        print(f"AVVISO: colonne sconosciute in SHEET_COLUMNS ignorate: {sorted(unknown)}")
+    return requested & set(data_columns)
+
+ENABLED_COLUMNS = load_enabled_columns()
+
+def build_card_details_query(card_tiers=CARD_TIER_NAMES, player_tiers=None, columns=None):
+    """Genera la query dettagli carta con i soli campi dei tier richiesti e delle colonne attive."""
+    if player_tiers is None:
+        player_tiers = card_tiers
+    if columns is None:
+        columns = ENABLED_COLUMNS
+    card_fields, player_fields = [], ["slug"]
+    for tier in CARD_TIER_NAMES:
+        for level, selection, selection_columns in CARD_QUERY_TIERS[tier]:
+            if not columns.intersection(selection_columns):
+                continue
+            if level == "card" and tier in card_tiers:
+                card_fields.append(selection)
+            elif level == "player" and tier in player_tiers:
+                player_fields.append(selection)
+    return f"""
+    query GetCardDetails($cardSlug: String!) {{
         anyCard(slug: $cardSlug) {{
             ... on Card {{
-                rarity, grade, xp, xpNeededForNextGrade, pictureUrl, inSeasonEligible, secondaryMarketFeeEnabled
-                liveSingleSaleOffer {{ receiverSide {{ amounts {{ eurCents, usdCents, gbpCents, wei, referenceCurrency }} }} }}
-                player {{
-                    slug, displayName, position, lastFiveSo5Appearances, lastFifteenSo5Appearances
-                    playerGameScores(last: 15) {{ score }}
-                    activeInjuries {{ status, expectedEndDate }}
-                    activeSuspensions {{ reason, endDate }}
-                    activeClub {{ name, upcomingGames(first: 1) {{ id, date, competition {{ displayName }}, homeTeam {{ ... on TeamInterface {{ name }} }}, awayTeam {{ ... on TeamInterface {{ name }} }} }} }}
-                    u23Eligible
-                    L_ANY: lowestPriceAnyCard(rarity: limited, inSeason: false) {{ {PRICE_FRAGMENT} }}
-                    L_IN: lowestPriceAnyCard(rarity: limited, inSeason: true) {{ {PRICE_FRAGMENT} }}
-                    R_ANY: lowestPriceAnyCard(rarity: rare, inSeason: false) {{ {PRICE_FRAGMENT} }}
-                    R_IN: lowestPriceAnyCard(rarity: rare, inSeason: true) {{ {PRICE_FRAGMENT} }}
-                    SR_ANY: lowestPriceAnyCard(rarity: super_rare, inSeason: false) {{ {PRICE_FRAGMENT} }}
-                    SR_IN: lowestPriceAnyCard(rarity: super_rare, inSeason: true) {{ {PRICE_FRAGMENT} }}
-                }}
+                {" ".join(card_fields)}
+                player {{ {" ".join(player_fields)} }}
             }}
         }}
     }}
 """
 
-PROJECTION_QUERY = """
-    query GetProjection($playerSlug: String!, $gameId: ID!) {
-        football {
-            player(slug: $playerSlug) {
-                playerGameScore(gameId: $gameId) {
-                    projection { grade score reliabilityBasisPoints }
-                    anyPlayerGameStats {
-                        ... on PlayerGameStats {
-                            footballPlayingStatusOdds { starterOddsBasisPoints }
-                        }
-                    }
-                }
-            }
+OPTIMIZED_CARD_DETAILS_QUERY = build_card_details_query()
+
+def player_selections(tiers, columns):
+    """Selezioni a livello giocatore di CARD_QUERY_TIERS per i tier e le colonne indicate."""
+    return [selection for tier in tiers for level, selection, selection_columns in CARD_QUERY_TIERS[tier] if level == "player" and columns.intersection(selection_columns)]
+
+def build_player_floors_query(count):
+    """Query con alias p0..pN-1: solo i sei lowestPriceAnyCard per ogni giocatore del blocco."""
+    floor_fields = " ".join(player_selections(("market",), ENABLED_COLUMNS))
+    variable_defs = ", ".join(f"$p{i}: String!" for i in range(count))
+    aliases = " ".join(f"p{i}: player(slug: $p{i}) {{ slug {floor_fields} }}" for i in range(count))
+    return f"query GetPlayerFloors({variable_defs}) {{ football {{ {aliases} }} }}"
+
+# Sottoscrizioni per il listener: carte dei giocatori della galleria (offerta in vendita) e
+# offerte di mercato (una offerta "accepted" è una nuova vendita)
+CARD_UPDATES_SUBSCRIPTION = f"""
+    subscription OnCardUpdated($playerSlugs: [String!]) {{
+        aCardWasUpdated(playerSlugs: $playerSlugs) {{
+            ... on Card {{ slug rarity player {{ slug }} {PRICE_FRAGMENT} }}
+        }}
+    }}
+"""
+
+OFFER_UPDATES_SUBSCRIPTION = """
+    subscription OnOfferUpdated {
+        tokenOfferWasUpdated(sports: [FOOTBALL]) {
+            status
+            senderSide { anyCards { ... on Card { slug rarity player { slug } } } }
         }
     }
 """
 
+PROJECTION_FIELDS = "projection { grade score reliabilityBasisPoints } anyPlayerGameStats { ... on PlayerGameStats { footballPlayingStatusOdds { starterOddsBasisPoints } } }"
+
+PROJECTION_QUERY = f"""
+    query GetProjection($playerSlug: String!, $gameId: ID!) {{
+        football {{
+            player(slug: $playerSlug) {{
+                playerGameScore(gameId: $gameId) {{ {PROJECTION_FIELDS} }}
+            }}
+        }}
+    }}
+"""
+
+# Watchlist: colonne di Foglio1 riusate (stesse selezioni giocatore della query carta) e colonne vendite
+WATCHLIST_CARD_COLUMNS = ["Player API Slug", "Player Name", "Position", "FLOOR CLASSIC LIMITED", "FLOOR CLASSIC RARE", "FLOOR CLASSIC SR", "FLOOR IN SEASON LIMITED", "FLOOR IN SEASON RARE", "FLOOR IN SEASON SR", "L5 So5 (%)", "L15 So5 (%)", "Avg So5 Score (5)", "Avg So5 Score (15)", "Partita", "Data Prossima Partita", "Next Game API ID"] + PROJECTION_COLUMNS + ["Infortunio", "Squalifica"]
+WATCHLIST_SALES_COLUMNS = [header.format(label) for label in WATCHLIST_RARITIES.values() for header in ("Last Sale {} (EUR)", "Avg Sale {} (EUR)", "Sales 7d {}")]
+WATCHLIST_HEADERS = WATCHLIST_CARD_COLUMNS + WATCHLIST_SALES_COLUMNS + ["Sales Updated At", "Ultimo Aggiornamento"]
+
+def build_watchlist_players_query(count):
+    """Query con alias p0..pN-1 con le selezioni giocatore di tutti i tier usate dalla watchlist."""
+    fields = " ".join(player_selections(CARD_TIER_NAMES, (ENABLED_COLUMNS | {"Player Name"}).intersection(WATCHLIST_CARD_COLUMNS)))
+    variable_defs = ", ".join(f"$p{i}: String!" for i in range(count))
+    aliases = " ".join(f"p{i}: player(slug: $p{i}) {{ slug {fields} }}" for i in range(count))
+    return f"query GetWatchlistPlayers({variable_defs}) {{ football {{ {aliases} }} }}"
+
+def build_projections_query(count):
+    """Proiezioni di più giocatori (coppie giocatore/partita $pI, $gI) in una sola richiesta."""
+    variable_defs = ", ".join(f"$p{i}: String!, $g{i}: ID!" for i in range(count))
+    aliases = " ".join(f"p{i}: player(slug: $p{i}) {{ playerGameScore(gameId: $g{i}) {{ {PROJECTION_FIELDS} }} }}" for i in range(count))
+    return f"query GetProjections({variable_defs}) {{ football {{ {aliases} }} }}"
+
+def build_token_prices_query(count):
+    """tokenPrices di più coppie giocatore/rarità ($sI, $rI) in una sola richiesta."""
+    variable_defs = ", ".join(["$limit: Int!"] + [f"$s{i}: String!, $r{i}: Rarity!" for i in range(count)])
+    aliases = " ".join(f"s{i}: tokenPrices(playerSlug: $s{i}, rarity: $r{i}, first: $limit, includePrivateSales: true) {{ {TOKEN_PRICE_FIELDS} }}" for i in range(count))
+    return f"query GetTokenPricesBatch({variable_defs}) {{ tokens {{ {aliases} }} }}"
+
 # --- 3. FUNZIONI HELPER ---
-def load_state():
+ACTIVE_TARGET_KEY = None
+SHARED_CACHE = {}
+# Risorse tenute "calde" per tutta la vita del processo (fondamentali in modalità daemon)
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.mount("https://", requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=16))
+SHEETS_CLIENT = None
+SHEETS_CREDENTIALS = None
+SHEETS_SESSION = None
+SPREADSHEETS = {}
+WORKSHEETS = {}
+SHEET_SNAPSHOTS = {}
+SHUTDOWN_EVENT = threading.Event()
+
+def strip_continuations(state_data):
+    for data in [state_data] + list(state_data.get('targets', {}).values()):
+        for key in [key for key in data if key.endswith('_continuation')]:
+            del data[key]
+    return state_data
+
+def load_state_file():
     try:
         with open(STATE_FILE, "r") as f: 
             return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError): 
+    except FileNotFoundError:
+        if STATE_FILE != DEFAULT_STATE_FILE:
+            # Primo avvio di uno shard: parte dallo stato comune, senza le sue continuazioni
+            try:
+                with open(DEFAULT_STATE_FILE, "r") as f:
+                    return strip_continuations(json.load(f))
+            except (FileNotFoundError, json.JSONDecodeError):
+                pass
+        return {}
+    except json.JSONDecodeError: 
         return {}
 
-def save_state(state_data):
+def load_state():
+    """Ritorna lo stato del target attivo (o l'intero file in modalità singolo utente)."""
+    state_data = load_state_file()
+    if ACTIVE_TARGET_KEY:
+        return state_data.get('targets', {}).get(ACTIVE_TARGET_KEY, {})
+    return state_data
+
+def save_state_file(state_data):
     with open(STATE_FILE, "w") as f: 
         json.dump(state_data, f, indent=2)
 
+def save_state(state_data):
+    if ACTIVE_TARGET_KEY:
+        root_state = load_state_file()
+        root_state.setdefault('targets', {})[ACTIVE_TARGET_KEY] = state_data
+        state_data = root_state
+    save_state_file(state_data)
+
+def journal_path(job):
+    suffix = f"_{hashlib.sha1(ACTIVE_TARGET_KEY.encode()).hexdigest()[:10]}" if ACTIVE_TARGET_KEY else ""
+    if SHARD_COUNT > 1:
+        suffix += f"_shard{SHARD_INDEX}of{SHARD_COUNT}"
+    return os.path.join(JOURNAL_DIR, f"{job}{suffix}.jsonl")
+
+def load_journal(job):
+    """
+    Rilegge il journal di una sessione interrotta (crash, kill, eccezione): ritorna
+    {chiave: dati} degli elementi già completati. Un'ultima riga troncata viene ignorata.
+    """
+    completed = {}
+    try:
+        with open(journal_path(job), "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                completed.update(entry.get('items', {}))
+    except FileNotFoundError:
+        pass
+    if completed:
+        print(f"Journal '{job}': {len(completed)} elementi già completati da una sessione interrotta.")
+    return completed
+
+def journal_append(job, items):
+    """Registra subito su disco gli elementi completati (o il batch appena scritto): {chiave: dati}."""
+    if not items:
+        return
+    os.makedirs(JOURNAL_DIR, exist_ok=True)
+    with open(journal_path(job), "a") as f:
+        f.write(json.dumps({"at": time.time(), "items": items}) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+def compact_journal(job):
+    """A fine sessione (o dopo il salvataggio della continuazione) i progressi sono nello stato."""
+    try:
+        os.remove(journal_path(job))
+    except FileNotFoundError:
+        pass
+
+ITEM_ERROR_KINDS = ("unprocessable", "graphql", "empty")
+LAST_FETCH_ERROR = threading.local()
+
+def response_error(data, has_payload=True):
+    """
+    Tipo di errore di una risposta di sorare_graphql_fetch, None se valida.
+    "unprocessable", "graphql" ed "empty" riguardano il singolo elemento; "http" e "network" no.
+    """
+    if data is None:
+        return getattr(LAST_FETCH_ERROR, 'kind', None) or "network"
+    if data.get("errors"):
+        return "graphql"
+    if not has_payload:
+        return "empty"
+    return None
+
+def item_retry_blocked(state, job, key, now=None):
+    """True se l'elemento è in backoff dopo un errore o in dead-letter in attesa del prossimo tentativo."""
+    now = now or time.time()
+    dead = state.get('dead_letter', {}).get(job, {}).get(key)
+    if dead:
+        return now < dead['failed_at'] + DEAD_LETTER_RETRY_DAYS * 86400
+    failure = state.get('item_failures', {}).get(job, {}).get(key)
+    return bool(failure) and now < failure['next_retry']
+
+def record_item_failure(state, job, key, reason, breaker=None):
+    """Conta un errore dell'elemento: backoff raddoppiato a ogni errore, dead-letter dopo DEAD_LETTER_AFTER_FAILURES."""
+    failures = state.setdefault('item_failures', {}).setdefault(job, {})
+    dead_letter = state.setdefault('dead_letter', {}).setdefault(job, {})
+    previous_failure, previous_dead = failures.get(key), dead_letter.get(key)
+    if breaker is not None:
+        breaker['streak'].append((job, key, previous_failure, previous_dead))
+    now = time.time()
+    count = (previous_dead or previous_failure or {}).get('count', 0) + 1
+    backoff = min(FAILURE_BACKOFF_BASE_MINUTES * 60 * 2 ** (count - 1), FAILURE_BACKOFF_MAX_HOURS * 3600)
+    entry = {"count": count, "reason": reason, "failed_at": now, "next_retry": now + backoff}
+    if previous_dead or count >= DEAD_LETTER_AFTER_FAILURES:
+        failures.pop(key, None)
+        dead_letter[key] = entry
+        if not previous_dead:
+            print(f"  ☠️ {key}: {count} errori consecutivi ({reason}), spostato in dead-letter.")
+    else:
+        failures[key] = entry
+        print(f"  ⚠️ {key}: errore {count} ({reason}), nuovo tentativo tra {backoff / 60:.0f} min.")
+
+def record_item_success(state, job, key):
+    state.get('item_failures', {}).get(job, {}).pop(key, None)
+    state.get('dead_letter', {}).get(job, {}).pop(key, None)
+
+def prune_item_failures(state, job, active_keys):
+    """Gli elementi usciti dalla galleria non restano nel tracciamento errori."""
+    for bucket in (state.get('item_failures', {}).get(job, {}), state.get('dead_letter', {}).get(job, {})):
+        for stale_key in [key for key in bucket if key not in active_keys]:
+            del bucket[stale_key]
+
+def dead_letter_summary(state, job, limit=10):
+    """Riga per la notifica Telegram con gli elementi in dead-letter del job (vuota se non ce ne sono)."""
+    dead_letter = state.get('dead_letter', {}).get(job, {})
+    if not dead_letter:
+        return ""
+    names = ", ".join(sorted(dead_letter)[:limit]) + (", ..." if len(dead_letter) > limit else "")
+    return f"\\n☠️ Dead-letter: {len(dead_letter)} ({names})"
+
+def new_circuit_breaker():
+    return {"attempts": 0, "failures": 0, "consecutive": 0, "streak": [], "tripped": False}
+
+def circuit_breaker_record(breaker, state, error):
+    """
+    Registra l'esito di una richiesta. Con troppi errori consecutivi (o una quota di errori
+    troppo alta) il breaker scatta: il problema è di Sorare, non degli elementi, quindi
+    gli errori della serie in corso non contano per il backoff dei singoli elementi.
+    """
+    breaker['attempts'] += 1
+    if not error:
+        breaker['consecutive'], breaker['streak'] = 0, []
+        return False
+    breaker['failures'] += 1
+    breaker['consecutive'] += 1
+    if breaker['tripped']:
+        return True
+    if breaker['consecutive'] >= CIRCUIT_BREAKER_CONSECUTIVE_FAILURES or (
+            breaker['attempts'] >= CIRCUIT_BREAKER_MIN_ATTEMPTS and breaker['failures'] / breaker['attempts'] >= CIRCUIT_BREAKER_FAILURE_RATIO):
+        breaker['tripped'] = True
+        for job, key, previous_failure, previous_dead in reversed(breaker['streak']):
+            for bucket, previous in (('item_failures', previous_failure), ('dead_letter', previous_dead)):
+                entries = state.setdefault(bucket, {}).setdefault(job, {})
+                if previous is None:
+                    entries.pop(key, None)
+                else:
+                    entries[key] = previous
+        print(f"🛑 Circuit breaker: {breaker['failures']} errori su {breaker['attempts']} richieste ({breaker['consecutive']} consecutivi). Sessione interrotta.")
+    return breaker['tripped']
+
+API_CALL_COUNTS = collections.Counter()
+API_CALL_LOCK = threading.Lock()
+
+def count_api_call(kind):
+    with API_CALL_LOCK:
+        API_CALL_COUNTS[kind] += 1
+
+def start_cost_measure():
+    """Punto di partenza della misura dei costi di uno stage (da chiamare quando gli elementi sono noti)."""
+    with API_CALL_LOCK:
+        return time.time(), dict(API_CALL_COUNTS)
+
+def record_run_costs(state, stage, items, measure):
+    """Aggiorna in state['run_costs'] i costi per elemento dello stage con la misura appena conclusa."""
+    if not items:
+        return
+    started_at, counts_before = measure
+    with API_CALL_LOCK:
+        sample = {
+            "seconds": (time.time() - started_at) / items,
+            "sorare_requests": (API_CALL_COUNTS["sorare"] - counts_before.get("sorare", 0)) / items,
+            "sheets_writes": (API_CALL_COUNTS["sheets_writes"] - counts_before.get("sheets_writes", 0)) / items,
+        }
+    costs = state.setdefault('run_costs', {}).setdefault(stage, {})
+    for name, value in sample.items():
+        previous = costs.get(name)
+        costs[name] = round(value if previous is None else previous + RUN_COST_SMOOTHING * (value - previous), 4)
+    costs['runs'] = costs.get('runs', 0) + 1
+    costs['last_items'] = items
+    costs['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def parse_shard_argument(args):
+    """Legge --shard i/N (o --shard=i/N) dalla riga di comando; None se assente."""
+    for position, arg in enumerate(args):
+        value = None
+        if arg == "--shard" and position + 1 < len(args):
+            value = args[position + 1]
+        elif arg.startswith("--shard="):
+            value = arg.split("=", 1)[1]
+        if value is not None:
+            try:
+                index, count = (int(part) for part in value.split("/"))
+            except ValueError:
+                raise ValueError(f"--shard deve essere nel formato i/N, non '{value}'")
+            if count < 1 or not 0 <= index < count:
+                raise ValueError(f"--shard {value}: serve 0 <= i < N")
+            return index, count
+    return None
+
+def use_shard(index, count):
+    """Attiva lo shard: stato e journal separati, quota di scrittura divisa per N."""
+    global SHARD_INDEX, SHARD_COUNT, STATE_FILE
+    SHARD_INDEX, SHARD_COUNT = index, count
+    STATE_FILE = f"state.shard{index}of{count}.json"
+    print(f"Modalità shard {index}/{count}: stato in {STATE_FILE}")
+
+def in_shard(player_slug):
+    """
+    Partizione deterministica per hash dello slug giocatore: carte e coppie dello stesso
+    giocatore finiscono nello stesso shard (cache condivisa) e le righe non si sovrappongono.
+    """
+    if SHARD_COUNT == 1:
+        return True
+    return int(hashlib.md5(str(player_slug).encode()).hexdigest()[:8], 16) % SHARD_COUNT == SHARD_INDEX
+
+SHEET_WRITE_TIMES = collections.deque()
+SHEET_WRITE_LOCK = threading.Lock()
+
+def throttle_sheet_write():
+    """
+    Budget di scrittura per minuto (finestra mobile di 60 secondi): gli N shard insieme
+    restano entro SHEETS_WRITES_PER_MINUTE; quando il budget è esaurito si attende.
+    """
+    budget = max(1, SHEETS_WRITES_PER_MINUTE // SHARD_COUNT)
+    with SHEET_WRITE_LOCK:
+        while True:
+            now = time.time()
+            while SHEET_WRITE_TIMES and now - SHEET_WRITE_TIMES[0] >= 60:
+                SHEET_WRITE_TIMES.popleft()
+            if len(SHEET_WRITE_TIMES) < budget:
+                break
+            time.sleep(60 - (now - SHEET_WRITE_TIMES[0]))
+        SHEET_WRITE_TIMES.append(time.time())
+
+def sheets_write(function, *args, **kwargs):
+    """
+    Governatore delle scritture: ogni chiamata Sheets che modifica qualcosa passa da qui.
+    Consuma il budget per minuto e ritenta gli errori di quota (429) e temporanei con backoff.
+    """
+    count_api_call("sheets_writes")
+    for attempt in range(SHEETS_WRITE_MAX_RETRIES + 1):
+        throttle_sheet_write()
+        try:
+            return function(*args, **kwargs)
+        except gspread.exceptions.APIError as e:
+            status = getattr(e.response, 'status_code', None)
+            if status not in SHEETS_RETRY_STATUS_CODES or attempt == SHEETS_WRITE_MAX_RETRIES:
+                raise
+            delay = SHEETS_RETRY_BASE_SECONDS * 2 ** attempt
+            print(f"Sheets ha risposto {status}: nuovo tentativo tra {delay}s ({attempt + 1}/{SHEETS_WRITE_MAX_RETRIES})...")
+            time.sleep(delay)
+
+def coalesce_ranges(updates):
+    """
+    Unisce gli aggiornamenti di righe adiacenti (stessa colonna iniziale e stessa larghezza)
+    in un unico range: meno range per batch_update e payload più compatti.
+    """
+    blocks = []
+    for update in sorted(updates, key=lambda u: gspread.utils.a1_to_rowcol(u['range'].split(':')[0])):
+        row, col = gspread.utils.a1_to_rowcol(update['range'].split(':')[0])
+        width = len(update['values'][0])
+        last = blocks[-1] if blocks else None
+        if last and last['col'] == col and last['width'] == width and last['row'] + len(last['values']) == row:
+            last['values'].extend(update['values'])
+        else:
+            blocks.append({'row': row, 'col': col, 'width': width, 'values': list(update['values'])})
+    return [{'range': f"{gspread.utils.rowcol_to_a1(block['row'], block['col'])}:{gspread.utils.rowcol_to_a1(block['row'] + len(block['values']) - 1, block['col'] + block['width'] - 1)}", 'values': block['values']} for block in blocks]
+
+def sheets_batch_update(sheet, updates, **kwargs):
+    return sheets_write(sheet.batch_update, coalesce_ranges(updates), **kwargs)
+
+def appended_row_indices(response, count):
+    """Righe scritte da append_rows (da updates.updatedRange della risposta), o None se la risposta non le riporta."""
+    updated_range = ((response or {}).get('updates') or {}).get('updatedRange')
+    if not updated_range:
+        return None
+    first_row = gspread.utils.a1_to_rowcol(updated_range.split('!')[-1].split(':')[0])[0]
+    return list(range(first_row, first_row + count))
+
+def contiguous_row_blocks(row_indices):
+    """Righe da eliminare raggruppate in blocchi contigui (start, end), dal basso verso l'alto."""
+    blocks = []
+    for row_index in sorted(set(row_indices), reverse=True):
+        if blocks and blocks[-1][0] == row_index + 1:
+            blocks[-1][0] = row_index
+        else:
+            blocks.append([row_index, row_index])
+    return [tuple(block) for block in blocks]
+
+def load_targets():
+    """Legge la lista dei target (user slug, spreadsheet) dalla variabile TARGETS."""
+    if not TARGETS_JSON or not TARGETS_JSON.strip():
+        return []
+    try:
+        targets = json.loads(TARGETS_JSON)
+    except json.JSONDecodeError as e:
+        print(f"ERRORE: TARGETS non è un JSON valido: {e}")
+        return []
+    if not isinstance(targets, list):
+        print("ERRORE: TARGETS deve essere una lista JSON di oggetti {\"user_slug\", \"spreadsheet_id\"}.")
+        return []
+    valid_targets = []
+    for target in targets:
+        if isinstance(target, dict) and target.get('user_slug') and target.get('spreadsheet_id'):
+            valid_targets.append(target)
+        else:
+            print(f"AVVISO: target non valido ignorato (servono user_slug e spreadsheet_id): {target!r}")
+    return valid_targets
+
+def use_target(target):
+    """Attiva un target: utente, foglio e stato di continuazione dedicato."""
+    global USER_SLUG, SPREADSHEET_ID, ACTIVE_TARGET_KEY
+    USER_SLUG, SPREADSHEET_ID = target['user_slug'], target['spreadsheet_id']
+    ACTIVE_TARGET_KEY = f"{USER_SLUG}@{SPREADSHEET_ID}"
+
+def run_for_targets(function):
+    """Esegue la funzione per ogni target configurato, o una volta sola senza TARGETS."""
+    global USER_SLUG, SPREADSHEET_ID, ACTIVE_TARGET_KEY
+    targets = load_targets()
+    if not targets and TARGETS_JSON and TARGETS_JSON.strip():
+        # TARGETS configurato ma senza voci valide: nessun ripiego su USER_SLUG/SPREADSHEET_ID
+        print("ERRORE: nessun target valido in TARGETS, esecuzione annullata.")
+        return
+    if not targets:
+        function()
+        flush_output_sinks()
+        flush_timeseries()
+        return
+    default_target = (USER_SLUG, SPREADSHEET_ID, ACTIVE_TARGET_KEY)
+    try:
+        for target in targets:
+            print(f"=== TARGET: {target['user_slug']} ({target['spreadsheet_id']}) ===")
+            use_target(target)
+            try:
+                function()
+            except Exception as e:
+                print(f"ERRORE durante l'esecuzione per {target['user_slug']}: {e}")
+            flush_output_sinks()
+            flush_timeseries()
+    finally:
+        USER_SLUG, SPREADSHEET_ID, ACTIVE_TARGET_KEY = default_target
+
+def shared_cache_get(namespace, key):
+    """Cache di processo per i dati a livello giocatore, condivisa tra tutti i target."""
+    entry = SHARED_CACHE.get((namespace, key))
+    if entry and time.time() - entry[0] < SHARED_CACHE_TTL_SECONDS:
+        return entry[1]
+    return None
+
+def shared_cache_set(namespace, key, value):
+    SHARED_CACHE[(namespace, key)] = (time.time(), value)
+
+def stop_requested():
+    """True quando il daemon ha ricevuto un segnale di arresto: i job salvano la continuazione ed escono."""
+    return SHUTDOWN_EVENT.is_set()
+
+# Spreadsheet e Worksheet ricostruiti dai metadati salvati usano il costruttore interno di gspread 6
+# (requirements.txt fissa gspread>=6,<7): con un'altra versione si usa solo l'API pubblica
+GSPREAD_RESTORE_SUPPORTED = gspread.__version__.split('.')[0] == '6'
+
+def restore_spreadsheet(spreadsheet_id, title):
+    """Spreadsheet senza la lettura dei metadati che Spreadsheet() farebbe sempre (solo gspread 6)."""
+    spreadsheet = gspread.Spreadsheet.__new__(gspread.Spreadsheet)
+    spreadsheet.client = SHEETS_CLIENT.http_client
+    spreadsheet._properties = {"id": spreadsheet_id, "title": title}
+    return spreadsheet
+
+def restore_worksheet(spreadsheet, properties):
+    return gspread.Worksheet(spreadsheet, properties, spreadsheet.id, spreadsheet.client)
+
+def worksheet_properties(worksheet):
+    return dict(worksheet._properties) if GSPREAD_RESTORE_SUPPORTED else None
+
+def load_sheets_session():
+    global SHEETS_SESSION
+    if SHEETS_SESSION is None:
+        try:
+            with open(SHEETS_SESSION_FILE, "r") as f:
+                SHEETS_SESSION = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            SHEETS_SESSION = {}
+        SHEETS_SESSION.setdefault('spreadsheets', {})
+    return SHEETS_SESSION
+
+def save_sheets_session():
+    """Salva token e metadati; le dimensioni vengono rilette dai worksheet aperti (resize inclusi)."""
+    if SHEETS_SESSION is None:
+        return
+    # Su GitHub Actions il file finisce in actions/cache, leggibile da altri workflow: niente token
+    if SHEETS_CREDENTIALS is not None and SHEETS_CREDENTIALS.token and SHEETS_CREDENTIALS.expiry and os.environ.get("GITHUB_ACTIONS") != "true":
+        SHEETS_SESSION['token'] = SHEETS_CREDENTIALS.token
+        SHEETS_SESSION['expiry'] = SHEETS_CREDENTIALS.expiry.isoformat()
+        SHEETS_SESSION['client_email'] = SHEETS_CREDENTIALS.service_account_email
+    for (spreadsheet_id, title), worksheet in WORKSHEETS.items():
+        entry = SHEETS_SESSION['spreadsheets'].get(spreadsheet_id, {}).get('worksheets', {}).get(title)
+        if entry is not None:
+            entry['properties'] = worksheet_properties(worksheet)
+    try:
+        with open(SHEETS_SESSION_FILE, "w") as f:
+            json.dump(SHEETS_SESSION, f, indent=2)
+    except OSError as e:
+        print(f"Impossibile salvare la sessione Sheets: {e}")
+
+atexit.register(save_sheets_session)
+
+def open_spreadsheet(spreadsheet_id=None):
+    """
+    Client Sheets e spreadsheet aperti una sola volta per processo. Il token OAuth salvato
+    viene riusato finché non scade; uno spreadsheet già visto si apre senza leggere i metadati.
+    """
+    global SHEETS_CLIENT, SHEETS_CREDENTIALS
+    spreadsheet_id = spreadsheet_id or SPREADSHEET_ID
+    session = load_sheets_session()
+    if SHEETS_CLIENT is None:
+        info = json.loads(GSPREAD_CREDENTIALS_JSON)
+        SHEETS_CREDENTIALS = Credentials.from_service_account_info(info, scopes=gspread.auth.DEFAULT_SCOPES)
+        if session.get('token') and session.get('client_email') == info.get('client_email'):
+            SHEETS_CREDENTIALS.token = session['token']
+            SHEETS_CREDENTIALS.expiry = datetime.fromisoformat(session['expiry'])
+        SHEETS_CLIENT = gspread.Client(auth=SHEETS_CREDENTIALS)
+    if spreadsheet_id not in SPREADSHEETS:
+        cached = session['spreadsheets'].get(spreadsheet_id)
+        if GSPREAD_RESTORE_SUPPORTED and cached and time.time() - cached.get('cached_at', 0) < SHEETS_METADATA_MAX_AGE_HOURS * 3600:
+            spreadsheet = restore_spreadsheet(spreadsheet_id, cached.get('title', ''))
+        else:
+            spreadsheet = SHEETS_CLIENT.open_by_key(spreadsheet_id)
+            session['spreadsheets'][spreadsheet_id] = {"title": spreadsheet.title, "cached_at": time.time(), "worksheets": {}}
+        SPREADSHEETS[spreadsheet_id] = spreadsheet
+    return SPREADSHEETS[spreadsheet_id]
+
+def remember_worksheet(spreadsheet, worksheet):
+    WORKSHEETS[(spreadsheet.id, worksheet.title)] = worksheet
+    cached = load_sheets_session()['spreadsheets'].setdefault(spreadsheet.id, {"title": spreadsheet.title, "cached_at": time.time(), "worksheets": {}})
+    cached['worksheets'][worksheet.title] = {"properties": worksheet_properties(worksheet), "header_hash": None}
+    return worksheet
+
+def open_worksheet(spreadsheet, title):
+    """Worksheet per titolo: aperto tramite l'ID salvato, senza leggere i metadati."""
+    key = (spreadsheet.id, title)
+    if key not in WORKSHEETS:
+        cached = load_sheets_session()['spreadsheets'].get(spreadsheet.id, {}).get('worksheets', {}).get(title)
+        if cached and cached.get('properties') and GSPREAD_RESTORE_SUPPORTED:
+            WORKSHEETS[key] = restore_worksheet(spreadsheet, cached['properties'])
+        else:
+            remember_worksheet(spreadsheet, spreadsheet.worksheet(title))
+    return WORKSHEETS[key]
+
+def ensure_header_row(worksheet, headers, rewrite=True):
+    """
+    Scrive gli header in grassetto solo se l'hash salvato non corrisponde. Con rewrite=False
+    una prima riga già presente non viene toccata (viene solo letta).
+    """
+    expected_hash = hashlib.sha1(json.dumps(headers).encode()).hexdigest()
+    cached = load_sheets_session()['spreadsheets'].get(worksheet.spreadsheet_id, {}).get('worksheets', {}).get(worksheet.title)
+    if cached and cached.get('header_hash') == expected_hash:
+        return
+    current = worksheet.row_values(1)
+    if not current or (rewrite and current != headers):
+        sheets_write(worksheet.update, range_name='A1', values=[headers])
+        sheets_write(worksheet.format, f'A1:{gspread.utils.rowcol_to_a1(1, len(headers))}', {'textFormat': {'bold': True}})
+        current = headers
+    if cached is not None:
+        cached['header_hash'] = hashlib.sha1(json.dumps(current).encode()).hexdigest()
+
+def forget_worksheet(spreadsheet, title):
+    WORKSHEETS.pop((spreadsheet.id, title), None)
+    SHEET_SNAPSHOTS.pop((spreadsheet.id, title), None)
+    load_sheets_session()['spreadsheets'].get(spreadsheet.id, {}).get('worksheets', {}).pop(title, None)
+
+def reset_sheets_cache():
+    """Dopo un errore i riferimenti potrebbero essere obsoleti: si riparte da zero (il token resta valido)."""
+    global SHEETS_CLIENT
+    SHEETS_CLIENT = None
+    SPREADSHEETS.clear()
+    WORKSHEETS.clear()
+    SHEET_SNAPSHOTS.clear()
+    load_sheets_session()['spreadsheets'].clear()
+
+def read_sheet_records(sheet):
+    """
+    get_all_records() con snapshot in memoria: entro SHEET_SNAPSHOT_TTL_SECONDS le letture
+    successive non toccano l'API. Ritorna copie, così i chiamanti possono modificarle.
+    """
+    key = (sheet.spreadsheet.id, sheet.title)
+    snapshot = SHEET_SNAPSHOTS.get(key)
+    if snapshot and time.time() - snapshot[0] < SHEET_SNAPSHOT_TTL_SECONDS:
+        records = snapshot[1]
+    else:
+        try:
+            records = sheet.get_all_records()
+        except gspread.exceptions.APIError:
+            # L'ID salvato potrebbe non esistere più: alla prossima apertura si rileggono i metadati
+            forget_worksheet(sheet.spreadsheet, sheet.title)
+            raise
+        SHEET_SNAPSHOTS[key] = (time.time(), records)
+    return [dict(record) for record in records]
+
+def patch_sheet_snapshot(sheet, row_index, values_by_header):
+    """Applica allo snapshot una riga appena scritta sul foglio."""
+    snapshot = SHEET_SNAPSHOTS.get((sheet.spreadsheet.id, sheet.title))
+    if snapshot and 0 <= row_index - 2 < len(snapshot[1]):
+        snapshot[1][row_index - 2].update(values_by_header)
+
+def invalidate_sheet_snapshot(sheet):
+    """Da chiamare dopo inserimenti o cancellazioni di righe."""
+    SHEET_SNAPSHOTS.pop((sheet.spreadsheet.id, sheet.title), None)
+
+def current_row_positions(sheet):
+    """
+    Righe attuali delle carte, rilette dalla sola colonna Slug: lo snapshot può avere fino a
+    SHEET_SNAPSHOT_TTL_SECONDS e sync_galleria (processo separato) cancella e aggiunge righe.
+    Se le posizioni non coincidono più con lo snapshot lo invalida. Ritorna {slug: indice riga}.
+    """
+    slugs = sheet.col_values(MAIN_SHEET_HEADERS.index("Slug") + 1)[1:]
+    snapshot = SHEET_SNAPSHOTS.get((sheet.spreadsheet.id, sheet.title))
+    if snapshot and [str(record.get('Slug', '')) for record in snapshot[1]] != slugs:
+        invalidate_sheet_snapshot(sheet)
+    return {slug: i + 2 for i, slug in enumerate(slugs) if slug}
+
+def columns_range(row_index, headers):
+    """Range A1 di una riga per un blocco di colonne contigue di MAIN_SHEET_HEADERS."""
+    first, last = MAIN_SHEET_HEADERS.index(headers[0]) + 1, MAIN_SHEET_HEADERS.index(headers[-1]) + 1
+    return f"{gspread.utils.rowcol_to_a1(row_index, first)}:{gspread.utils.rowcol_to_a1(row_index, last)}"
+
+# --- Sink di output locali (SQLite, CSV, Parquet) ---
+# Ogni dataset ha una modalità: "upsert" per chiave (aggiorna solo le colonne presenti nella riga),
+# "append" (righe storiche) o "replace" (l'insieme completo di un target a ogni scrittura)
+SINK_DATASETS = {
+    "cards": ("upsert", ["Target", "Slug"]),
+    "sales": ("upsert", ["Target", "Player API Slug", "Rarity Searched"]),
+    "sales_ledger": ("append", None),
+    "sales_summary": ("upsert", ["Target", "Player API Slug", "Rarity Searched"]),
+    "lineups": ("replace", ["Target"]),
+    "charts": ("replace", ["Target"]),
+    "watchlist": ("upsert", ["Target", "Player API Slug"]),
+}
+
+def local_value(value):
+    """I sink locali ricevono numeri veri: niente stringhe "12.50 EUR" né celle vuote."""
+    if value == "":
+        return None
+    if isinstance(value, str) and value.endswith(" EUR"):
+        try:
+            return float(value[:-4])
+        except ValueError:
+            return value
+    return value
+
+class OutputSink:
+    """Accumula le righe per dataset e le scrive a blocchi di batch_rows (flush_dataset nelle sottoclassi)."""
+
+    def __init__(self, batch_rows=SINK_BATCH_ROWS):
+        self.batch_rows = batch_rows
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def write(self, dataset, rows, replace_target=None):
+        with self.lock:
+            batch = self.pending.setdefault(dataset, {"rows": [], "replace": set()})
+            if replace_target is not None:
+                batch["rows"] = [row for row in batch["rows"] if row.get("Target") != replace_target]
+                batch["replace"].add(replace_target)
+            batch["rows"].extend(rows)
+            if len(batch["rows"]) >= self.batch_rows:
+                self.flush_dataset(dataset)
+
+    def flush(self):
+        with self.lock:
+            for dataset in list(self.pending):
+                self.flush_dataset(dataset)
+
+class SqliteSink(OutputSink):
+    """Una tabella per dataset; le colonne nuove vengono aggiunte al primo utilizzo."""
+
+    def __init__(self, path, batch_rows=SINK_BATCH_ROWS):
+        super().__init__(batch_rows)
+        self.path = path
+        self.connection = None
+
+    def ensure_table(self, dataset, columns):
+        mode, key_columns = SINK_DATASETS[dataset]
+        if mode == "upsert":
+            definitions = ", ".join(f'"{column}"' for column in key_columns)
+            self.connection.execute(f'CREATE TABLE IF NOT EXISTS "{dataset}" ({definitions}, PRIMARY KEY ({definitions}))')
+        else:
+            self.connection.execute(f'CREATE TABLE IF NOT EXISTS "{dataset}" ("Target")')
+        existing = {row[1] for row in self.connection.execute(f'PRAGMA table_info("{dataset}")')}
+        for column in columns:
+            if column not in existing:
+                self.connection.execute(f'ALTER TABLE "{dataset}" ADD COLUMN "{column}"')
+
+    def flush_dataset(self, dataset):
+        batch = self.pending.pop(dataset, None)
+        if not batch or not (batch["rows"] or batch["replace"]):
+            return
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        mode, key_columns = SINK_DATASETS[dataset]
+        # Righe parziali: un INSERT per ogni insieme di colonne
+        by_columns = {}
+        for row in batch["rows"]:
+            by_columns.setdefault(tuple(row), []).append(row)
+        with self.connection:
+            self.ensure_table(dataset, dict.fromkeys(column for columns in by_columns for column in columns))
+            for target in batch["replace"]:
+                self.connection.execute(f'DELETE FROM "{dataset}" WHERE "Target" = ?', (target,))
+            for columns, rows in by_columns.items():
+                names = ", ".join(f'"{column}"' for column in columns)
+                statement = f'INSERT INTO "{dataset}" ({names}) VALUES ({", ".join("?" for _ in columns)})'
+                updates = [column for column in columns if column not in key_columns] if mode == "upsert" else []
+                if updates:
+                    conflict = ", ".join(f'"{column}"' for column in key_columns)
+                    statement += f' ON CONFLICT ({conflict}) DO UPDATE SET ' + ", ".join(f'"{column}" = excluded."{column}"' for column in updates)
+                elif mode == "upsert":
+                    statement = statement.replace("INSERT INTO", "INSERT OR IGNORE INTO", 1)
+                self.connection.executemany(statement, [[local_value(row[column]) for column in columns] for row in rows])
+
+class FileSink(OutputSink):
+    """
+    Un file per dataset in directory (CSV o Parquet). Gli append CSV aggiungono righe in coda;
+    upsert e replace riscrivono il file unendo le righe già presenti (caricate una volta sola).
+    """
+
+    def __init__(self, directory, file_format="csv", batch_rows=SINK_BATCH_ROWS):
+        super().__init__(batch_rows)
+        self.directory, self.file_format = directory, file_format
+        self.loaded = {}
+
+    def path(self, dataset):
+        return os.path.join(self.directory, f"{dataset}.{self.file_format}")
+
+    def read_rows(self, dataset):
+        path = self.path(dataset)
+        if not os.path.exists(path):
+            return []
+        if self.file_format == "parquet":
+            return pyarrow.parquet.read_table(path).to_pylist()
+        with open(path, newline="", encoding="utf-8") as f:
+            return [{key: (value if value != "" else None) for key, value in row.items()} for row in csv.DictReader(f)]
+
+    def write_rows(self, dataset, rows, append=False):
+        columns = list(dict.fromkeys(column for row in rows for column in row))
+        path = self.path(dataset)
+        if self.file_format == "parquet":
+            table = pyarrow.Table.from_pylist([{column: row.get(column) for column in columns} for row in rows])
+            pyarrow.parquet.write_table(table, path)
+            return
+        new_file = not append or not os.path.exists(path)
+        if not new_file:
+            with open(path, newline="", encoding="utf-8") as f:
+                columns = next(csv.reader(f), columns)
+        with open(path, "w" if new_file else "a", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+            if new_file:
+                writer.writeheader()
+            writer.writerows(rows)
+
+    def flush_dataset(self, dataset):
+        batch = self.pending.pop(dataset, None)
+        if not batch or not (batch["rows"] or batch["replace"]):
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        mode, key_columns = SINK_DATASETS[dataset]
+        rows = [{column: local_value(value) for column, value in row.items()} for row in batch["rows"]]
+        if mode == "append":
+            if self.file_format == "csv":
+                self.write_rows(dataset, rows, append=True)
+            else:
+                self.write_rows(dataset, self.read_rows(dataset) + rows)
+            return
+        if dataset not in self.loaded:
+            self.loaded[dataset] = {tuple(row.get(column) for column in key_columns): row for row in self.read_rows(dataset)} if mode == "upsert" else self.read_rows(dataset)
+        if mode == "upsert":
+            merged = self.loaded[dataset]
+            for row in rows:
+                key = tuple(row.get(column) for column in key_columns)
+                merged[key] = {**merged.get(key, {}), **row}
+            self.write_rows(dataset, list(merged.values()))
+        else:
+            self.loaded[dataset] = [row for row in self.loaded[dataset] if row.get("Target") not in batch["replace"]] + rows
+            self.write_rows(dataset, self.loaded[dataset])
+
+class SheetsSink(OutputSink):
+    """
+    Foglio1 come sink del dataset "cards": le righe ({header: valore}, con Slug) si collocano per
+    Slug sulla colonna riletta al flush e si scrivono solo le colonne in columns, a blocchi contigui.
+    Le colonne identità restano quelle scritte da sync_galleria. Il flush lo decide il chiamante
+    (una rilettura della colonna Slug e una batch_update per flush).
+    """
+
+    def __init__(self, sheet, columns):
+        super().__init__(sys.maxsize)
+        self.sheet = sheet
+        self.columns = set(columns) - set(CARD_IDENTITY_COLUMNS)
+
+    def flush_dataset(self, dataset):
+        batch = self.pending.pop(dataset, None)
+        if not batch or not batch["rows"]:
+            return
+        positions = current_row_positions(self.sheet)
+        updates, patched_rows = [], []
+        for row in batch["rows"]:
+            row_index = positions.get(str(row.get("Slug", "")))
+            if not row_index:
+                print(f"AVVISO: carta {row.get('Slug')} non più presente su {self.sheet.title}, riga non scritta.")
+                continue
+            headers = [header for header in MAIN_SHEET_HEADERS if header in row and header in self.columns]
+            block = []
+            for header in headers + [None]:
+                if block and (header is None or MAIN_SHEET_HEADERS.index(header) != MAIN_SHEET_HEADERS.index(block[-1]) + 1):
+                    updates.append({'range': columns_range(row_index, block), 'values': [[row[column] for column in block]]})
+                    block = []
+                if header is not None:
+                    block.append(header)
+            patched_rows.append((row_index, {header: row[header] for header in headers}))
+        if updates:
+            sheets_batch_update(self.sheet, updates, value_input_option='USER_ENTERED')
+        for row_index, values in patched_rows:
+            patch_sheet_snapshot(self.sheet, row_index, values)
+
+def load_output_sinks():
+    """Sink locali da OUTPUT_SINKS (lista JSON); senza configurazione l'unico output resta Google Sheets."""
+    if not OUTPUT_SINKS_JSON or not OUTPUT_SINKS_JSON.strip():
+        return []
+    try:
+        configs = json.loads(OUTPUT_SINKS_JSON)
+    except json.JSONDecodeError as e:
+        print(f"ERRORE: OUTPUT_SINKS non è un JSON valido: {e}")
+        return []
+    sinks = []
+    for config in configs:
+        kind, batch_rows = config.get("type"), int(config.get("batch_rows", SINK_BATCH_ROWS))
+        if kind == "sqlite":
+            sinks.append(SqliteSink(config.get("path", "gestionale.db"), batch_rows))
+        elif kind in ("csv", "parquet"):
+            if kind == "parquet" and pyarrow is None:
+                print("AVVISO: il sink parquet richiede 'pyarrow' (pip install pyarrow), uso CSV.")
+                kind = "csv"
+            sinks.append(FileSink(config.get("dir", "export"), kind, batch_rows))
+        else:
+            print(f"AVVISO: sink di output sconosciuto ignorato: {config}")
+    return sinks
+
+OUTPUT_SINKS = load_output_sinks()
+
+def current_target_key():
+    return ACTIVE_TARGET_KEY or f"{USER_SLUG}@{SPREADSHEET_ID}"
+
+def emit_rows(dataset, rows, target=None):
+    """
+    Invia righe ({header: valore}) a tutti i sink locali; ognuno le accumula e scrive a blocchi
+    per conto suo. Per i dataset "replace" le righe sono l'insieme completo del target.
+    """
+    if not OUTPUT_SINKS:
+        return
+    target = target or current_target_key()
+    rows = [{"Target": target, **row} for row in rows]
+    replace_target = target if SINK_DATASETS[dataset][0] == "replace" else None
+    for sink in OUTPUT_SINKS:
+        try:
+            sink.write(dataset, rows, replace_target)
+        except Exception as e:
+            print(f"Errore sink {type(sink).__name__} ({dataset}): {e}")
+
+def flush_output_sinks():
+    for sink in OUTPUT_SINKS:
+        try:
+            sink.flush()
+        except Exception as e:
+            print(f"Errore flush sink {type(sink).__name__}: {e}")
+
+atexit.register(flush_output_sinks)
+
+# --- Serie storiche locali (floor e prezzi di listino) ---
+# Ogni serie ha tre livelli colonnari: "raw" (un campione per refresh) e i bucket "hourly"/"daily"
+# con media, minimo, massimo, ultimo valore e numero di campioni
+TIMESERIES_LEVELS = {
+    "raw": ("ts", "value"),
+    "hourly": ("ts", "mean", "min", "max", "last", "count"),
+    "daily": ("ts", "mean", "min", "max", "last", "count"),
+}
+TIMESERIES_BUCKET_SECONDS = {"hourly": 3600, "daily": 86400}
+TIMESERIES_TYPECODES = {"ts": "I", "count": "I"}  # le altre colonne sono float32 ("f")
+
+class TimeSeriesStore:
+    """
+    Serie storiche in array compatti (stdlib array), salvate in un unico file: un header JSON
+    con chiavi e lunghezze seguito dai byte di ogni colonna. Il downsampling avviene al salvataggio.
+    Più processi (listener, job da cron, daemon) possono scrivere lo stesso file: il salvataggio
+    rilegge il file sotto lock e unisce i campioni degli altri prima di sostituirlo.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.series = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def empty_series():
+        return {level: {column: array.array(TIMESERIES_TYPECODES.get(column, "f")) for column in columns} for level, columns in TIMESERIES_LEVELS.items()}
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            header = json.loads(f.readline())
+            data = f.read()
+        offset = 0
+        for key, lengths in header["series"]:
+            series = self.empty_series()
+            for level, columns in TIMESERIES_LEVELS.items():
+                for column in columns:
+                    values = series[level][column]
+                    size = lengths[level] * values.itemsize
+                    values.frombytes(data[offset:offset + size])
+                    if header.get("byteorder", sys.byteorder) != sys.byteorder:
+                        values.byteswap()
+                    offset += size
+            self.series[key] = series
+
+    @staticmethod
+    def covered(series, level_name, ts):
+        """Vero se ts ricade in un bucket di un livello più grossolano di series: il campione è già aggregato lì."""
+        levels = list(TIMESERIES_LEVELS)
+        for coarser in levels[levels.index(level_name) + 1:]:
+            bucket = ts - ts % TIMESERIES_BUCKET_SECONDS[coarser]
+            stamps = series[coarser]["ts"]
+            index = bisect.bisect_left(stamps, bucket)
+            if index < len(stamps) and stamps[index] == bucket:
+                return True
+        return False
+
+    def merge(self, other):
+        """
+        Unisce le serie di un altro store: i campioni raw per timestamp (a parità vince il proprio),
+        i bucket orari e giornalieri per timestamp (vince quello con più campioni). Le righe che
+        l'altra parte ha già aggregato in un livello più grossolano non si ripetono.
+        """
+        for key, theirs in other.series.items():
+            mine = self.series.setdefault(key, self.empty_series())
+            merged_series = {}
+            for level_name, columns in TIMESERIES_LEVELS.items():
+                rows = {}
+                for source, counterpart in ((theirs, mine), (mine, theirs)):
+                    for row in zip(*(source[level_name][column] for column in columns)):
+                        if self.covered(counterpart, level_name, row[0]):
+                            continue
+                        existing = rows.get(row[0])
+                        if existing is None or level_name == "raw" or row[-1] >= existing[-1]:
+                            rows[row[0]] = row
+                merged = merged_series[level_name] = self.empty_series()[level_name]
+                for row in sorted(rows.values()):
+                    for column, value in zip(columns, row):
+                        merged[column].append(value)
+            mine.update(merged_series)
+
+    def save(self, now=None):
+        with self.lock:
+            if not self.dirty:
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(f"{self.path}.lock", "w") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                on_disk = TimeSeriesStore(self.path)
+                try:
+                    on_disk.load()
+                except (OSError, ValueError, KeyError, TypeError):
+                    on_disk.series = {}
+                self.merge(on_disk)
+                self.downsample(now)
+                self.write()
+            self.dirty = False
+
+    def write(self):
+        """Scrittura atomica (file temporaneo + os.replace); da chiamare sotto lock."""
+        header = {"version": 1, "byteorder": sys.byteorder, "series": [[key, {level: len(series[level]["ts"]) for level in TIMESERIES_LEVELS}] for key, series in self.series.items()]}
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(json.dumps(header).encode() + b"\n")
+            for series in self.series.values():
+                for level, columns in TIMESERIES_LEVELS.items():
+                    for column in columns:
+                        series[level][column].tofile(f)
+        os.replace(temp_path, self.path)
+
+    def append(self, key, value, timestamp=None):
+        """Aggiunge un campione; entro TIMESERIES_MIN_SPACING_SECONDS dall'ultimo lo sostituisce."""
+        ts = int(timestamp if timestamp is not None else time.time())
+        with self.lock:
+            raw = self.series.setdefault(key, self.empty_series())["raw"]
+            index = bisect.bisect_left(raw["ts"], ts)
+            if index == len(raw["ts"]) and index and ts - raw["ts"][-1] < TIMESERIES_MIN_SPACING_SECONDS:
+                raw["ts"][-1], raw["value"][-1] = ts, value
+            elif index < len(raw["ts"]) and raw["ts"][index] == ts:
+                raw["value"][index] = value
+            else:
+                raw["ts"].insert(index, ts)
+                raw["value"].insert(index, value)
+            self.dirty = True
+
+    @staticmethod
+    def merge_buckets(level, rows, bucket_seconds):
+        """Accumula righe (ts, media, min, max, ultimo, campioni) ordinate nei bucket di level."""
+        columns = TIMESERIES_LEVELS["hourly"]
+        for ts, mean, low, high, last, count in rows:
+            bucket = ts - ts % bucket_seconds
+            if level["ts"] and level["ts"][-1] == bucket:
+                total = level["count"][-1] + count
+                level["mean"][-1] = (level["mean"][-1] * level["count"][-1] + mean * count) / total
+                level["min"][-1], level["max"][-1] = min(level["min"][-1], low), max(level["max"][-1], high)
+                level["last"][-1], level["count"][-1] = last, total
+            else:
+                for column, value in zip(columns, (bucket, mean, low, high, last, count)):
+                    level[column].append(value)
+
+    def downsample(self, now=None):
+        """Campioni più vecchi di TIMESERIES_RAW_HOURS in bucket orari, bucket orari oltre TIMESERIES_HOURLY_DAYS in giornalieri."""
+        now = int(now if now is not None else time.time())
+        raw_cutoff = (now - TIMESERIES_RAW_HOURS * 3600) // 3600 * 3600
+        hourly_cutoff = (now - TIMESERIES_HOURLY_DAYS * 86400) // 86400 * 86400
+        for series in self.series.values():
+            raw, hourly, daily = series["raw"], series["hourly"], series["daily"]
+            count = bisect.bisect_left(raw["ts"], raw_cutoff)
+            if count:
+                self.merge_buckets(hourly, [(ts, value, value, value, value, 1) for ts, value in zip(raw["ts"][:count], raw["value"][:count])], TIMESERIES_BUCKET_SECONDS["hourly"])
+                for column in TIMESERIES_LEVELS["raw"]:
+                    del raw[column][:count]
+            count = bisect.bisect_left(hourly["ts"], hourly_cutoff)
+            if count:
+                self.merge_buckets(daily, zip(*(hourly[column][:count] for column in TIMESERIES_LEVELS["hourly"])), TIMESERIES_BUCKET_SECONDS["daily"])
+                for column in TIMESERIES_LEVELS["hourly"]:
+                    del hourly[column][:count]
+
+    def range_rows(self, key, start=None, end=None):
+        """Righe (ts, media, min, max, ultimo) nell'intervallo, dal livello giornaliero al raw, in ordine di tempo."""
+        series = self.series.get(key)
+        if not series:
+            return []
+        rows = []
+        with self.lock:
+            for level_name in ("daily", "hourly", "raw"):
+                level = series[level_name]
+                low = bisect.bisect_left(level["ts"], start) if start is not None else 0
+                high = bisect.bisect_right(level["ts"], end) if end is not None else len(level["ts"])
+                if level_name == "raw":
+                    rows.extend((ts, value, value, value, value) for ts, value in zip(level["ts"][low:high], level["value"][low:high]))
+                else:
+                    rows.extend(zip(*(level[column][low:high] for column in ("ts", "mean", "min", "max", "last"))))
+        return rows
+
+    def range(self, key, start=None, end=None):
+        """Punti (ts, valore) nell'intervallo: i bucket contribuiscono con la loro media."""
+        return [(row[0], row[1]) for row in self.range_rows(key, start, end)]
+
+    def stats(self, key, start=None, end=None):
+        """Trend e volatilità (deviazione standard delle variazioni percentuali) nell'intervallo."""
+        rows = self.range_rows(key, start, end)
+        if not rows:
+            return None
+        means = [row[1] for row in rows]
+        changes = [(current - previous) / previous * 100 for previous, current in zip(means, means[1:]) if previous]
+        first, last = rows[0][4], rows[-1][4]
+        return {
+            "points": len(rows),
+            "from": rows[0][0],
+            "to": rows[-1][0],
+            "first": round(first, 2),
+            "last": round(last, 2),
+            "min": round(min(row[2] for row in rows), 2),
+            "max": round(max(row[3] for row in rows), 2),
+            "mean": round(statistics.fmean(means), 2),
+            "change_pct": round((last - first) / first * 100, 2) if first else None,
+            "volatility_pct": round(statistics.pstdev(changes), 2) if len(changes) > 1 else None,
+        }
+
+TIMESERIES_STORES = {}
+TIMESERIES_LOCK = threading.Lock()
+
+def timeseries_store(dataset):
+    """Store del dataset ("floors": chiave slug|alias floor, "listings": slug carta), caricato una volta sola."""
+    with TIMESERIES_LOCK:
+        if dataset not in TIMESERIES_STORES:
+            store = TimeSeriesStore(os.path.join(TIMESERIES_DIR, f"{dataset}.bin"))
+            try:
+                store.load()
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                print(f"AVVISO: serie storiche '{dataset}' illeggibili, riparto da zero: {e}")
+                store.series = {}
+            TIMESERIES_STORES[dataset] = store
+        return TIMESERIES_STORES[dataset]
+
+def record_floor_samples(player_slug, floors_by_header, timestamp=None):
+    """Un campione per ogni colonna FLOOR con un prezzo ({header: EUR}); le celle vuote non sono campioni."""
+    if not player_slug:
+        return
+    store = timeseries_store("floors")
+    for header, value in floors_by_header.items():
+        if isinstance(value, (int, float)) and header in FLOOR_COLUMN_ALIASES:
+            store.append(f"{player_slug}|{FLOOR_COLUMN_ALIASES[header]}", value, timestamp)
+
+def record_listing_sample(card_slug, price, timestamp=None):
+    if card_slug and isinstance(price, (int, float)):
+        timeseries_store("listings").append(card_slug, price, timestamp)
+
+def flush_timeseries():
+    for dataset, store in list(TIMESERIES_STORES.items()):
+        try:
+            store.save()
+        except OSError as e:
+            print(f"Errore salvataggio serie storiche '{dataset}': {e}")
+
+atexit.register(flush_timeseries)
+
+def price_history(slug, hours=168):
+    """Trend e volatilità locali (nessuna chiamata API) dei floor di un giocatore o del listino di una carta."""
+    start = time.time() - hours * 3600
+    series = [(header, "floors", f"{slug}|{alias}") for header, alias in FLOOR_COLUMN_ALIASES.items()]
+    series.append(("Listino carta", "listings", slug))
+    print(f"--- STORICO PREZZI: {slug} (ultime {hours:g} ore) ---")
+    found = False
+    for label, dataset, key in series:
+        stats = timeseries_store(dataset).stats(key, start)
+        if not stats:
+            continue
+        found = True
+        change = f"{stats['change_pct']:+.2f}%" if stats['change_pct'] is not None else "n/d"
+        volatility = f"{stats['volatility_pct']:.2f}%" if stats['volatility_pct'] is not None else "n/d"
+        print(f"{label}: {stats['first']} → {stats['last']} EUR ({change}), min {stats['min']}, max {stats['max']}, media {stats['mean']}, volatilità {volatility}, {stats['points']} punti")
+    if not found:
+        print("Nessun campione registrato per questo slug nell'intervallo.")
+
+def sheets_dashboard_only():
+    """In modalità "dashboard" (con almeno un sink locale) Sheets riceve solo il sottoinsieme compatto."""
+    return SHEETS_OUTPUT == "dashboard" and bool(OUTPUT_SINKS)
+
+def main_sheet_sink(sheet):
+    """SheetsSink per Foglio1: in modalità dashboard scrive solo SHEETS_DASHBOARD_COLUMNS, le altre colonne non si toccano."""
+    return SheetsSink(sheet, SHEETS_DASHBOARD_COLUMNS if sheets_dashboard_only() else MAIN_SHEET_HEADERS)
+
 def sorare_graphql_fetch(query, variables={}):
     payload = {"query": query, "variables": variables}
     headers = {"APIKEY": SORARE_API_KEY, "Content-Type": "application/json", "Accept": "application/json", "User-Agent": "Mozilla/5.0", "Accept-Language": "en-US,en;q=0.9", "X-Sorare-ApiVersion": "v1"}
+    LAST_FETCH_ERROR.kind = None
+    count_api_call("sorare")
     try:
-        response = requests.post(API_URL, json=payload, headers=headers, timeout=30)
+        response = HTTP_SESSION.post(API_URL, json=payload, headers=headers, timeout=30)
         if response.status_code == 422:
+            LAST_FETCH_ERROR.kind = "unprocessable"
             try:
                 error_details = response.json()
                 print(f"AVVISO: Dati non processabili per {variables}. Dettagli API: {error_details}")
@@ -133,9 +1478,11 @@ def sorare_graphql_fetch(query, variables={}):
             print(f"ERRORE GraphQL per {variables}: {data['errors']}")
         return data
     except requests.exceptions.HTTPError as e:
+        LAST_FETCH_ERROR.kind = "http"
         print(f"Errore HTTP: {e}")
         return None
     except requests.exceptions.RequestException as e:
+        LAST_FETCH_ERROR.kind = "network"
         print(f"Errore di rete generico: {e}")
         return None
 
@@ -145,13 +1492,13 @@ def send_telegram_notification(text):
     api_url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
     payload = {"chat_id": TELEGRAM_CHAT_ID, "text": text, "parse_mode": "HTML"}
     try: 
-        requests.post(api_url, json=payload, timeout=10)
+        HTTP_SESSION.post(api_url, json=payload, timeout=10)
     except Exception: 
         pass
 
 def get_eth_rate():
     try:
-        response = requests.get("https://api.coingecko.com/api/v3/simple/price?ids=ethereum&vs_currencies=eur", timeout=5)
+        response = HTTP_SESSION.get("https://api.coingecko.com/api/v3/simple/price?ids=ethereum&vs_currencies=eur", timeout=5)
         response.raise_for_status()
         return response.json()["ethereum"]["eur"]
     except Exception: 
@@ -159,7 +1506,7 @@ def get_eth_rate():
 
 def get_currency_rates():
     try:
-        response = requests.get("https://api.exchangerate-api.com/v4/latest/EUR", timeout=5)
+        response = HTTP_SESSION.get("https://api.exchangerate-api.com/v4/latest/EUR", timeout=5)
         response.raise_for_status()
         rates = response.json().get('rates', {})
         return {'usd_to_eur': 1 / rates.get('USD', 1.08), 'gbp_to_eur': 1 / rates.get('GBP', 0.85)}
@@ -194,19 +1541,113 @@ def fetch_projection(player_slug, game_id):
     if not player_slug or not game_id: 
         return None
     clean_game_id = str(game_id).replace("Game:", "")
+    cached = shared_cache_get('projection', (player_slug, clean_game_id))
+    if cached is not None:
+        return cached
     data = sorare_graphql_fetch(PROJECTION_QUERY, {"playerSlug": player_slug, "gameId": clean_game_id})
-    return data.get("data", {}).get("football", {}).get("player", {}).get("playerGameScore") if data else None
+    projection = data.get("data", {}).get("football", {}).get("player", {}).get("playerGameScore") if data else None
+    if projection is not None:
+        shared_cache_set('projection', (player_slug, clean_game_id), projection)
+    return projection
 
-def build_updated_card_row(original_record, card_details, player_info, projection_data, rates):
+def fetch_token_prices(player_slug, rarity, limit):
+    """tokenPrices per una coppia giocatore/rarità, riusando risultati già scaricati con limite >= richiesto."""
+    cached = shared_cache_get('token_prices', (player_slug, rarity))
+    if cached is not None and cached[0] >= limit:
+        return cached[1]
+    api_data = sorare_graphql_fetch(PLAYER_TOKEN_PRICES_QUERY, {
+        "playerSlug": player_slug, 
+        "rarity": rarity, 
+        "limit": limit
+    })
+    if api_data and api_data.get("data") and not api_data.get("errors"):
+        shared_cache_set('token_prices', (player_slug, rarity), (limit, api_data))
+    return api_data
+
+def form_tier_due(last_refresh, next_game_date_str, now):
+    """Il tier "form" è da aggiornare? Decide il calendario della prossima partita nota."""
+    age = now - last_refresh
+    if age >= timedelta(hours=FORM_MAX_AGE_HOURS):
+        return True
+    try:
+        # 'Data Prossima Partita' è in UTC (formato di build_updated_card_row)
+        game_date = datetime.strptime(str(next_game_date_str).strip(), '%d-%m-%y %H:%M').replace(tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+    except ValueError:
+        # Nessuna partita nota: vale l'intervallo fisso
+        return age >= timedelta(hours=CARD_TIER_INTERVAL_HOURS["form"])
+    scores_ready_at = game_date + timedelta(hours=FORM_POST_GAME_DELAY_HOURS)
+    if now >= scores_ready_at:
+        return last_refresh < scores_ready_at
+    if game_date - now <= timedelta(hours=FORM_PREGAME_WINDOW_HOURS):
+        return age >= timedelta(hours=CARD_TIER_INTERVAL_HOURS["form"])
+    return False
+
+def due_card_tiers(tier_refresh, now=None, next_game_date=None):
+    """Tier da scaricare per una carta, in base all'ultimo aggiornamento di ciascun tier."""
+    now = now or datetime.now()
+    tiers = ["market"]
+    for tier in ("form", "static"):
+        last_refresh_str = tier_refresh.get(tier)
+        try:
+            last_refresh = datetime.strptime(last_refresh_str, '%Y-%m-%d %H:%M:%S') if last_refresh_str else None
+        except ValueError:
+            last_refresh = None
+        if last_refresh:
+            if tier == "form" and not form_tier_due(last_refresh, next_game_date, now):
+                continue
+            if tier != "form" and now - last_refresh < timedelta(hours=CARD_TIER_INTERVAL_HOURS[tier]):
+                continue
+        tiers.append(tier)
+    return tuple(tiers)
+
+def next_game_changed(original_record, player_info):
+    """L'ID della prossima partita (tier market) è diverso da quello nel foglio?"""
+    upcoming_games = (player_info.get("nextGame") or {}).get("upcomingGames") or []
+    if not upcoming_games or not upcoming_games[0]:
+        return False
+    return str(upcoming_games[0].get("id", "")) != str(original_record.get("Next Game API ID", ""))
+
+def merge_player_info(*parts):
+    """Unisce i dati giocatore di più tier; i sotto-oggetti comuni (es. activeClub) vengono fusi."""
+    merged = {}
+    for part in parts:
+        for key, value in part.items():
+            if isinstance(value, dict) and isinstance(merged.get(key), dict):
+                merged[key] = {**merged[key], **value}
+            else:
+                merged[key] = value
+    return merged
+
+def fetch_card_tiers(card_slug, player_api_slug, tiers):
+    """
+    Scarica i tier richiesti di una carta; i dati giocatore già in cache (per tier) non
+    vengono riscaricati. Ritorna ((card_details, player_info, player_slug), None)
+    oppure (None, tipo di errore) come da response_error.
+    """
+    cached_player, player_tiers = {}, []
+    for tier in tiers:
+        cached = shared_cache_get('player', (player_api_slug, tier)) if player_api_slug else None
+        if cached is None:
+            player_tiers.append(tier)
+        else:
+            cached_player = merge_player_info(cached_player, cached)
+    details_data = sorare_graphql_fetch(build_card_details_query(tiers, tuple(player_tiers)), {"cardSlug": card_slug})
+    error = response_error(details_data, bool(((details_data or {}).get("data") or {}).get("anyCard")))
+    if error:
+        return None, error
+    card_details = details_data["data"]["anyCard"]
+    fetched_player = card_details.get("player") or {}
+    player_slug = fetched_player.get("slug") or player_api_slug
+    for tier in player_tiers:
+        shared_cache_set('player', (player_slug, tier), fetched_player)
+    return (card_details, merge_player_info(cached_player, fetched_player), player_slug), None
+
+def build_updated_card_row(original_record, card_details, player_info, projection_data, rates, tiers=CARD_TIER_NAMES):
     record = original_record.copy()
     if not player_info: 
         player_info = card_details.get("player", {})
-    record["FLOOR CLASSIC LIMITED"] = calculate_eur_price(player_info.get('L_ANY'), rates)
-    record["FLOOR IN SEASON LIMITED"] = calculate_eur_price(player_info.get('L_IN'), rates)
-    record["FLOOR CLASSIC RARE"] = calculate_eur_price(player_info.get('R_ANY'), rates)
-    record["FLOOR IN SEASON RARE"] = calculate_eur_price(player_info.get('R_IN'), rates)
-    record["FLOOR CLASSIC SR"] = calculate_eur_price(player_info.get('SR_ANY'), rates)
-    record["FLOOR IN SEASON SR"] = calculate_eur_price(player_info.get('SR_IN'), rates)
+    for header, alias in FLOOR_COLUMN_ALIASES.items():
+        record[header] = calculate_eur_price(player_info.get(alias), rates)
 
     # Set default projection values first
     record["Projection Grade"] = "G"
@@ -231,6 +1672,7 @@ def build_updated_card_row(original_record, card_details, player_info, projectio
         record["XP Mancanti Livello"] = record["XP Prox Livello"] - record["XP Corrente"]
     record["In Season?"], record["Fee Abilitata?"] = "Sì" if card_details.get("inSeasonEligible") else "No", "Sì" if card_details.get("secondaryMarketFeeEnabled") else "No"
     record["Foto URL"], record["Sale Price (EUR)"] = card_details.get("pictureUrl", ""), calculate_eur_price(card_details, rates)
+    record["Position"], record["U23 Eligible?"] = player_info.get("position", ""), "Sì" if player_info.get("u23Eligible") else "No"
     l5, l15 = player_info.get('lastFiveSo5Appearances'), player_info.get('lastFifteenSo5Appearances')
     if l5 is not None: 
         record["L5 So5 (%)"] = f"{int((l5 / 5) * 100)}%"
@@ -272,6 +1714,14 @@ def build_updated_card_row(original_record, card_details, player_info, projectio
             record["Partita"], record["Data Prossima Partita"], record["Next Game API ID"] = "Data non disp.", "", ""
     else: 
         record["Partita"], record["Data Prossima Partita"], record["Next Game API ID"] = "Nessuna partita", "", ""
+    # I tier non scaricati in questo ciclo mantengono i valori già presenti nel foglio,
+    # le colonne disattivate restano vuote
+    for tier in CARD_TIER_NAMES:
+        for header in CARD_TIER_COLUMNS[tier]:
+            if header not in ENABLED_COLUMNS:
+                record[header] = ''
+            elif tier not in tiers:
+                record[header] = original_record.get(header, '')
     record["Ultimo Aggiornamento"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     return [record.get(header, '') for header in MAIN_SHEET_HEADERS]
 
@@ -425,24 +1875,347 @@ def build_sales_history_row(name, slug, rarity, all_sales, headers):
     out_row_map["Last Updated"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     return [out_row_map.get(h, '') for h in headers]
 
-def check_sheet_health(sales_sheet, expected_headers):
+def fetch_gallery_pages(rarity):
+    """Generatore: scorre le pagine di ALL_CARDS_QUERY per una singola rarità."""
+    cursor, has_next_page = None, True
+    while has_next_page:
+        variables = {"userSlug": USER_SLUG, "rarities": [rarity], "cursor": cursor}
+        data = sorare_graphql_fetch(ALL_CARDS_QUERY, variables)
+        if not data or "errors" in data or not (data.get("data") or {}).get("user", {}).get("cards"):
+            raise RuntimeError(f"Paginazione interrotta per la rarità '{rarity}'")
+        cards_data = data["data"]["user"]["cards"]
+        yield cards_data.get("nodes", [])
+        page_info = cards_data.get("pageInfo", {})
+        has_next_page, cursor = page_info.get("hasNextPage", False), page_info.get("endCursor")
+        if has_next_page:
+            time.sleep(GALLERY_PAGE_PAUSE_SECONDS)
+
+def stream_gallery_cards(incomplete_rarities=None):
+    """
+    Pagina la galleria con uno stream indipendente per ogni rarità, in parallelo.
+    Le carte vengono restituite man mano che le pagine arrivano; le rarità la cui
+    paginazione si interrompe vengono aggiunte a incomplete_rarities.
+    """
+    pages = queue.Queue()
+
+    def run_stream(rarity):
+        try:
+            for nodes in fetch_gallery_pages(rarity):
+                pages.put(nodes)
+        except Exception as e:
+            print(f"ERRORE: {e}")
+            if incomplete_rarities is not None:
+                incomplete_rarities.append(rarity)
+        finally:
+            pages.put(None)
+
+    with ThreadPoolExecutor(max_workers=len(GALLERY_RARITIES)) as executor:
+        for rarity in GALLERY_RARITIES:
+            executor.submit(run_stream, rarity)
+        finished_streams = 0
+        while finished_streams < len(GALLERY_RARITIES):
+            nodes = pages.get()
+            if nodes is None:
+                finished_streams += 1
+                continue
+            for card in nodes:
+                if card and card.get('slug'):
+                    yield card
+
+def fetch_cards_since(watermark):
+    """
+    Legge le carte dalla più recente (ordinate per 'ownerSince') fino al watermark.
+    Ritorna (carte con ownerSince >= watermark, totalCount) oppure None in caso di errore.
+    Nel caso comune basta una sola richiesta.
+    """
+    recent_cards, total_count = {}, None
+    cursor, has_next_page = None, True
+    while has_next_page:
+        variables = {"userSlug": USER_SLUG, "rarities": GALLERY_RARITIES, "cursor": cursor}
+        data = sorare_graphql_fetch(RECENT_CARDS_QUERY, variables)
+        if not data or "errors" in data or not (data.get("data") or {}).get("user", {}).get("cards"):
+            return None
+        cards_data = data["data"]["user"]["cards"]
+        if total_count is None:
+            total_count = cards_data.get("totalCount")
+        reached_watermark = False
+        for card in cards_data.get("nodes", []):
+            if not card or not card.get('slug'):
+                continue
+            owner_since = card.get('ownerSince') or ''
+            if owner_since < watermark:
+                reached_watermark = True
+                break
+            recent_cards[card['slug']] = card
+            if owner_since == watermark:
+                reached_watermark = True
+        page_info = cards_data.get("pageInfo", {})
+        has_next_page, cursor = page_info.get("hasNextPage", False) and not reached_watermark, page_info.get("endCursor")
+        if has_next_page:
+            time.sleep(GALLERY_PAGE_PAUSE_SECONDS)
+    return recent_cards, total_count
+
+def parse_api_sales(api_data):
+    """Converte la risposta tokenPrices in una lista di vendite (prezzo già in EUR)."""
+    sales = []
+    if api_data and api_data.get("data") and not api_data.get("errors"):
+        for sale in api_data["data"].get("tokens", {}).get("tokenPrices", []):
+            sales.append({
+                "timestamp": datetime.strptime(sale['date'], "%Y-%m-%dT%H:%M:%SZ").timestamp() * 1000, 
+                "price": sale['amounts']['eurCents'] / 100,
+                "seasonEligibility": "IN_SEASON" if sale['card']['inSeasonEligible'] else "CLASSIC"
+            })
+    return sales
+
+def build_sales_history_headers():
+    """Header del foglio Cronologia Vendite (layout "wide")."""
+    expected_headers = ["Player Name", "Player API Slug", "Rarity Searched", "Sales Today (In-Season)", "Sales Today (Classic)"]
+    periods = [3, 7, 14, 30]
+    for p in periods: 
+        expected_headers.extend([f"Avg Price {p}d (In-Season)", f"Avg Price {p}d (Classic)"])
+    for j in range(1, MAX_SALES_TO_DISPLAY + 1): 
+        expected_headers.extend([f"Sale {j} Date", f"Sale {j} Price (EUR)", f"Sale {j} Eligibility"])
+    expected_headers.append("Last Updated")
+    return expected_headers
+
+def merge_sales_history(pair, api_data, existing_info, headers):
+    """
+    Unisce le vendite appena scaricate (tokenPrices) con quelle già nel foglio e costruisce
+    la riga della cronologia. existing_info è {"row_index", "record"} o None.
+    """
+    # CORREZIONE CRITICA BUG CACHE: SALVA SEMPRE IL PREZZO GIÀ CONVERTITO
+    new_sales_from_api = parse_api_sales(api_data)
+    for sale in new_sales_from_api[:3]:  # Debug log
+        print(f"  🆕 API (cache): {sale['price']} EUR")
+    
+    # Recupera vendite esistenti dal foglio CON CORREZIONE AUTOMATICA
+    old_sales_from_sheet = []
+    if existing_info:
+        record = existing_info['record']
+        print(f"  📄 Leggo vendite esistenti dal foglio...")
+        
+        # Estrai i prezzi API per il confronto
+        api_prices_for_comparison = [s['price'] for s in new_sales_from_api]
+        
+        for j in range(1, MAX_SALES_TO_DISPLAY + 1):
+            date_str, price_val = record.get(f"Sale {j} Date"), record.get(f"Sale {j} Price (EUR)")
+            if date_str and price_val:
+                raw_price = parse_price(price_val)  # parse_price restituisce il valore raw dal foglio
+                if raw_price is not None:
+                    # CORREZIONE AUTOMATICA: Confronta con i prezzi API
+                    corrected_price = smart_price_correction(raw_price, api_prices_for_comparison)
+                    
+                    try:
+                        timestamp = datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S').timestamp() * 1000
+                        eligibility = record.get(f"Sale {j} Eligibility")
+                        old_sales_from_sheet.append({
+                            "timestamp": timestamp, 
+                            "price": corrected_price,  # USA IL PREZZO CORRETTO
+                            "seasonEligibility": eligibility
+                        })
+                        if j <= 3:  # Debug log
+                            correction_note = " (corretto)" if corrected_price != raw_price else ""
+                            print(f"  📄 Foglio Sale {j}: {corrected_price} EUR{correction_note}")
+                    except (ValueError, TypeError):
+                        continue
+    
+    # Combina e deduplica vendite
+    print(f"  🔄 Combinazione: {len(new_sales_from_api)} nuove + {len(old_sales_from_sheet)} esistenti")
+    all_sales = new_sales_from_api + old_sales_from_sheet
+    unique_sales = {int(s['timestamp']): s for s in all_sales}  # Dedup by timestamp
+    combined_sales = sorted(unique_sales.values(), key=lambda x: x['timestamp'], reverse=True)[:MAX_SALES_TO_DISPLAY]
+    
+    print(f"  ✅ Risultato finale: {len(combined_sales)} vendite uniche")
+    
+    # 🚀 CREA RIGA AGGIORNATA CON FORMATTAZIONE STRINGA
+    updated_row = build_sales_history_row(pair['name'], pair['slug'], pair['rarity'], combined_sales, headers)
+    return updated_row
+
+def collect_sales_pairs(main_records):
+    """Coppie giocatore/rarità uniche presenti nella galleria."""
+    pairs_map = {}
+    for record in main_records:
+        slug, rarity = record.get("Player API Slug"), record.get("Rarity")
+        if slug and rarity:
+            key = f"{slug}::{rarity.lower()}"
+            if key not in pairs_map: 
+                pairs_map[key] = {"slug": slug, "rarity": rarity.lower(), "name": record.get("Player Name")}
+    return list(pairs_map.values())
+
+def get_or_create_worksheet(spreadsheet, title, headers):
+    """Apre un foglio, creandolo con gli header in grassetto se non esiste."""
+    try:
+        return open_worksheet(spreadsheet, title)
+    except gspread.WorksheetNotFound:
+        worksheet = remember_worksheet(spreadsheet, sheets_write(spreadsheet.add_worksheet, title=title, rows=1000, cols=len(headers)))
+        ensure_header_row(worksheet, headers)
+        print(f"Foglio '{title}' creato.")
+        return worksheet
+
+async def run_sales_pipeline(pairs, pending_indices, sales_limit_for, process_pair, flush, deadline, on_fetched=None):
+    """
+    Pipeline a tre stadi collegati da code limitate:
+    1. fetch concorrenti di tokenPrices (al massimo SALES_FETCH_CONCURRENCY insieme);
+    2. merge e costruzione delle righe (process_pair), in ordine di arrivo;
+    3. flush periodici sul foglio (flush), così un timeout non perde righe già pronte.
+    Se un flush fallisce le sue coppie non contano come scritte e non partono altri fetch.
+    Dopo la deadline non parte nessun nuovo fetch; quelli in corso vengono completati e scritti.
+    on_fetched(index, errore) ritorna False per scartare una risposta in errore (la coppia conta
+    come completata per la sessione) o "stop" per non avviare altri fetch (circuit breaker):
+    in quel caso anche le coppie scartate tornano da fare.
+    Ritorna l'insieme degli indici effettivamente scritti.
+    """
+    fetched_queue = asyncio.Queue(maxsize=SALES_PIPELINE_QUEUE_SIZE)
+    write_queue = asyncio.Queue(maxsize=SALES_PIPELINE_QUEUE_SIZE)
+    semaphore = asyncio.Semaphore(SALES_FETCH_CONCURRENCY)
+    completed = set()
+
+    async def fetch_one(index):
+        try:
+            pair = pairs[index]
+            api_data, error = await asyncio.to_thread(fetch_pair_token_prices, pair, sales_limit_for(pair))
+            await fetched_queue.put((index, api_data, error))
+        finally:
+            semaphore.release()
+
+    stop_fetching = [False]
+    discarded = set()
+
+    async def fetch_stage():
+        tasks = []
+        for index in pending_indices:
+            await semaphore.acquire()
+            if stop_fetching[0]:
+                semaphore.release()
+                break
+            if time.time() > deadline or stop_requested():
+                semaphore.release()
+                print(f"⏰ Timeout imminente. Nessun nuovo fetch dopo l'indice {index}.")
+                break
+            tasks.append(asyncio.create_task(fetch_one(index)))
+        await asyncio.gather(*tasks)
+        await fetched_queue.put(None)
+
+    async def build_stage():
+        while (item := await fetched_queue.get()) is not None:
+            index, api_data, error = item
+            verdict = on_fetched(index, error) if on_fetched else True
+            if verdict == "stop":
+                stop_fetching[0] = True
+                completed.difference_update(discarded)
+                continue
+            if not verdict:
+                if not stop_fetching[0]:
+                    completed.add(index)
+                    discarded.add(index)
+                continue
+            await write_queue.put((index, process_pair(index, pairs[index], api_data)))
+        await write_queue.put(None)
+
+    async def flush_stage():
+        pending, last_flush, failed = [], time.time(), False
+        while True:
+            try:
+                item = await asyncio.wait_for(write_queue.get(), timeout=SALES_FLUSH_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                item = False
+            finished = item is None
+            if item and not failed:
+                pending.append(item)
+            if pending and (finished or len(pending) >= SALES_FLUSH_EVERY_ROWS or time.time() - last_flush >= SALES_FLUSH_INTERVAL_SECONDS):
+                try:
+                    await asyncio.to_thread(flush, [payload for _, payload in pending])
+                    completed.update(index for index, _ in pending)
+                except Exception as e:
+                    # Scrittura fallita anche dopo i tentativi di sheets_write: le coppie restano da
+                    # fare, niente nuovi fetch e il resto della coda si scarta (torna nella continuazione)
+                    print(f"ERRORE scrittura di {len(pending)} coppie: {e}. Interrompo la sessione.")
+                    stop_fetching[0], failed = True, True
+                pending, last_flush = [], time.time()
+            if finished:
+                return
+
+    await asyncio.gather(fetch_stage(), build_stage(), flush_stage())
+    return completed
+
+def fetch_pair_token_prices(pair, limit):
+    """fetch_token_prices con il tipo di errore, letto nello stesso thread della richiesta."""
+    LAST_FETCH_ERROR.kind = None
+    api_data = fetch_token_prices(pair['slug'], pair['rarity'], limit)
+    return api_data, response_error(api_data, bool((api_data or {}).get("data")))
+
+def sales_failure_handler(state, pairs, breaker):
+    """on_fetched della pipeline vendite: backoff/dead-letter per coppia e circuit breaker."""
+    def on_fetched(index, error):
+        key = f"{pairs[index]['slug']}::{pairs[index]['rarity']}"
+        if circuit_breaker_record(breaker, state, error):
+            return "stop"
+        if not error:
+            record_item_success(state, 'update_sales', key)
+            return True
+        if error in ITEM_ERROR_KINDS:
+            record_item_failure(state, 'update_sales', key, error, breaker)
+        return False
+    return on_fetched
+
+def notify_circuit_breaker(job_title, breaker):
+    if breaker['tripped']:
+        send_telegram_notification(f"🛑 <b>{job_title}: circuit breaker</b>\\n\\nSorare risponde con errori ({breaker['failures']}/{breaker['attempts']} richieste). Riprendo alla prossima esecuzione.")
+
+def save_sales_continuation(state, continuation_data, pairs, pending_indices, completed):
+    """Salva la continuazione dopo un timeout: indice minimo non completato + indici già scritti oltre."""
+    remaining = [i for i in pending_indices if i not in completed]
+    if not remaining:
+        return False
+    continuation_data['last_index'] = remaining[0]
+    continuation_data['completed_indices'] = sorted(i for i in set(continuation_data.get('completed_indices', [])) | completed if i > remaining[0])
+    state['update_sales_continuation'] = continuation_data
+    save_state(state)
+    compact_journal('update_sales')
+    print(f"⏰ Stato salvato: {len(remaining)} coppie rimanenti su {len(pairs)}.")
+    return True
+
+def journaled_pair_indices(pairs, journaled):
+    """Indici delle coppie già scritte secondo il journal (per chiave slug::rarità, stabile tra sessioni)."""
+    return {i for i, pair in enumerate(pairs) if f"{pair['slug']}::{pair['rarity']}" in journaled}
+
+def records_from_values(values, headers=None):
+    """
+    Come get_all_records(), ma su valori già letti: stessi controlli sugli header
+    duplicati e stessa conversione numerica, senza un'altra lettura del foglio.
     """
-    Controlla se il foglio ha problemi di header duplicati o colonne extra.
-    Ritorna (is_healthy, needs_recreation, error_message)
+    if not values or values == [[]]:
+        return []
+    keys = headers if headers is not None else values[0]
+    duplicates = [key for key in set(keys) if keys.count(key) > 1]
+    if duplicates:
+        raise gspread.exceptions.GSpreadException(f"the header row in the worksheet contains duplicates: {duplicates}")
+    rows = [gspread.utils.numericise_all(row + [""] * (len(keys) - len(row)), False, "", False, []) for row in values[1:]]
+    return gspread.utils.to_records(keys, rows)
+
+def check_sheet_health(sales_sheet, expected_headers):
+    """
+    Controlla se il foglio ha problemi di header duplicati o colonne extra, con un'unica
+    lettura completa (get_all_values) riusata poi per i record.
+    Ritorna (is_healthy, needs_recreation, error_message, values)
     """
+    values = []
     try:
-        # Prova a leggere gli header esistenti
-        existing_headers = sales_sheet.row_values(1) if sales_sheet.row_count > 0 else []
+        values = sales_sheet.get_all_values()
+        # La prima riga senza le celle vuote finali, come row_values(1)
+        existing_headers = list(values[0]) if values else []
+        while existing_headers and existing_headers[-1] == "":
+            existing_headers.pop()
         
         # Controlla se possiamo leggere i record (test per header duplicati)
         try:
-            test_records = sales_sheet.get_all_records()
+            test_records = records_from_values(values)
             print(f"Test lettura records: OK ({len(test_records)} righe)")
         except Exception as e:
             if "duplicates" in str(e).lower() or "header" in str(e).lower():
-                return False, True, f"Header duplicati/vuoti: {e}"
+                return False, True, f"Header duplicati/vuoti: {e}", values
             else:
-                return False, False, f"Errore generico lettura: {e}"
+                return False, False, f"Errore generico lettura: {e}", values
         
         # Controlla dimensioni
         num_expected_cols = len(expected_headers)
@@ -455,57 +2228,100 @@ def check_sheet_health(sales_sheet, expected_headers):
         # Controlla header consistency
         if len(existing_headers) != len(expected_headers):
             print(f"Header count mismatch: {len(existing_headers)} vs {len(expected_headers)}")
-            return False, False, "Numero header diverso"
+            return False, False, "Numero header diverso", values
         
         if existing_headers != expected_headers:
             print("Header content mismatch")
-            return False, False, "Contenuto header diverso"
+            return False, False, "Contenuto header diverso", values
         
         # Tutto OK
-        return True, False, "Foglio sano"
+        return True, False, "Foglio sano", values
         
     except Exception as e:
-        return False, True, f"Errore grave nel controllo: {e}"
+        return False, True, f"Errore grave nel controllo: {e}", values
 
 # --- 4. FUNZIONI PRINCIPALI ---
+def open_gallery_sheet():
+    spreadsheet = open_spreadsheet()
+    try:
+        sheet = open_worksheet(spreadsheet, MAIN_SHEET_NAME)
+    except gspread.WorksheetNotFound:
+        sheet = remember_worksheet(spreadsheet, sheets_write(spreadsheet.add_worksheet, title=MAIN_SHEET_NAME, rows="1", cols=len(MAIN_SHEET_HEADERS)))
+        print(f"Foglio '{MAIN_SHEET_NAME}' creato.")
+    ensure_header_row(sheet, MAIN_SHEET_HEADERS, rewrite=False)
+    return sheet
+
+def build_new_card_row(card):
+    player = card.get("player") or {}
+    record = {header: "" for header in MAIN_SHEET_HEADERS}
+    record["Slug"], record["Rarity"], record["Owner Since"] = card.get("slug", ""), card.get("rarity", ""), card.get("ownerSince", "")
+    record["Player Name"], record["Player API Slug"] = player.get("displayName", ""), player.get("slug", "")
+    record["Position"], record["U23 Eligible?"] = player.get("position", ""), "Sì" if player.get("u23Eligible") else "No"
+    return [record.get(header, '') for header in MAIN_SHEET_HEADERS]
+
+def sync_galleria_incremental(sync_state):
+    """
+    Sincronizzazione veloce: legge le carte dalla più recente fino al watermark
+    'ownerSince' salvato nello stato. Ritorna True se la galleria è stata
+    allineata, False se serve una riconciliazione completa.
+    """
+    known_slugs = set(sync_state.get('slugs', []))
+    watermark = sync_state.get('owner_since_watermark')
+    print(f"Sincronizzazione incrementale (watermark: {watermark})...")
+    result = fetch_cards_since(watermark)
+    if result is None:
+        print("Lettura incrementale fallita. Passo alla riconciliazione completa.")
+        return False
+    recent_cards, total_count = result
+    new_cards = {slug: card for slug, card in recent_cards.items() if slug not in known_slugs}
+    expected_count = len(known_slugs) + len(new_cards)
+    if total_count != expected_count:
+        print(f"Conteggio API ({total_count}) diverso da quello atteso ({expected_count}). Passo alla riconciliazione completa.")
+        return False
+    if new_cards:
+        try:
+            sheet = open_gallery_sheet()
+        except Exception as e:
+            print(f"ERRORE CRITICO GSheets in sync_galleria: {e}")
+            return True
+        print(f"Aggiunta di {len(new_cards)} nuove carte al foglio...")
+        sheets_write(sheet.append_rows, [build_new_card_row(card) for card in new_cards.values()], value_input_option='USER_ENTERED')
+        invalidate_sheet_snapshot(sheet)
+        known_slugs.update(new_cards)
+        sync_state['slugs'] = sorted(known_slugs)
+    sync_state['owner_since_watermark'] = max([watermark] + [card.get('ownerSince') for card in recent_cards.values() if card.get('ownerSince')])
+    message = f"✅ <b>Sincronizzazione Galleria Completata</b>\\n\\nGalleria: {len(known_slugs)} carte\\n➕ Aggiunte: {len(new_cards)}\\n➖ Rimosse: 0"
+    print(message)
+    send_telegram_notification(message)
+    return True
+
 def sync_galleria():
     print("--- INIZIO SINCRONIZZAZIONE GALLERIA ---")
+    state = load_state()
+    sync_state = state.get('sync_galleria', {})
+    last_full_sync_str = sync_state.get('last_full_sync')
+    needs_full_sync = True
+    if last_full_sync_str and sync_state.get('owner_since_watermark'):
+        last_full_sync = datetime.strptime(last_full_sync_str, '%Y-%m-%d %H:%M:%S')
+        needs_full_sync = datetime.now() - last_full_sync > timedelta(hours=FULL_GALLERY_SYNC_INTERVAL_HOURS)
+    if not needs_full_sync and sync_galleria_incremental(sync_state):
+        state['sync_galleria'] = sync_state
+        save_state(state)
+        return
     try:
-        credentials = json.loads(GSPREAD_CREDENTIALS_JSON)
-        gc = gspread.service_account_from_dict(credentials)
-        spreadsheet = gc.open_by_key(SPREADSHEET_ID)
-        try:
-            sheet = spreadsheet.worksheet(MAIN_SHEET_NAME)
-            if not sheet.row_values(1):
-                 sheet.update(range_name='A1', values=[MAIN_SHEET_HEADERS])
-                 sheet.format(f'A1:{gspread.utils.rowcol_to_a1(1, len(MAIN_SHEET_HEADERS))}', {'textFormat': {'bold': True}})
-        except gspread.WorksheetNotFound:
-            sheet = spreadsheet.add_worksheet(title=MAIN_SHEET_NAME, rows="1", cols=len(MAIN_SHEET_HEADERS))
-            sheet.update(range_name='A1', values=[MAIN_SHEET_HEADERS])
-            sheet.format(f'A1:{gspread.utils.rowcol_to_a1(1, len(MAIN_SHEET_HEADERS))}', {'textFormat': {'bold': True}})
-            print(f"Foglio '{MAIN_SHEET_NAME}' creato.")
+        sheet = open_gallery_sheet()
     except Exception as e:
         print(f"ERRORE CRITICO GSheets in sync_galleria: {e}")
         return
     print("Recupero di tutte le carte dall'API di Sorare...")
-    api_cards = []
-    cursor, has_next_page = None, True
-    while has_next_page:
-        variables = {"userSlug": USER_SLUG, "rarities": ["limited", "rare", "super_rare", "unique"], "cursor": cursor}
-        data = sorare_graphql_fetch(ALL_CARDS_QUERY, variables)
-        if not data or "errors" in data or not data.get("data", {}).get("user", {}).get("cards"):
-            break
-        cards_data = data["data"]["user"]["cards"]
-        api_cards.extend(cards_data.get("nodes", []))
-        page_info = cards_data.get("pageInfo", {})
-        has_next_page, cursor = page_info.get("hasNextPage", False), page_info.get("endCursor")
-        if has_next_page: 
-            time.sleep(1)
-    api_card_slugs = {card['slug'] for card in api_cards}
+    api_cards, incomplete_rarities = {}, []
+    for card in stream_gallery_cards(incomplete_rarities):
+        api_cards[card['slug']] = card
+    api_card_slugs = set(api_cards)
     print(f"Recupero completato. Trovate {len(api_card_slugs)} carte uniche in totale.")
     print("Leggo le carte presenti nel foglio Google...")
     try:
-        sheet_records = sheet.get_all_records()
+        sheet_records = read_sheet_records(sheet)
         sheet_card_slugs = {record['Slug']: {'row_index': i + 2} for i, record in enumerate(sheet_records) if record.get('Slug')}
     except gspread.exceptions.GSpreadException as e:
         print(f"Attenzione: il foglio '{MAIN_SHEET_NAME}' sembra vuoto o malformato. Verrà trattato come vuoto. Dettagli: {e}")
@@ -513,64 +2329,83 @@ def sync_galleria():
     print(f"Trovate {len(sheet_card_slugs)} carte nel foglio.")
     slugs_to_add = api_card_slugs - sheet_card_slugs.keys()
     slugs_to_delete = sheet_card_slugs.keys() - api_card_slugs
+    if slugs_to_delete and incomplete_rarities:
+        # Una listing parziale farebbe sembrare "rimosse" carte ancora possedute
+        print(f"ATTENZIONE: paginazione incompleta per {', '.join(incomplete_rarities)}. Salto la rimozione di {len(slugs_to_delete)} carte.")
+        slugs_to_delete = set()
     if slugs_to_delete:
-        rows_to_delete = sorted([sheet_card_slugs[slug]['row_index'] for slug in slugs_to_delete], reverse=True)
+        rows_to_delete = [sheet_card_slugs[slug]['row_index'] for slug in slugs_to_delete]
         print(f"Rimozione di {len(rows_to_delete)} righe...")
-        for row_index in rows_to_delete:
+        # Righe contigue in una sola chiamata, dal basso perché gli indici restino validi
+        for start_index, end_index in contiguous_row_blocks(rows_to_delete):
             try:
-                sheet.delete_rows(row_index)
-                time.sleep(1.5)
+                sheets_write(sheet.delete_rows, start_index, end_index)
             except Exception as e:
-                print(f"Errore durante la rimozione della riga {row_index}: {e}")
+                print(f"Errore durante la rimozione delle righe {start_index}-{end_index}: {e}")
+        invalidate_sheet_snapshot(sheet)
     if slugs_to_add:
-        new_cards_data = [card for card in api_cards if card['slug'] in slugs_to_add]
-        data_to_write = []
-        empty_record = {header: "" for header in MAIN_SHEET_HEADERS}
-        for card in new_cards_data:
-            player = card.get("player") or {}
-            record = empty_record.copy()
-            record["Slug"], record["Rarity"], record["Owner Since"] = card.get("slug", ""), card.get("rarity", ""), card.get("ownerSince", "")
-            record["Player Name"], record["Player API Slug"] = player.get("displayName", ""), player.get("slug", "")
-            record["Position"], record["U23 Eligible?"] = player.get("position", ""), "Sì" if player.get("u23Eligible") else "No"
-            data_to_write.append([record.get(header, '') for header in MAIN_SHEET_HEADERS])
+        data_to_write = [build_new_card_row(api_cards[slug]) for slug in slugs_to_add]
         if data_to_write:
             print(f"Aggiunta di {len(data_to_write)} nuove carte al foglio...")
-            sheet.append_rows(data_to_write, value_input_option='USER_ENTERED')
+            sheets_write(sheet.append_rows, data_to_write, value_input_option='USER_ENTERED')
+            invalidate_sheet_snapshot(sheet)
+    if not incomplete_rarities:
+        owner_since_values = [card.get('ownerSince') for card in api_cards.values() if card.get('ownerSince')]
+        state['sync_galleria'] = {
+            'slugs': sorted(api_card_slugs),
+            'owner_since_watermark': max(owner_since_values) if owner_since_values else None,
+            'last_full_sync': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
+        save_state(state)
     message = f"✅ <b>Sincronizzazione Galleria Completata</b>\\n\\nGalleria: {len(api_card_slugs)} carte\\n➕ Aggiunte: {len(slugs_to_add)}\\n➖ Rimosse: {len(slugs_to_delete)}"
     print(message)
     send_telegram_notification(message)
 
+def cards_due_for_update(all_sheet_records):
+    """Righe dello shard con "Ultimo Aggiornamento" assente o più vecchio di CARD_DATA_UPDATE_INTERVAL_HOURS (con row_index)."""
+    cutoff_time = datetime.now() - timedelta(hours=CARD_DATA_UPDATE_INTERVAL_HOURS)
+    cards_to_process = []
+    for i, record in enumerate(all_sheet_records):
+        record['row_index'] = i + 2
+        if not in_shard(record.get('Player API Slug') or record.get('Slug')):
+            continue
+        last_update_str = str(record.get('Ultimo Aggiornamento', '')).strip()
+        if not last_update_str:
+            cards_to_process.append(record)
+            continue
+        try:
+            if datetime.strptime(last_update_str, '%Y-%m-%d %H:%M:%S') < cutoff_time:
+                cards_to_process.append(record)
+        except ValueError:
+            cards_to_process.append(record)
+    return cards_to_process
+
 def update_cards():
     print("--- INIZIO AGGIORNAMENTO DATI CARTE (OTTIMIZZATO) ---")
     start_time, state = time.time(), load_state()
     continuation_data = state.get('update_cards_continuation', {})
     start_index = continuation_data.get('last_index', 0)
     try:
-        credentials = json.loads(GSPREAD_CREDENTIALS_JSON)
-        gc = gspread.service_account_from_dict(credentials)
-        sheet = gc.open_by_key(SPREADSHEET_ID).worksheet(MAIN_SHEET_NAME)
+        sheet = open_worksheet(open_spreadsheet(), MAIN_SHEET_NAME)
         print("Connessione a Google Sheets riuscita.")
     except Exception as e:
         print(f"ERRORE CRITICO GSheets: {e}")
         return
     rates = {"eth_to_eur": get_eth_rate()}
     rates.update(get_currency_rates())
+    tier_refresh = state.setdefault('card_tier_refresh', {})
+    journaled = load_journal('update_cards')
+    for card_slug, refreshed_tiers in journaled.items():
+        tier_refresh.setdefault(card_slug, {}).update(refreshed_tiers)
+    done_slugs = set(journaled) | set(continuation_data.get('completed_slugs', []))
     if start_index == 0:
         print("Avvio nuova sessione...")
-        all_sheet_records = sheet.get_all_records()
-        cutoff_time = datetime.now() - timedelta(hours=CARD_DATA_UPDATE_INTERVAL_HOURS)
-        cards_to_process = []
-        for i, record in enumerate(all_sheet_records):
-            record['row_index'] = i + 2
-            last_update_str = record.get('Ultimo Aggiornamento', '').strip()
-            if not last_update_str:
-                cards_to_process.append(record)
-                continue
-            try:
-                if datetime.strptime(last_update_str, '%Y-%m-%d %H:%M:%S') < cutoff_time:
-                    cards_to_process.append(record)
-            except ValueError:
-                cards_to_process.append(record)
+        all_sheet_records = read_sheet_records(sheet)
+        sheet_slugs = {record.get('Slug') for record in all_sheet_records if in_shard(record.get('Player API Slug') or record.get('Slug'))}
+        for stale_slug in [slug for slug in tier_refresh if slug not in sheet_slugs]:
+            del tier_refresh[stale_slug]
+        prune_item_failures(state, 'update_cards', sheet_slugs)
+        cards_to_process = cards_due_for_update(all_sheet_records)
         print(f"Identificate {len(cards_to_process)} carte da aggiornare.")
         continuation_data['cards_to_process'] = cards_to_process
     else:
@@ -581,59 +2416,262 @@ def update_cards():
         if 'update_cards_continuation' in state: 
             del state['update_cards_continuation']
         save_state(state)
+        compact_journal('update_cards')
         return
+    breaker = new_circuit_breaker()
+    pending_rows = []
+    sheet_sink = main_sheet_sink(sheet)
+    measure, attempted = start_cost_measure(), 0
+
+    def flush_card_rows():
+        """Scrive le righe in attesa con una batch_update; solo dopo la scrittura finiscono nel journal."""
+        if not pending_rows:
+            return
+        batch = pending_rows[:]
+        pending_rows.clear()
+        try:
+            sheet_sink.write("cards", [row for _, _, row in batch])
+            sheet_sink.flush()
+        except Exception as e:
+            print(f"Errore aggiornamento di {len(batch)} righe ({', '.join(slug for slug, _, _ in batch)}): {e}")
+            return
+        refreshed_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        journal_items = {}
+        for card_slug, tiers, _ in batch:
+            card_tiers_state = tier_refresh.setdefault(card_slug, {})
+            for tier in tiers:
+                card_tiers_state[tier] = refreshed_at
+            journal_items[card_slug] = {tier: refreshed_at for tier in tiers}
+            done_slugs.add(card_slug)
+        journal_append('update_cards', journal_items)
+
     for i in range(start_index, len(cards_to_process)):
-        if time.time() - start_time > 300:
+        if time.time() - start_time > CARDS_TIMEOUT_SECONDS or stop_requested() or breaker['tripped']:
+            flush_card_rows()
+            notify_circuit_breaker("Dati Carte", breaker)
+            record_run_costs(state, 'update_cards', attempted, measure)
             print(f"Timeout imminente. Salvo stato all'indice {i}.")
             continuation_data['last_index'] = i
+            continuation_data['completed_slugs'] = [card.get('Slug') for card in cards_to_process[i:] if card.get('Slug') in done_slugs]
             state['update_cards_continuation'] = continuation_data
             save_state(state)
+            compact_journal('update_cards')
             return
         card_to_update = cards_to_process[i]
         card_slug = card_to_update.get('Slug')
         if not card_slug: 
             continue
-        print(f"Aggiorno carta ({i+1}/{len(cards_to_process)}): {card_slug}")
-        details_data = sorare_graphql_fetch(OPTIMIZED_CARD_DETAILS_QUERY, {"cardSlug": card_slug})
-        if not details_data or not details_data.get("data", {}).get("anyCard"):
+        if card_slug in done_slugs:
+            continue
+        if item_retry_blocked(state, 'update_cards', card_slug):
+            continue
+        tiers = due_card_tiers(tier_refresh.get(card_slug, {}), next_game_date=card_to_update.get('Data Prossima Partita'))
+        print(f"Aggiorno carta ({i+1}/{len(cards_to_process)}): {card_slug} [{', '.join(tiers)}]")
+
+        player_api_slug = card_to_update.get('Player API Slug')
+        attempted += 1
+        fetched, error = fetch_card_tiers(card_slug, player_api_slug, tiers)
+        circuit_breaker_record(breaker, state, error)
+        if error:
+            if error in ITEM_ERROR_KINDS and not breaker['tripped']:
+                record_item_failure(state, 'update_cards', card_slug, error, breaker)
             time.sleep(1)
             continue
-        card_details = details_data["data"]["anyCard"]
-        player_info = card_details.get("player")
-        player_slug = player_info.get("slug") if player_info else None
-
-        # Get game_id from the club's upcoming games
-        upcoming_games = []
-        if player_info and player_info.get("activeClub"):
-            upcoming_games = player_info.get("activeClub", {}).get("upcomingGames", [])
-        game_id = upcoming_games[0].get("id") if upcoming_games else None
-
-        projection_data = fetch_projection(player_slug, game_id)
-        updated_row = build_updated_card_row(card_to_update, card_details, player_info, projection_data, rates)
-        try:
-            sheet.update(range_name=f'A{card_to_update["row_index"]}', values=[updated_row], value_input_option='USER_ENTERED')
-        except Exception as e:
-            print(f"Errore aggiornamento riga per {card_slug}: {e}")
+        record_item_success(state, 'update_cards', card_slug)
+        card_details, player_info, player_slug = fetched
+        if "form" not in tiers and next_game_changed(card_to_update, player_info):
+            print("  Prossima partita cambiata: aggiorno anche i dati di forma.")
+            form_fetched, _ = fetch_card_tiers(card_slug, player_api_slug, ("form",))
+            if form_fetched:
+                card_details = {**card_details, **form_fetched[0]}
+                player_info = merge_player_info(player_info, form_fetched[1])
+                tiers = tiers + ("form",)
+
+        projection_data = None
+        if "form" in tiers and ENABLED_COLUMNS.intersection(PROJECTION_COLUMNS):
+            # Get game_id from the club's upcoming games
+            upcoming_games = (player_info.get("activeClub") or {}).get("upcomingGames") or []
+            game_id = upcoming_games[0].get("id") if upcoming_games else None
+            projection_data = fetch_projection(player_slug, game_id)
+        updated_row = build_updated_card_row(card_to_update, card_details, player_info, projection_data, rates, tiers)
+        if "market" in tiers:
+            market_values = dict(zip(MAIN_SHEET_HEADERS, updated_row))
+            record_floor_samples(player_slug, market_values)
+            record_listing_sample(card_slug, market_values["Sale Price (EUR)"])
+        # Ai sink locali solo le colonne davvero aggiornate: in modalità dashboard il foglio non ha le altre
+        refreshed_columns = set(CARD_IDENTITY_COLUMNS + ["Ultimo Aggiornamento"]) | {header for tier in tiers for header in CARD_TIER_COLUMNS[tier] if header in ENABLED_COLUMNS}
+        emit_rows("cards", [{header: value for header, value in zip(MAIN_SHEET_HEADERS, updated_row) if header in refreshed_columns}])
+        pending_rows.append((card_slug, tiers, dict(zip(MAIN_SHEET_HEADERS, updated_row))))
+        if len(pending_rows) >= SHEETS_COALESCE_ROWS:
+            flush_card_rows()
         time.sleep(1)
+    flush_card_rows()
+    record_run_costs(state, 'update_cards', attempted, measure)
     print("Esecuzione completata. Pulizia dello stato.")
     if 'update_cards_continuation' in state: 
         del state['update_cards_continuation']
     save_state(state)
+    compact_journal('update_cards')
+    execution_time = time.time() - start_time
+    send_telegram_notification(f"✅ <b>Dati Carte Aggiornati (GitHub)</b>\\n\\n⏱️ Tempo: {execution_time:.2f}s{dead_letter_summary(state, 'update_cards')}")
+
+def write_sales_summary(summary_sheet, ledger_state):
+    """
+    Riscrive il foglio di riepilogo (compatto) con gli aggregati di tutte le coppie.
+    In modalità shard scrive solo le righe delle proprie coppie (vedi write_shard_summary_rows).
+    """
+    rows = []
+    for key in sorted(ledger_state):
+        entry = ledger_state[key]
+        # Lo stato di uno shard parte da quello comune: le coppie degli altri shard non sono sue
+        if not in_shard(entry.get('slug')):
+            continue
+        recent_sales = [{"timestamp": ts, "price": price, "seasonEligibility": eligibility} for ts, price, eligibility in entry.get('recent', [])]
+        rows.append(build_sales_history_row(entry.get('name'), entry.get('slug'), entry.get('rarity'), recent_sales, SALES_SUMMARY_HEADERS))
+    emit_rows("sales_summary", [dict(zip(SALES_SUMMARY_HEADERS, row)) for row in rows])
+    if SHARD_COUNT > 1:
+        write_shard_summary_rows(summary_sheet, rows)
+        return
+    sheets_write(summary_sheet.resize, rows=len(rows) + 1, cols=len(SALES_SUMMARY_HEADERS))
+    sheets_write(summary_sheet.update, range_name='A1', values=[SALES_SUMMARY_HEADERS] + rows, value_input_option='USER_ENTERED')
+
+def write_shard_summary_rows(summary_sheet, rows):
+    """
+    Scrittura del riepilogo di uno shard senza toccare le righe degli altri: update per posizione
+    delle coppie già presenti (in modalità shard nessuno cancella, ridimensiona o riordina il foglio)
+    e append_rows per quelle nuove. Le coppie uscite dalla galleria restano fino alla prossima
+    riscrittura completa senza shard.
+    """
+    slug_col = SALES_SUMMARY_HEADERS.index("Player API Slug")
+    positions = {(row[slug_col], row[slug_col + 1]): i + 1 for i, row in enumerate(summary_sheet.get_all_values()) if i and len(row) > slug_col + 1 and row[slug_col]}
+    updates, new_rows = [], []
+    for row in rows:
+        row_index = positions.get((str(row[slug_col]), str(row[slug_col + 1])))
+        if row_index:
+            updates.append({'range': f'A{row_index}', 'values': [row]})
+        else:
+            new_rows.append(row)
+    if updates:
+        sheets_batch_update(summary_sheet, updates, value_input_option='USER_ENTERED')
+    if new_rows:
+        sheets_write(summary_sheet.append_rows, new_rows, value_input_option='USER_ENTERED', table_range='A1')
+
+def update_sales_ledger():
+    """
+    Layout "ledger": ogni nuova vendita diventa una riga del registro (append_rows a blocchi,
+    mai riscritture) e gli aggregati per coppia vanno nel foglio di riepilogo.
+    Per ogni coppia lo stato conserva l'ultima vendita registrata e la finestra di
+    SALES_SUMMARY_WINDOW_DAYS giorni necessaria a calcolare le medie.
+    """
+    print("--- INIZIO AGGIORNAMENTO REGISTRO VENDITE (LEDGER) ---")
+    start_time, state = time.time(), load_state()
+    continuation_data = state.get('update_sales_continuation', {})
+    start_index = continuation_data.get('last_index', 0)
+    ledger_state = state.setdefault('sales_ledger', {})
+    try:
+        spreadsheet = open_spreadsheet()
+        main_sheet = open_worksheet(spreadsheet, MAIN_SHEET_NAME)
+        ledger_sheet = get_or_create_worksheet(spreadsheet, SALES_LEDGER_SHEET_NAME, SALES_LEDGER_HEADERS)
+        summary_sheet = get_or_create_worksheet(spreadsheet, SALES_SUMMARY_SHEET_NAME, SALES_SUMMARY_HEADERS)
+    except Exception as e:
+        print(f"ERRORE CRITICO GSheets: {e}")
+        return
+    # Le voci del registro già scritte prima di un'interruzione tornano nello stato
+    journaled = load_journal('update_sales')
+    ledger_state.update(journaled)
+
+    if start_index == 0:
+        continuation_data['pairs_to_process'] = [pair for pair in collect_sales_pairs(read_sheet_records(main_sheet)) if in_shard(pair['slug'])]
+    pairs_to_process = continuation_data.get('pairs_to_process', [])
+    print(f"Processamento: {len(pairs_to_process)} coppie giocatore-rarità")
+
+    new_sales_count = 0
+
+    def sales_limit_for(pair):
+        return MAX_SALES_FROM_API
+
+    def process_pair(i, pair, api_data):
+        key = f"{pair['slug']}::{pair['rarity']}"
+        print(f"📊 ({i+1}/{len(pairs_to_process)}): {pair['name']} ({pair['rarity']})")
+        api_sales = parse_api_sales(api_data)
+        # Si lavora su una copia: la voce dello stato cambia solo dopo la scrittura (flush_ledger),
+        # così un flush fallito non fa avanzare last_timestamp oltre vendite mai registrate
+        entry = ledger_state.get(key)
+        if entry is None:
+            # Coppia nuova: qui solo le vendite recenti, la storia profonda la carica backfill_sales
+            entry = {"name": pair['name'], "slug": pair['slug'], "rarity": pair['rarity'], "last_timestamp": 0, "recent": []}
+            enqueue_sales_backfill(state, pair)
+        entry = {**entry, "name": pair['name'], "recent": list(entry['recent'])}
+        # La prima vendita è nota solo per le coppie registrate da zero: per le voci più vecchie
+        # la ricava backfill_sales dal registro
+        empty_entry = entry['last_timestamp'] == 0
+
+        new_sales = sorted({int(s['timestamp']): s for s in api_sales if s['timestamp'] > entry['last_timestamp']}.values(), key=lambda x: x['timestamp'])
+        ledger_rows = build_ledger_rows(pair, new_sales)
+        for sale in new_sales:
+            entry['recent'].append([sale['timestamp'], sale['price'], sale['seasonEligibility']])
+        if new_sales:
+            entry['last_timestamp'] = new_sales[-1]['timestamp']
+            if empty_entry:
+                entry.setdefault('first_timestamp', new_sales[0]['timestamp'])
+            print(f"  🆕 {len(new_sales)} nuove vendite")
+        window_start_ms = (time.time() - SALES_SUMMARY_WINDOW_DAYS * 86400) * 1000
+        entry['recent'] = sorted([s for s in entry['recent'] if s[0] >= window_start_ms], key=lambda s: s[0], reverse=True)
+        return key, entry, ledger_rows
+
+    def flush_ledger(batches):
+        nonlocal new_sales_count
+        ledger_rows = [row for _, _, rows in batches for row in rows]
+        if ledger_rows and not sheets_dashboard_only():
+            # In modalità dashboard lo storico completo resta nei sink locali: su Sheets solo il riepilogo
+            print(f"➕ Registro: {len(ledger_rows)} nuove vendite...")
+            sheets_write(ledger_sheet.append_rows, ledger_rows, value_input_option='USER_ENTERED')
+        # Ai sink (in append) solo dopo la scrittura sul foglio: un flush fallito si ripete senza doppioni
+        emit_rows("sales_ledger", [dict(zip(SALES_LEDGER_HEADERS, row)) for row in ledger_rows])
+        new_sales_count += len(ledger_rows)
+        for key, entry, _ in batches:
+            ledger_state[key] = entry
+        journal_append('update_sales', {key: entry for key, entry, _ in batches})
+
+    skip_indices = set(continuation_data.get('completed_indices', [])) | journaled_pair_indices(pairs_to_process, journaled)
+    pending_indices = [i for i in range(start_index, len(pairs_to_process)) if i not in skip_indices and not item_retry_blocked(state, 'update_sales', f"{pairs_to_process[i]['slug']}::{pairs_to_process[i]['rarity']}")]
+    breaker, measure = new_circuit_breaker(), start_cost_measure()
+    completed = asyncio.run(run_sales_pipeline(pairs_to_process, pending_indices, sales_limit_for, process_pair, flush_ledger, start_time + SALES_TIMEOUT_SECONDS, sales_failure_handler(state, pairs_to_process, breaker)))
+    record_run_costs(state, 'update_sales', len(completed), measure)
+    notify_circuit_breaker("Registro Vendite", breaker)
+    if save_sales_continuation(state, continuation_data, pairs_to_process, pending_indices, completed):
+        write_sales_summary(summary_sheet, ledger_state)
+        save_state(state)
+        return
+
+    # Le coppie non più in galleria escono dal riepilogo
+    active_keys = {f"{pair['slug']}::{pair['rarity']}" for pair in pairs_to_process}
+    for stale_key in [key for key in ledger_state if key not in active_keys]:
+        del ledger_state[stale_key]
+    prune_item_failures(state, 'update_sales', active_keys)
+    write_sales_summary(summary_sheet, ledger_state)
+    print("✅ Registro vendite aggiornato!")
+    if 'update_sales_continuation' in state: 
+        del state['update_sales_continuation']
+    save_state(state)
+    compact_journal('update_sales')
+
     execution_time = time.time() - start_time
-    send_telegram_notification(f"✅ <b>Dati Carte Aggiornati (GitHub)</b>\\n\\n⏱️ Tempo: {execution_time:.2f}s")
+    send_telegram_notification(f"✅ <b>Registro Vendite Aggiornato</b>\\n\\n⏱️ Tempo: {execution_time:.2f}s\\n📊 {len(pairs_to_process)} giocatori processati\\n➕ {new_sales_count} nuove vendite{dead_letter_summary(state, 'update_sales')}")
 
 def update_sales():
+    if SALES_LAYOUT == "ledger":
+        update_sales_ledger()
+        return
     print("--- INIZIO AGGIORNAMENTO CRONOLOGIA VENDITE (SOLUZIONE FORMATO STRINGA) ---")
     start_time, state = time.time(), load_state()
     continuation_data = state.get('update_sales_continuation', {})
     start_index = continuation_data.get('last_index', 0)
     try:
-        credentials = json.loads(GSPREAD_CREDENTIALS_JSON)
-        gc = gspread.service_account_from_dict(credentials)
-        spreadsheet = gc.open_by_key(SPREADSHEET_ID)
-        main_sheet = spreadsheet.worksheet(MAIN_SHEET_NAME)
+        spreadsheet = open_spreadsheet()
+        main_sheet = open_worksheet(spreadsheet, MAIN_SHEET_NAME)
         try:
-            sales_sheet = spreadsheet.worksheet(SALES_HISTORY_SHEET_NAME)
+            sales_sheet = open_worksheet(spreadsheet, SALES_HISTORY_SHEET_NAME)
         except gspread.WorksheetNotFound:
             sales_sheet = None
     except Exception as e:
@@ -641,26 +2679,21 @@ def update_sales():
         return
     
     # Prepara gli header attesi
-    expected_headers = ["Player Name", "Player API Slug", "Rarity Searched", "Sales Today (In-Season)", "Sales Today (Classic)"]
-    periods = [3, 7, 14, 30]
-    for p in periods: 
-        expected_headers.extend([f"Avg Price {p}d (In-Season)", f"Avg Price {p}d (Classic)"])
-    for j in range(1, MAX_SALES_TO_DISPLAY + 1): 
-        expected_headers.extend([f"Sale {j} Date", f"Sale {j} Price (EUR)", f"Sale {j} Eligibility"])
-    expected_headers.append("Last Updated")
+    expected_headers = build_sales_history_headers()
     
     num_expected_cols = len(expected_headers)
     print(f"Colonne attese: {num_expected_cols}")
     
     # LOGICA INTELLIGENTE: Controlla salute del foglio
     sheet_needs_recreation = False
+    sheet_values = []
     
     if sales_sheet is None:
         print("Foglio non esistente. Sarà creato.")
         sheet_needs_recreation = True
     else:
         print("Controllo salute del foglio esistente...")
-        is_healthy, needs_recreation, error_msg = check_sheet_health(sales_sheet, expected_headers)
+        is_healthy, needs_recreation, error_msg, sheet_values = check_sheet_health(sales_sheet, expected_headers)
         print(f"Stato foglio: {error_msg}")
         
         if needs_recreation:
@@ -673,12 +2706,12 @@ def update_sales():
                 current_cols = sales_sheet.col_count
                 if current_cols != num_expected_cols:
                     print(f"Ridimensionamento: {current_cols} -> {num_expected_cols} colonne")
-                    sales_sheet.resize(rows=max(1000, sales_sheet.row_count), cols=num_expected_cols)
+                    sheets_write(sales_sheet.resize, rows=max(1000, sales_sheet.row_count), cols=num_expected_cols)
                 
                 # Aggiorna header se necessario
-                sales_sheet.update(range_name='A1', values=[expected_headers])
+                sheets_write(sales_sheet.update, range_name='A1', values=[expected_headers])
                 header_range = f'A1:{chr(64 + min(num_expected_cols, 26))}1' if num_expected_cols <= 26 else f'A1:{chr(64 + (num_expected_cols-1)//26)}{chr(65 + ((num_expected_cols-1)%26))}1'
-                sales_sheet.format(header_range, {'textFormat': {'bold': True}})
+                sheets_write(sales_sheet.format, header_range, {'textFormat': {'bold': True}})
                 print("✅ Foglio sistemato senza ricreazione")
             except Exception as e:
                 print(f"❌ Sistemazione fallita: {e}. Procedo con ricreazione.")
@@ -687,53 +2720,52 @@ def update_sales():
             print("✅ FOGLIO SANO: Uso logica database normale")
     
     # RICREAZIONE FOGLIO (solo se necessario)
+    if sheet_needs_recreation and SHARD_INDEX != 0:
+        print("Ricreazione del foglio riservata allo shard 0: questo shard termina.")
+        return
     if sheet_needs_recreation:
         print("🔄 RICREAZIONE FOGLIO IN CORSO...")
         
         # Elimina foglio esistente se presente
         if sales_sheet:
             try:
-                spreadsheet.del_worksheet(sales_sheet)
+                sheets_write(spreadsheet.del_worksheet, sales_sheet)
+                forget_worksheet(spreadsheet, SALES_HISTORY_SHEET_NAME)
                 print("Foglio eliminato.")
             except Exception as e:
                 print(f"Errore eliminazione: {e}")
         
         # Crea nuovo foglio
-        sales_sheet = spreadsheet.add_worksheet(
+        sales_sheet = remember_worksheet(spreadsheet, sheets_write(
+            spreadsheet.add_worksheet,
             title=SALES_HISTORY_SHEET_NAME, 
             rows=1000, 
             cols=num_expected_cols
-        )
+        ))
         
         # Aggiungi header
-        sales_sheet.update(range_name='A1', values=[expected_headers])
+        sheets_write(sales_sheet.update, range_name='A1', values=[expected_headers])
         header_range = f'A1:{chr(64 + min(num_expected_cols, 26))}1' if num_expected_cols <= 26 else f'A1:{chr(64 + (num_expected_cols-1)//26)}{chr(65 + ((num_expected_cols-1)%26))}1'
-        sales_sheet.format(header_range, {'textFormat': {'bold': True}})
+        sheets_write(sales_sheet.format, header_range, {'textFormat': {'bold': True}})
         
         print(f"✅ Nuovo foglio creato: {num_expected_cols} colonne esatte")
         
         # Reset continuation data since sheet is new
         continuation_data = {'pairs_to_process': [], 'existing_sales_map': {}, 'last_index': 0}
+        compact_journal('update_sales')
         start_index = 0
     
     # LOGICA DATABASE NORMALE
     if start_index == 0:
         print("Preparazione dati per aggiornamento database...")
-        main_records = main_sheet.get_all_records()
-        pairs_map = {}
-        for record in main_records:
-            slug, rarity = record.get("Player API Slug"), record.get("Rarity")
-            if slug and rarity:
-                key = f"{slug}::{rarity.lower()}"
-                if key not in pairs_map: 
-                    pairs_map[key] = {"slug": slug, "rarity": rarity.lower(), "name": record.get("Player Name")}
-        continuation_data['pairs_to_process'] = list(pairs_map.values())
+        continuation_data['pairs_to_process'] = [pair for pair in collect_sales_pairs(read_sheet_records(main_sheet)) if in_shard(pair['slug'])]
         
         # Leggi dati esistenti se il foglio non è stato ricreato
         if not sheet_needs_recreation:
-            print("Lettura storico vendite esistente...")
+            print("Lettura storico vendite esistente (dai valori del controllo di salute)...")
             try:
-                existing_records = sales_sheet.get_all_records()
+                # Dopo una sistemazione gli header validi sono quelli appena scritti
+                existing_records = records_from_values(sheet_values, expected_headers)
                 continuation_data['existing_sales_map'] = { 
                     f"{rec.get('Player API Slug')}::{rec.get('Rarity Searched')}": 
                     {"row_index": i + 2, "record": rec} 
@@ -748,125 +2780,515 @@ def update_sales():
     
     pairs_to_process = continuation_data.get('pairs_to_process', [])
     existing_sales_map = continuation_data.get('existing_sales_map', {})
-    updates_to_batch = []
-    new_rows_to_append = []
     headers = expected_headers
 
     print(f"Processamento: {len(pairs_to_process)} coppie giocatore-rarità")
-    
-    for i in range(start_index, len(pairs_to_process)):
-        if time.time() - start_time > 480: # 8 minuti timeout
-            print(f"⏰ Timeout imminente. Salvo stato all'indice {i}.")
-            continuation_data['last_index'] = i
-            state['update_sales_continuation'] = continuation_data
-            save_state(state)
-            if updates_to_batch: 
-                sales_sheet.batch_update(updates_to_batch, value_input_option='USER_ENTERED')
-            if new_rows_to_append: 
-                sales_sheet.append_rows(new_rows_to_append, value_input_option='USER_ENTERED')
-            return
-        
-        pair = pairs_to_process[i]
+
+    def sales_limit_for(pair):
+        return MAX_SALES_FROM_API
+
+    def process_pair(i, pair, api_data):
         key = f"{pair['slug']}::{pair['rarity']}"
         print(f"📊 ({i+1}/{len(pairs_to_process)}): {pair['name']} ({pair['rarity']})")
-        
         existing_info = existing_sales_map.get(key)
-        sales_to_fetch = MAX_SALES_FROM_API if existing_info else INITIAL_SALES_FETCH_COUNT
-        
-        # Fetch nuove vendite dall'API
-        api_data = sorare_graphql_fetch(PLAYER_TOKEN_PRICES_QUERY, {
-            "playerSlug": pair['slug'], 
-            "rarity": pair['rarity'], 
-            "limit": sales_to_fetch
-        })
+        if not existing_info:
+            # Coppia nuova: qui solo le vendite recenti, la storia profonda la carica backfill_sales
+            enqueue_sales_backfill(state, pair)
         
-        new_sales_from_api = []
-        if api_data and api_data.get("data") and not api_data.get("errors"):
-            for sale in api_data["data"].get("tokens", {}).get("tokenPrices", []):
-                # CORREZIONE CRITICA BUG CACHE: SALVA SEMPRE IL PREZZO GIÀ CONVERTITO
-                api_price_eur = sale['amounts']['eurCents'] / 100  # Convertito qui
-                new_sales_from_api.append({
-                    "timestamp": datetime.strptime(sale['date'], "%Y-%m-%dT%H:%M:%SZ").timestamp() * 1000, 
-                    "price": api_price_eur,  # SALVATO GIÀ IN EUR NELLA CACHE
-                    "seasonEligibility": "IN_SEASON" if sale['card']['inSeasonEligible'] else "CLASSIC"
-                })
-                if len(new_sales_from_api) <= 3:  # Debug log
-                    print(f"  🆕 API (cache): {api_price_eur} EUR (da {sale['amounts']['eurCents']} cents)")
-        
-        # Recupera vendite esistenti dal foglio CON CORREZIONE AUTOMATICA
-        old_sales_from_sheet = []
-        if existing_info:
-            record = existing_info['record']
-            print(f"  📄 Leggo vendite esistenti dal foglio...")
-            
-            # Estrai i prezzi API per il confronto
-            api_prices_for_comparison = [s['price'] for s in new_sales_from_api]
-            
-            for j in range(1, MAX_SALES_TO_DISPLAY + 1):
-                date_str, price_val = record.get(f"Sale {j} Date"), record.get(f"Sale {j} Price (EUR)")
-                if date_str and price_val:
-                    raw_price = parse_price(price_val)  # parse_price restituisce il valore raw dal foglio
-                    if raw_price is not None:
-                        # CORREZIONE AUTOMATICA: Confronta con i prezzi API
-                        corrected_price = smart_price_correction(raw_price, api_prices_for_comparison)
-                        
-                        try:
-                            timestamp = datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S').timestamp() * 1000
-                            eligibility = record.get(f"Sale {j} Eligibility")
-                            old_sales_from_sheet.append({
-                                "timestamp": timestamp, 
-                                "price": corrected_price,  # USA IL PREZZO CORRETTO
-                                "seasonEligibility": eligibility
-                            })
-                            if j <= 3:  # Debug log
-                                correction_note = " (corretto)" if corrected_price != raw_price else ""
-                                print(f"  📄 Foglio Sale {j}: {corrected_price} EUR{correction_note}")
-                        except (ValueError, TypeError):
-                            continue
+        updated_row = merge_sales_history(pair, api_data, existing_info, headers)
         
-        # Combina e deduplica vendite
-        print(f"  🔄 Combinazione: {len(new_sales_from_api)} nuove + {len(old_sales_from_sheet)} esistenti")
-        all_sales = new_sales_from_api + old_sales_from_sheet
-        unique_sales = {int(s['timestamp']): s for s in all_sales}  # Dedup by timestamp
-        combined_sales = sorted(unique_sales.values(), key=lambda x: x['timestamp'], reverse=True)[:MAX_SALES_TO_DISPLAY]
-        
-        print(f"  ✅ Risultato finale: {len(combined_sales)} vendite uniche")
-        
-        # 🚀 CREA RIGA AGGIORNATA CON FORMATTAZIONE STRINGA
-        updated_row = build_sales_history_row(pair['name'], pair['slug'], pair['rarity'], combined_sales, headers)
-        
-        # Aggiungi all'aggiornamento o nuova riga
-        if existing_info:
-            updates_to_batch.append({'range': f'A{existing_info["row_index"]}', 'values': [updated_row]})
-        else:
-            new_rows_to_append.append(updated_row)
-            # Calcola la prossima row_index disponibile per future reference
-            next_row = len(existing_sales_map) + len(new_rows_to_append) + 2  # +1 for header, +1 for 1-based indexing
-            existing_sales_map[key] = {'row_index': next_row, 'record': {}}
-        
-        time.sleep(1)
-    
-    # Applica aggiornamenti
-    if updates_to_batch:
-        print(f"📝 Aggiornamento {len(updates_to_batch)} righe esistenti...")
-        sales_sheet.batch_update(updates_to_batch, value_input_option='USER_ENTERED')
-    
-    if new_rows_to_append:
-        print(f"➕ Aggiunta {len(new_rows_to_append)} nuove righe...")
-        sales_sheet.append_rows(new_rows_to_append, value_input_option='USER_ENTERED')
+        return key, existing_info, updated_row
+
+    def flush_sales(rows):
+        emit_rows("sales", [dict(zip(headers, updated_row)) for _, _, updated_row in rows])
+        updates_to_batch = [{'range': f'A{existing_info["row_index"]}', 'values': [updated_row]} for _, existing_info, updated_row in rows if existing_info]
+        new_rows = [(key, updated_row) for key, existing_info, updated_row in rows if not existing_info]
+        if updates_to_batch:
+            print(f"📝 Aggiornamento {len(updates_to_batch)} righe esistenti...")
+            sheets_batch_update(sales_sheet, updates_to_batch, value_input_option='USER_ENTERED')
+        if new_rows:
+            print(f"➕ Aggiunta {len(new_rows)} nuove righe...")
+            response = sheets_write(sales_sheet.append_rows, [updated_row for _, updated_row in new_rows], value_input_option='USER_ENTERED')
+            # La riga la dice la risposta: con --shard altri processi aggiungono in coda allo stesso foglio.
+            # Senza updatedRange la coppia resta fuori dalla mappa (è comunque nel journal)
+            for (key, _), row_index in zip(new_rows, appended_row_indices(response, len(new_rows)) or []):
+                existing_sales_map[key] = {'row_index': row_index, 'record': {}}
+        journal_append('update_sales', {key: None for key, _, _ in rows})
+
+    # Dopo un'interruzione il foglio (appena riletto) contiene già le righe scritte: basta saltarle
+    journaled = load_journal('update_sales')
+    skip_indices = set(continuation_data.get('completed_indices', [])) | journaled_pair_indices(pairs_to_process, journaled)
+    pending_indices = [i for i in range(start_index, len(pairs_to_process)) if i not in skip_indices and not item_retry_blocked(state, 'update_sales', f"{pairs_to_process[i]['slug']}::{pairs_to_process[i]['rarity']}")]
+    breaker, measure = new_circuit_breaker(), start_cost_measure()
+    completed = asyncio.run(run_sales_pipeline(pairs_to_process, pending_indices, sales_limit_for, process_pair, flush_sales, start_time + SALES_TIMEOUT_SECONDS, sales_failure_handler(state, pairs_to_process, breaker)))
+    record_run_costs(state, 'update_sales', len(completed), measure)
+    notify_circuit_breaker("Cronologia Vendite", breaker)
+    if save_sales_continuation(state, continuation_data, pairs_to_process, pending_indices, completed):
+        return
     
     # Cleanup
     print("✅ Aggiornamento database completato con formato stringa forzato!")
+    prune_item_failures(state, 'update_sales', {f"{pair['slug']}::{pair['rarity']}" for pair in pairs_to_process})
     if 'update_sales_continuation' in state: 
         del state['update_sales_continuation']
     save_state(state)
+    compact_journal('update_sales')
     
     execution_time = time.time() - start_time
     recreation_msg = " (Foglio ricreato)" if sheet_needs_recreation else " (Database aggiornato)"
-    send_telegram_notification(f"✅ <b>Cronologia Vendite Aggiornata</b>{recreation_msg}\\n\\n⏱️ Tempo: {execution_time:.2f}s\\n📊 {len(pairs_to_process)} giocatori processati\\n🚀 Formato stringa applicato")
+    send_telegram_notification(f"✅ <b>Cronologia Vendite Aggiornata</b>{recreation_msg}\\n\\n⏱️ Tempo: {execution_time:.2f}s\\n📊 {len(pairs_to_process)} giocatori processati\\n🚀 Formato stringa applicato{dead_letter_summary(state, 'update_sales')}")
+
+def build_ledger_rows(pair, sales, recorded_at=None):
+    """Righe del Registro Vendite (una per vendita) nel formato di SALES_LEDGER_HEADERS."""
+    recorded_at = recorded_at or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return [[
+        pair['name'], pair['slug'], pair['rarity'],
+        datetime.fromtimestamp(sale['timestamp']/1000).strftime('%Y-%m-%d %H:%M:%S'),
+        format_price_as_string(sale['price']), sale['seasonEligibility'], recorded_at
+    ] for sale in sales]
+
+def ledger_first_timestamps(ledger_sheet):
+    """Prima vendita già presente nel Registro per ogni coppia: {"slug::rarità": timestamp in ms}."""
+    first = {}
+    for row in ledger_sheet.get('B2:D') or []:
+        if len(row) < 3:
+            continue
+        try:
+            timestamp = datetime.strptime(row[2], '%Y-%m-%d %H:%M:%S').timestamp() * 1000
+        except ValueError:
+            continue
+        key = f"{row[0]}::{row[1]}"
+        first[key] = min(first.get(key, timestamp), timestamp)
+    return first
+
+def enqueue_sales_backfill(state, pair):
+    """Mette in coda una coppia per backfill_sales (una sola volta per coppia)."""
+    key = f"{pair['slug']}::{pair['rarity']}"
+    queue_state = state.setdefault('sales_backfill_queue', {})
+    if key not in queue_state and key not in state.get('sales_backfilled', {}):
+        queue_state[key] = {"slug": pair['slug'], "rarity": pair['rarity'], "name": pair.get('name'), "queued_at": time.time()}
+
+def parse_backfill_request(arg):
+    """Coppia richiesta da riga di comando: "player-slug:rarità" (o "player-slug::rarità")."""
+    slug, _, rarity = arg.replace("::", ":").partition(":")
+    if not slug or rarity.lower() not in GALLERY_RARITIES:
+        raise ValueError(f"coppia non valida '{arg}': usa player-slug:rarità ({', '.join(GALLERY_RARITIES)})")
+    return {"slug": slug, "rarity": rarity.lower(), "name": None}
+
+def backfill_sales(requested=()):
+    """
+    Carica la cronologia profonda di tokenPrices (BACKFILL_SALES_COUNT vendite) per le coppie
+    in coda (aggiunte da update_sales quando compare una coppia nuova) o richieste a mano.
+    Fetch molto concorrenti, caricamento a blocchi di BACKFILL_LOAD_BATCH_PAIRS coppie
+    (un solo append/batch_update per blocco) e progressi salvati dopo ogni blocco.
+    """
+    print("--- INIZIO BACKFILL CRONOLOGIA VENDITE ---")
+    start_time, state = time.time(), load_state()
+    queue_state = state.setdefault('sales_backfill_queue', {})
+    backfilled = state.setdefault('sales_backfilled', {})
+    for pair in requested:
+        backfilled.pop(f"{pair['slug']}::{pair['rarity']}", None)
+        enqueue_sales_backfill(state, pair)
+    # Blocchi già caricati prima di un'interruzione
+    for key, done_at in load_journal('backfill_sales').items():
+        queue_state.pop(key, None)
+        backfilled[key] = done_at
+    pending = [(key, entry) for key, entry in sorted(queue_state.items(), key=lambda item: item[1].get('queued_at', 0)) if in_shard(entry['slug']) and not item_retry_blocked(state, 'backfill_sales', key)]
+    if not pending:
+        print("Nessuna coppia da caricare.")
+        save_state(state)
+        compact_journal('backfill_sales')
+        return
+    print(f"{len(pending)} coppie in coda per il backfill.")
+    try:
+        spreadsheet = open_spreadsheet()
+        if SALES_LAYOUT == "ledger":
+            ledger_sheet = get_or_create_worksheet(spreadsheet, SALES_LEDGER_SHEET_NAME, SALES_LEDGER_HEADERS)
+            ledger_state = state.setdefault('sales_ledger', {})
+            # Voci registrate prima che lo stato tenesse la prima vendita: la si legge dal registro
+            legacy_keys = [key for key, _ in pending if key in ledger_state and not ledger_state[key].get('first_timestamp') and ledger_state[key].get('last_timestamp')]
+            first_recorded = ledger_first_timestamps(ledger_sheet) if legacy_keys and not sheets_dashboard_only() else {}
+        else:
+            sales_sheet = open_worksheet(spreadsheet, SALES_HISTORY_SHEET_NAME)
+            headers = build_sales_history_headers()
+            existing_sales_map = {f"{rec.get('Player API Slug')}::{rec.get('Rarity Searched')}": {"row_index": i + 2, "record": rec} for i, rec in enumerate(read_sheet_records(sales_sheet))}
+            # Intervallo [prima, ultima] delle vendite già inviate al sink sales_ledger per coppia:
+            # resta anche se la coppia esce dalla galleria, così un nuovo backfill non le duplica
+            exported_ranges = state.setdefault('sales_ledger_exported', {})
+    except Exception as e:
+        print(f"ERRORE CRITICO GSheets: {e}")
+        return
+
+    breaker, measure = new_circuit_breaker(), start_cost_measure()
+    loaded_pairs, loaded_sales, attempted = 0, 0, 0
+    with ThreadPoolExecutor(max_workers=BACKFILL_CONCURRENCY) as executor:
+        for batch_start in range(0, len(pending), BACKFILL_LOAD_BATCH_PAIRS):
+            if time.time() - start_time > BACKFILL_TIMEOUT_SECONDS or stop_requested() or breaker['tripped']:
+                print(f"⏰ Backfill interrotto: {len(pending) - batch_start} coppie restano in coda.")
+                break
+            batch = pending[batch_start:batch_start + BACKFILL_LOAD_BATCH_PAIRS]
+            attempted += len(batch)
+            results = executor.map(lambda item: fetch_pair_token_prices(item[1], BACKFILL_SALES_COUNT), batch)
+            ledger_rows, sheet_updates, done = [], [], {}
+            for (key, pair), (api_data, error) in zip(batch, results):
+                circuit_breaker_record(breaker, state, error)
+                if error:
+                    if error in ITEM_ERROR_KINDS and not breaker['tripped']:
+                        record_item_failure(state, 'backfill_sales', key, error, breaker)
+                    continue
+                record_item_success(state, 'backfill_sales', key)
+                sales = sorted(parse_api_sales(api_data), key=lambda sale: sale['timestamp'])
+                if SALES_LAYOUT == "ledger":
+                    entry = ledger_state.get(key)
+                    if entry is None:
+                        continue  # la coppia non è ancora nel registro: la crea update_sales
+                    pair = {**pair, "name": pair.get('name') or entry.get('name')}
+                    # Solo le vendite più vecchie della prima già registrata: niente doppioni.
+                    # Una coppia senza vendite registrate (last_timestamp 0) prende tutto.
+                    cutoff = entry.get('first_timestamp') or first_recorded.get(key)
+                    if not cutoff and entry.get('last_timestamp'):
+                        print(f"AVVISO: {key}: prima vendita del registro sconosciuta, backfill saltato per non duplicare righe.")
+                        done[key] = time.time()
+                        continue
+                    older_sales = [sale for sale in sales if not cutoff or sale['timestamp'] < cutoff]
+                    ledger_rows.extend(build_ledger_rows(pair, older_sales))
+                    if older_sales:
+                        entry['first_timestamp'] = older_sales[0]['timestamp']
+                        # update_sales riparte dall'ultima vendita registrata, anche se l'ha scritta il backfill
+                        entry['last_timestamp'] = max(entry.get('last_timestamp', 0), older_sales[-1]['timestamp'])
+                    elif cutoff:
+                        entry['first_timestamp'] = cutoff
+                    window_start_ms = (time.time() - SALES_SUMMARY_WINDOW_DAYS * 86400) * 1000
+                    entry['recent'] = sorted({s[0]: s for s in entry.get('recent', []) + [[sale['timestamp'], sale['price'], sale['seasonEligibility']] for sale in older_sales if sale['timestamp'] >= window_start_ms]}.values(), key=lambda s: s[0], reverse=True)
+                    loaded_sales += len(older_sales)
+                else:
+                    existing_info = existing_sales_map.get(key)
+                    if not existing_info:
+                        continue  # la riga non esiste ancora: la crea update_sales
+                    pair = {**pair, "name": pair.get('name') or existing_info['record'].get("Player Name")}
+                    updated_row = merge_sales_history(pair, api_data, existing_info, headers)
+                    sheet_updates.append({'range': f'A{existing_info["row_index"]}', 'values': [updated_row]})
+                    emit_rows("sales", [dict(zip(headers, updated_row))])
+                    # La cronologia oltre MAX_SALES_TO_DISPLAY resta solo nei sink locali. Il dataset è in
+                    # append: si esportano solo le vendite fuori dall'intervallo già esportato per la coppia
+                    if OUTPUT_SINKS:
+                        exported = exported_ranges.get(key)
+                        new_sales = [sale for sale in sales if not exported or not exported[0] <= sale['timestamp'] <= exported[1]]
+                        emit_rows("sales_ledger", [dict(zip(SALES_LEDGER_HEADERS, row)) for row in build_ledger_rows(pair, new_sales)])
+                        if sales:
+                            timestamps = [sale['timestamp'] for sale in sales] + (exported or [])
+                            exported_ranges[key] = [min(timestamps), max(timestamps)]
+                    loaded_sales += len(sales)
+                done[key] = time.time()
+            if ledger_rows:
+                emit_rows("sales_ledger", [dict(zip(SALES_LEDGER_HEADERS, row)) for row in ledger_rows])
+                if not sheets_dashboard_only():
+                    print(f"➕ Registro: {len(ledger_rows)} vendite storiche...")
+                    sheets_write(ledger_sheet.append_rows, ledger_rows, value_input_option='USER_ENTERED')
+            if sheet_updates:
+                print(f"📝 Cronologia: {len(sheet_updates)} righe con la storia completa...")
+                sheets_batch_update(sales_sheet, sheet_updates, value_input_option='USER_ENTERED')
+                for update in sheet_updates:
+                    patch_sheet_snapshot(sales_sheet, gspread.utils.a1_to_rowcol(update['range'])[0], dict(zip(headers, update['values'][0])))
+            journal_append('backfill_sales', done)
+            for key in done:
+                queue_state.pop(key, None)
+            backfilled.update(done)
+            loaded_pairs += len(done)
+            save_state(state)
+    notify_circuit_breaker("Backfill Vendite", breaker)
+    # Le coppie non più in galleria escono dallo storico del backfill; in coda restano al massimo un giorno
+    active_keys = set(ledger_state) if SALES_LAYOUT == "ledger" else set(existing_sales_map)
+    for stale_key in [key for key in backfilled if key not in active_keys]:
+        del backfilled[stale_key]
+    for stale_key in [key for key, entry in queue_state.items() if key not in active_keys and time.time() - entry.get('queued_at', 0) > 86400]:
+        del queue_state[stale_key]
+    record_run_costs(state, 'backfill_sales', attempted, measure)
+    save_state(state)
+    compact_journal('backfill_sales')
+    execution_time = time.time() - start_time
+    print(f"✅ Backfill: {loaded_pairs} coppie, {loaded_sales} vendite storiche in {execution_time:.2f}s.")
+    send_telegram_notification(f"✅ <b>Backfill Vendite</b>\\n\\n⏱️ Tempo: {execution_time:.2f}s\\n📊 {loaded_pairs} coppie caricate ({len(queue_state)} in coda)\\n➕ {loaded_sales} vendite storiche{dead_letter_summary(state, 'backfill_sales')}")
+
+def fetch_player_floors(player_slugs):
+    """Scarica i floor di un blocco di giocatori con una sola richiesta. Ritorna {slug: dati giocatore}."""
+    variables = {f"p{i}": slug for i, slug in enumerate(player_slugs)}
+    data = sorare_graphql_fetch(build_player_floors_query(len(player_slugs)), variables)
+    football = ((data or {}).get("data") or {}).get("football") or {}
+    return {player_slugs[i]: football[f"p{i}"] for i in range(len(player_slugs)) if football.get(f"p{i}")}
+
+def write_floor_updates(sheet, all_sheet_records, floors_by_player, rates, skip_slugs=(), sink=None):
+    """
+    Aggiorna le colonne FLOOR delle righe dei giocatori in floors_by_player tramite il SheetsSink
+    di Foglio1 (un'unica batch_update). Con sink le righe si accodano e il flush resta al chiamante.
+    """
+    floor_headers = [header for header in MAIN_SHEET_HEADERS if header in FLOOR_COLUMN_ALIASES]
+    for player_slug, player_info in floors_by_player.items():
+        record_floor_samples(player_slug, {header: calculate_eur_price(player_info.get(alias), rates) for header, alias in FLOOR_COLUMN_ALIASES.items() if header in ENABLED_COLUMNS})
+    rows = []
+    for record in all_sheet_records:
+        player_info = floors_by_player.get(record.get('Player API Slug'))
+        if not player_info or record.get('Slug') in skip_slugs:
+            continue
+        rows.append({"Slug": record.get('Slug'), **{header: calculate_eur_price(player_info.get(FLOOR_COLUMN_ALIASES[header]), rates) if header in ENABLED_COLUMNS else '' for header in floor_headers}})
+    emit_rows("cards", [{header: value for header, value in row.items() if header == "Slug" or header in ENABLED_COLUMNS} for row in rows])
+    if rows:
+        print(f"📝 Aggiornamento floor su {len(rows)} righe...")
+        if sink is None:
+            sink = main_sheet_sink(sheet)
+            sink.write("cards", rows)
+            sink.flush()
+        else:
+            sink.write("cards", rows)
+    return len(rows)
+
+def fetch_floors_for_players(player_slugs):
+    """Floor di più giocatori: blocchi da BATCH_SIZE con alias, in parallelo. Ritorna {slug: dati}."""
+    player_slugs = sorted(player_slugs)
+    batches = [player_slugs[i:i + BATCH_SIZE] for i in range(0, len(player_slugs), BATCH_SIZE)]
+    floors_by_player = {}
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        for result in executor.map(fetch_player_floors, batches):
+            floors_by_player.update(result)
+    return floors_by_player
 
 def update_floors():
-    pass
+    """
+    Aggiornamento leggero e frequente dei soli floor: una query con alias ogni BATCH_SIZE
+    giocatori unici e un'unica batch_update limitata alle sei colonne FLOOR.
+    """
+    print("--- INIZIO AGGIORNAMENTO FLOOR ---")
+    start_time = time.time()
+    if not ENABLED_COLUMNS.intersection(FLOOR_COLUMN_ALIASES):
+        print("Nessuna colonna FLOOR attiva in SHEET_COLUMNS. Fine.")
+        return
+    try:
+        sheet = open_worksheet(open_spreadsheet(), MAIN_SHEET_NAME)
+    except Exception as e:
+        print(f"ERRORE CRITICO GSheets: {e}")
+        return
+    rates = {"eth_to_eur": get_eth_rate()}
+    rates.update(get_currency_rates())
+
+    all_sheet_records = read_sheet_records(sheet)
+    player_slugs = sorted({record.get('Player API Slug') for record in all_sheet_records if record.get('Player API Slug')})
+    print(f"{len(player_slugs)} giocatori unici in {-(-len(player_slugs) // BATCH_SIZE)} richieste.")
+    measure = start_cost_measure()
+    floors_by_player = fetch_floors_for_players(player_slugs)
+
+    write_floor_updates(sheet, all_sheet_records, floors_by_player, rates)
+    # I costi misurati restano solo con il daemon o in locale: il workflow dei floor non salva
+    # state.json (ogni 5 minuti si contenderebbe il gruppo di concorrenza dello stato),
+    # quindi in CI la stima di plan per i floor resta strutturale
+    state = load_state()
+    record_run_costs(state, 'update_floors', len(player_slugs), measure)
+    save_state(state)
+    execution_time = time.time() - start_time
+    print(f"Floor aggiornati per {len(floors_by_player)}/{len(player_slugs)} giocatori in {execution_time:.2f}s.")
+
+# --- Watchlist (giocatori non posseduti) ---
+def load_watchlist_slugs(existing_records):
+    """Slug della watchlist: da WATCHLIST_FILE se configurato, altrimenti dal foglio Watchlist."""
+    if WATCHLIST_FILE:
+        with open(WATCHLIST_FILE, encoding='utf-8') as f:
+            candidates = [line.split(',')[0].strip() for line in f]
+        candidates = [slug for slug in candidates if slug and not slug.startswith('#') and slug != "Player API Slug"]
+    else:
+        candidates = [str(record.get('Player API Slug', '')).strip() for record in existing_records]
+    return list(dict.fromkeys(slug for slug in candidates if slug))
+
+def graphql_aliases(data, root):
+    """Oggetto radice di una risposta con alias; None se la richiesta è fallita del tutto."""
+    return ((data or {}).get("data") or {}).get(root)
+
+def fetch_watchlist_players(player_slugs):
+    """Dati giocatore di un blocco con una sola richiesta. Ritorna {slug: dati} o None se fallita."""
+    data = sorare_graphql_fetch(build_watchlist_players_query(len(player_slugs)), {f"p{i}": slug for i, slug in enumerate(player_slugs)})
+    football = graphql_aliases(data, "football")
+    if football is None:
+        return None
+    return {slug: football.get(f"p{i}") for i, slug in enumerate(player_slugs)}
+
+def fetch_watchlist_projections(pairs):
+    """Proiezioni per coppie (slug, game_id) con una sola richiesta; i risultati finiscono nella cache di fetch_projection."""
+    variables = {}
+    for i, (slug, game_id) in enumerate(pairs):
+        variables[f"p{i}"], variables[f"g{i}"] = slug, game_id
+    football = graphql_aliases(sorare_graphql_fetch(build_projections_query(len(pairs)), variables), "football")
+    if football is None:
+        return {}
+    projections = {}
+    for i, (slug, game_id) in enumerate(pairs):
+        projection = (football.get(f"p{i}") or {}).get("playerGameScore")
+        if projection is not None:
+            shared_cache_set('projection', (slug, game_id), projection)
+            projections[slug] = projection
+    return projections
+
+def fetch_watchlist_sales(pairs):
+    """
+    tokenPrices per coppie (slug, rarità) con una sola richiesta. Le risposte vengono messe in
+    cache nello stesso formato di fetch_token_prices. Ritorna {(slug, rarità): vendite} o None.
+    """
+    variables = {"limit": WATCHLIST_SALES_COUNT}
+    for i, (slug, rarity) in enumerate(pairs):
+        variables[f"s{i}"], variables[f"r{i}"] = slug, rarity
+    tokens = graphql_aliases(sorare_graphql_fetch(build_token_prices_query(len(pairs)), variables), "tokens")
+    if tokens is None:
+        return None
+    sales = {}
+    for i, pair in enumerate(pairs):
+        if tokens.get(f"s{i}") is None:
+            continue
+        api_data = {"data": {"tokens": {"tokenPrices": tokens[f"s{i}"]}}}
+        shared_cache_set('token_prices', pair, (WATCHLIST_SALES_COUNT, api_data))
+        sales[pair] = parse_api_sales(api_data)
+    return sales
+
+def run_in_batches(function, items, batch_size):
+    """Esegue function su blocchi di items in parallelo (WATCHLIST_CONCURRENCY); ritorna i risultati per blocco."""
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    with ThreadPoolExecutor(max_workers=WATCHLIST_CONCURRENCY) as executor:
+        return list(zip(batches, executor.map(function, batches)))
+
+def build_watchlist_row(slug, existing, player_info, projection, sales_by_rarity, rates, now):
+    """Riga della watchlist: colonne giocatore come in Foglio1, vendite riprese dal foglio se non riscaricate."""
+    card_row = dict(zip(MAIN_SHEET_HEADERS, build_updated_card_row({"Player API Slug": slug}, {}, player_info, projection, rates)))
+    card_row["Player Name"] = player_info.get("displayName") or existing.get("Player Name", "")
+    row = {header: card_row.get(header, '') for header in WATCHLIST_CARD_COLUMNS}
+    if sales_by_rarity is None:
+        row.update({header: existing.get(header, '') for header in WATCHLIST_SALES_COLUMNS + ["Sales Updated At"]})
+    else:
+        week_ago = (now.timestamp() - 7 * 86400) * 1000
+        for rarity, label in WATCHLIST_RARITIES.items():
+            sales = sorted(sales_by_rarity.get(rarity, []), key=lambda sale: sale['timestamp'], reverse=True)
+            row[f"Last Sale {label} (EUR)"] = sales[0]['price'] if sales else ''
+            row[f"Avg Sale {label} (EUR)"] = round(sum(sale['price'] for sale in sales) / len(sales), 2) if sales else ''
+            row[f"Sales 7d {label}"] = sum(1 for sale in sales if sale['timestamp'] >= week_ago)
+        row["Sales Updated At"] = now.strftime('%Y-%m-%d %H:%M:%S')
+    row["Ultimo Aggiornamento"] = now.strftime('%Y-%m-%d %H:%M:%S')
+    return row
+
+def watchlist_sales_due(existing, now):
+    """Le vendite di un giocatore vanno riscaricate dopo WATCHLIST_SALES_INTERVAL_MINUTES."""
+    try:
+        last = datetime.strptime(str(existing.get("Sales Updated At", '')), '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        return True
+    return (now - last).total_seconds() >= WATCHLIST_SALES_INTERVAL_MINUTES * 60
+
+def update_watchlist():
+    """
+    Aggiorna la watchlist di giocatori non posseduti: una query con alias ogni
+    WATCHLIST_PLAYERS_PER_REQUEST giocatori (floor, forma, partita), poi proiezioni e
+    vendite recenti anch'esse ad alias, in parallelo, e un'unica riscrittura del foglio.
+    I dati in cache (proiezioni, tokenPrices) scaricati da altri job o target non vengono richiesti di nuovo.
+    """
+    print("--- INIZIO AGGIORNAMENTO WATCHLIST ---")
+    start_time = time.time()
+    try:
+        spreadsheet = open_spreadsheet()
+        try:
+            sheet = open_worksheet(spreadsheet, WATCHLIST_SHEET_NAME)
+            existing_records = read_sheet_records(sheet)
+        except gspread.WorksheetNotFound:
+            if not WATCHLIST_FILE:
+                print(f"Foglio '{WATCHLIST_SHEET_NAME}' non trovato e WATCHLIST_FILE non configurato. Fine.")
+                return
+            sheet, existing_records = get_or_create_worksheet(spreadsheet, WATCHLIST_SHEET_NAME, WATCHLIST_HEADERS), []
+    except Exception as e:
+        print(f"ERRORE CRITICO GSheets: {e}")
+        return
+    try:
+        player_slugs = load_watchlist_slugs(existing_records)
+    except OSError as e:
+        print(f"ERRORE: impossibile leggere WATCHLIST_FILE: {e}")
+        return
+    if not player_slugs:
+        print("Watchlist vuota. Fine.")
+        return
+    existing_by_slug = {str(record.get('Player API Slug', '')).strip(): record for record in existing_records}
+    rates = {"eth_to_eur": get_eth_rate()}
+    rates.update(get_currency_rates())
+    now, measure = datetime.now(), start_cost_measure()
+
+    # 1. Dati giocatore (servono gli ID partita per le proiezioni)
+    players, requests_made = {}, 0
+    cached_players = {slug: shared_cache_get('watchlist_player', slug) for slug in player_slugs}
+    players.update({slug: info for slug, info in cached_players.items() if info is not None})
+    to_fetch = [slug for slug in player_slugs if slug not in players]
+    failed = set()
+    for batch, result in run_in_batches(fetch_watchlist_players, to_fetch, WATCHLIST_PLAYERS_PER_REQUEST):
+        requests_made += 1
+        if result is None:
+            failed.update(batch)
+            continue
+        for slug, info in result.items():
+            if info:
+                shared_cache_set('watchlist_player', slug, info)
+                players[slug] = info
+
+    # 2. Proiezioni e vendite recenti, in parallelo tra loro
+    projections, projection_pairs = {}, []
+    for slug, info in players.items():
+        games = (info.get("activeClub") or {}).get("upcomingGames") or []
+        game_id = str(games[0].get("id", "")).replace("Game:", "") if games and games[0] else ""
+        if not game_id or not ENABLED_COLUMNS.intersection(PROJECTION_COLUMNS):
+            continue
+        cached = shared_cache_get('projection', (slug, game_id))
+        if cached is not None:
+            projections[slug] = cached
+        else:
+            projection_pairs.append((slug, game_id))
+    sales_players = [slug for slug in player_slugs if slug in players and watchlist_sales_due(existing_by_slug.get(slug, {}), now)]
+    sales_by_player, sales_pairs = {}, []
+    for slug in sales_players:
+        sales_by_player[slug] = {}
+        for rarity in WATCHLIST_RARITIES:
+            cached = shared_cache_get('token_prices', (slug, rarity))
+            if cached is not None and cached[0] >= WATCHLIST_SALES_COUNT:
+                sales_by_player[slug][rarity] = parse_api_sales(cached[1])
+            else:
+                sales_pairs.append((slug, rarity))
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        projection_future = executor.submit(run_in_batches, fetch_watchlist_projections, projection_pairs, WATCHLIST_PLAYERS_PER_REQUEST)
+        sales_future = executor.submit(run_in_batches, fetch_watchlist_sales, sales_pairs, WATCHLIST_PAIRS_PER_REQUEST)
+        for batch, result in projection_future.result():
+            requests_made += 1
+            projections.update(result)
+        for batch, result in sales_future.result():
+            requests_made += 1
+            for slug, rarity in batch:
+                if result is None:
+                    # Vendite non riscaricate: la riga mantiene quelle già nel foglio e riprova al prossimo ciclo
+                    sales_by_player.pop(slug, None)
+                elif slug in sales_by_player:
+                    sales_by_player[slug][rarity] = result.get((slug, rarity), [])
+
+    # 3. Un'unica riscrittura del foglio; i giocatori non scaricati mantengono la riga esistente
+    rows = []
+    for slug in player_slugs:
+        existing = existing_by_slug.get(slug, {})
+        if slug in players:
+            rows.append(build_watchlist_row(slug, existing, players[slug], projections.get(slug), sales_by_player.get(slug), rates, now))
+            record_floor_samples(slug, rows[-1])
+        elif slug in failed and existing:
+            rows.append({header: existing.get(header, '') for header in WATCHLIST_HEADERS})
+        else:
+            rows.append({"Player API Slug": slug, "Player Name": "Giocatore non trovato" if slug not in failed else existing.get("Player Name", '')})
+    emit_rows("watchlist", [row for row in rows if row.get("Ultimo Aggiornamento")])
+    values = [[row.get(header, '') for header in WATCHLIST_HEADERS] for row in rows]
+    sheets_write(sheet.resize, rows=len(values) + 1, cols=len(WATCHLIST_HEADERS))
+    sheets_write(sheet.update, range_name='A1', values=[WATCHLIST_HEADERS] + values, value_input_option='USER_ENTERED')
+    invalidate_sheet_snapshot(sheet)
+    state = load_state()
+    record_run_costs(state, 'update_watchlist', len(player_slugs), measure)
+    save_state(state)
+
+    execution_time = time.time() - start_time
+    print(f"Watchlist: {len(players)}/{len(player_slugs)} giocatori, {len(sales_players)} con vendite aggiornate, {requests_made} richieste in {execution_time:.2f}s.")
+    if failed:
+        print(f"AVVISO: {len(failed)} giocatori non scaricati (righe precedenti mantenute).")
 
 import urllib.parse
 
@@ -945,28 +3367,25 @@ def create_so5_charts():
     """Creates a new sheet with QuickChart.io chart images for each player."""
     print("--- INIZIO CREAZIONE GRAFICI SO5 (QuickChart.io) ---")
     try:
-        credentials = json.loads(GSPREAD_CREDENTIALS_JSON)
-        gc = gspread.service_account_from_dict(credentials)
-        spreadsheet = gc.open_by_key(SPREADSHEET_ID)
-        main_sheet = spreadsheet.worksheet(MAIN_SHEET_NAME)
+        spreadsheet = open_spreadsheet()
+        main_sheet = open_worksheet(spreadsheet, MAIN_SHEET_NAME)
     except Exception as e:
         print(f"ERRORE CRITICO GSheets: {e}")
         return
 
     # Get or create the chart sheet
     try:
-        chart_sheet = spreadsheet.worksheet(CHART_SHEET_NAME)
+        chart_sheet = open_worksheet(spreadsheet, CHART_SHEET_NAME)
     except gspread.WorksheetNotFound:
-        chart_sheet = spreadsheet.add_worksheet(title=CHART_SHEET_NAME, rows=1000, cols=5)
+        chart_sheet = remember_worksheet(spreadsheet, sheets_write(spreadsheet.add_worksheet, title=CHART_SHEET_NAME, rows=1000, cols=5))
         print(f"Foglio '{CHART_SHEET_NAME}' creato.")
 
-    chart_sheet.clear()
-    chart_sheet.update(range_name='A1:B1', values=[['Giocatore', 'Grafico Ultimi 5 Punteggi SO5']])
-    chart_sheet.format('A1:B1', {'textFormat': {'bold': True}})
+    sheets_write(chart_sheet.batch_clear, ['A2:E'])
+    ensure_header_row(chart_sheet, ['Giocatore', 'Grafico Ultimi 5 Punteggi SO5'])
     print("Foglio dei grafici pulito e intestazioni scritte.")
 
     # Read player data from the main sheet
-    all_records = main_sheet.get_all_records()
+    all_records = read_sheet_records(main_sheet)
     players_with_scores = [
         r for r in all_records if (r.get("Last 15 SO5 Scores", "") or r.get("Last 5 SO5 Scores", "")).strip()
     ]
@@ -977,7 +3396,7 @@ def create_so5_charts():
     print(f"Trovati {len(players_with_scores)} giocatori con punteggi SO5 da processare.")
 
     # Prepare data for batch update
-    update_data = []
+    update_data, chart_rows = [], []
     for i, player in enumerate(players_with_scores):
         # Check for new key first, then fall back to old key for backward compatibility
         scores_str = player.get("Last 15 SO5 Scores") or player.get("Last 5 SO5 Scores")
@@ -997,18 +3416,19 @@ def create_so5_charts():
 
         # Add player name and the raw chart URL to the update list
         row_index = i + 2  # +2 because sheet is 1-indexed and we have a header
-        update_data.append({'range': f'A{row_index}', 'values': [[player_name]]})
-        update_data.append({'range': f'B{row_index}', 'values': [[chart_url]]})
+        update_data.append({'range': f'A{row_index}', 'values': [[player_name, chart_url]]})
+        chart_rows.append({"Giocatore": player_name, "Player API Slug": player.get("Player API Slug"), "Last 15 SO5 Scores": scores_str, "Grafico": chart_url})
 
+    emit_rows("charts", chart_rows)
     # Batch write all formulas to the sheet
     if update_data:
         print(f"Scrittura di {len(players_with_scores)} grafici nel foglio...")
-        chart_sheet.batch_update(update_data, value_input_option='USER_ENTERED')
+        sheets_batch_update(chart_sheet, update_data, value_input_option='USER_ENTERED')
 
     # Adjust column and row sizes
-    chart_sheet.freeze(rows=1)
-    chart_sheet.update_acell('C1', "Nota: I grafici sono immagini generate da QuickChart.io")
-    spreadsheet.batch_update({
+    sheets_write(chart_sheet.update_acell, 'C1', "Nota: I grafici sono immagini generate da QuickChart.io")
+    # Il blocco della prima riga è già nella batch_update qui sotto (prima c'era anche un freeze separato)
+    sheets_write(spreadsheet.batch_update, {
         "requests": [
             {"updateSheetProperties": {"properties": {"sheetId": chart_sheet.id, "gridProperties": {"frozenRowCount": 1}},"fields": "gridProperties.frozenRowCount"}},
             {"updateDimensionProperties": {"range": {"sheetId": chart_sheet.id, "dimension": "COLUMNS", "startIndex": 0, "endIndex": 1}, "properties": {"pixelSize": 200}, "fields": "pixelSize"}},
@@ -1019,20 +3439,494 @@ def create_so5_charts():
 
     print(f"--- CREAZIONE GRAFICI COMPLETATA. {len(players_with_scores)} grafici aggiunti a '{CHART_SHEET_NAME}'. ---")
 
+def plan_stage(state, stage, items, structural, budget_seconds, details=""):
+    """
+    Stima di uno stage: richieste Sorare e scritture Sheets dai costi per elemento misurati
+    (o dal calcolo strutturale se mancano misure), tempo dai secondi per elemento misurati.
+    """
+    measured = state.get('run_costs', {}).get(stage)
+    count = len(items)
+    requests = round(measured['sorare_requests'] * count) if measured else structural['sorare_requests']
+    writes = round(measured['sheets_writes'] * count) if measured else structural['sheets_writes']
+    seconds = (measured['seconds'] if measured else PLAN_DEFAULT_SECONDS_PER_ITEM[stage]) * count
+    source = f"costi misurati su {measured['runs']} esecuzioni, ultima {measured['updated_at']}" if measured else "nessuna misura: stima strutturale"
+    print(f"\n[{stage}] {count} elementi ({source})")
+    if details:
+        print(f"  {details}")
+    if items:
+        more = f" … (+{count - PLAN_SAMPLE_ITEMS})" if count > PLAN_SAMPLE_ITEMS else ""
+        print(f"  {', '.join(items[:PLAN_SAMPLE_ITEMS])}{more}")
+    runs_needed = -(-int(seconds) // budget_seconds) if budget_seconds else 1
+    fit = "rientra nel budget" if runs_needed <= 1 else f"NON rientra: ~{runs_needed} esecuzioni (o shard)"
+    print(f"  Richieste Sorare: ~{requests} | Scritture Sheets: ~{writes} | Tempo stimato: {seconds:.0f}s su {budget_seconds:.0f}s → {fit}")
+    return {"requests": requests, "writes": writes, "seconds": seconds}
+
+def plan():
+    """
+    Dry-run: legge lo snapshot dei fogli, lo stato e i journal e riporta per ogni stage gli
+    elementi che verrebbero processati, le richieste Sorare, le scritture Sheets e il tempo
+    previsto. Nessuna chiamata che modifichi fogli, stato o journal.
+    """
+    print("--- PIANO DI ESECUZIONE (DRY-RUN) ---")
+    state = load_state()
+    try:
+        spreadsheet = open_spreadsheet()
+        records = read_sheet_records(open_worksheet(spreadsheet, MAIN_SHEET_NAME))
+    except Exception as e:
+        print(f"ERRORE CRITICO GSheets: {e}")
+        return
+    stages = []
+
+    # update_cards: continuazione in corso o righe scadute, senza quelle già nel journal o in backoff
+    continuation = state.get('update_cards_continuation', {})
+    journaled = load_journal('update_cards')
+    if continuation.get('cards_to_process'):
+        cards = continuation['cards_to_process'][continuation.get('last_index', 0):]
+    else:
+        cards = cards_due_for_update(records)
+    done = set(journaled) | set(continuation.get('completed_slugs', []))
+    cards = [card for card in cards if card.get('Slug') and card['Slug'] not in done and not item_retry_blocked(state, 'update_cards', card['Slug'])]
+    tier_refresh = state.get('card_tier_refresh', {})
+    tier_counts = collections.Counter()
+    card_requests = 0
+    for card in cards:
+        tiers = due_card_tiers({**tier_refresh.get(card['Slug'], {}), **journaled.get(card['Slug'], {})}, next_game_date=card.get('Data Prossima Partita'))
+        tier_counts.update(tiers)
+        card_requests += 1 + ("form" in tiers and bool(ENABLED_COLUMNS.intersection(PROJECTION_COLUMNS)))
+    stages.append(plan_stage(state, 'update_cards', [card['Slug'] for card in cards],
+                             {"sorare_requests": card_requests, "sheets_writes": -(-len(cards) // SHEETS_COALESCE_ROWS)}, CARDS_TIMEOUT_SECONDS,
+                             f"Tier: {', '.join(f'{tier} {tier_counts[tier]}' for tier in CARD_TIER_NAMES)}" + (" (ripresa da continuazione)" if continuation.get('cards_to_process') else "")))
+
+    # update_sales: stesse coppie e stessi salti della pipeline
+    continuation = state.get('update_sales_continuation', {})
+    start_index = continuation.get('last_index', 0)
+    pairs = continuation.get('pairs_to_process', []) if start_index else [pair for pair in collect_sales_pairs(records) if in_shard(pair['slug'])]
+    skip_indices = set(continuation.get('completed_indices', [])) | journaled_pair_indices(pairs, load_journal('update_sales'))
+    pending = [pairs[i] for i in range(start_index, len(pairs)) if i not in skip_indices and not item_retry_blocked(state, 'update_sales', f"{pairs[i]['slug']}::{pairs[i]['rarity']}")]
+    if SALES_LAYOUT == "ledger":
+        known = set(state.get('sales_ledger', {}))
+        sales_writes = (0 if sheets_dashboard_only() else -(-len(pending) // SALES_FLUSH_EVERY_ROWS)) + 2
+    else:
+        try:
+            known = {f"{record.get('Player API Slug')}::{record.get('Rarity Searched')}" for record in read_sheet_records(open_worksheet(spreadsheet, SALES_HISTORY_SHEET_NAME))}
+        except gspread.WorksheetNotFound:
+            known = set()
+        new_count = sum(1 for pair in pending if f"{pair['slug']}::{pair['rarity']}" not in known)
+        sales_writes = -(-(len(pending) - new_count) // SALES_FLUSH_EVERY_ROWS) + -(-new_count // SALES_FLUSH_EVERY_ROWS)
+    new_pairs = sum(1 for pair in pending if f"{pair['slug']}::{pair['rarity']}" not in known)
+    stages.append(plan_stage(state, 'update_sales', [f"{pair['slug']}:{pair['rarity']}" for pair in pending],
+                             {"sorare_requests": len(pending), "sheets_writes": sales_writes}, SALES_TIMEOUT_SECONDS,
+                             f"Layout {SALES_LAYOUT}, {new_pairs} coppie nuove (andranno in coda per il backfill)"))
+
+    # backfill_sales: coda nello stato, senza le coppie già caricate nel journal o in backoff
+    journaled = load_journal('backfill_sales')
+    queued = [key for key, entry in sorted(state.get('sales_backfill_queue', {}).items(), key=lambda item: item[1].get('queued_at', 0))
+              if key not in journaled and in_shard(entry['slug']) and not item_retry_blocked(state, 'backfill_sales', key)]
+    backfill_writes = 0 if SALES_LAYOUT == "ledger" and sheets_dashboard_only() else -(-len(queued) // BACKFILL_LOAD_BATCH_PAIRS)
+    stages.append(plan_stage(state, 'backfill_sales', queued, {"sorare_requests": len(queued), "sheets_writes": backfill_writes}, BACKFILL_TIMEOUT_SECONDS))
+
+    # update_floors: giocatori unici di Foglio1, una richiesta ogni BATCH_SIZE (misure solo dal daemon, vedi update_floors)
+    players = sorted({record.get('Player API Slug') for record in records if record.get('Player API Slug')}) if ENABLED_COLUMNS.intersection(FLOOR_COLUMN_ALIASES) else []
+    stages.append(plan_stage(state, 'update_floors', players, {"sorare_requests": -(-len(players) // BATCH_SIZE), "sheets_writes": 1 if players else 0}, DAEMON_JOB_INTERVAL_MINUTES["update_floors"] * 60,
+                             "" if state.get('run_costs', {}).get('update_floors') else "Il workflow dei floor non salva lo stato: in CI questa stima resta strutturale"))
+
+    # update_watchlist: giocatori, proiezioni (al massimo una per giocatore) e vendite scadute
+    try:
+        watchlist_records = read_sheet_records(open_worksheet(spreadsheet, WATCHLIST_SHEET_NAME))
+    except gspread.WorksheetNotFound:
+        watchlist_records = []
+    try:
+        watchlist = load_watchlist_slugs(watchlist_records) if watchlist_records or WATCHLIST_FILE else []
+    except OSError as e:
+        print(f"AVVISO: impossibile leggere WATCHLIST_FILE: {e}")
+        watchlist = []
+    existing_by_slug = {str(record.get('Player API Slug', '')).strip(): record for record in watchlist_records}
+    now = datetime.now()
+    sales_due = sum(1 for slug in watchlist if watchlist_sales_due(existing_by_slug.get(slug, {}), now))
+    player_batches = -(-len(watchlist) // WATCHLIST_PLAYERS_PER_REQUEST)
+    projection_batches = player_batches if ENABLED_COLUMNS.intersection(PROJECTION_COLUMNS) else 0
+    stages.append(plan_stage(state, 'update_watchlist', watchlist,
+                             {"sorare_requests": player_batches + projection_batches + -(-sales_due * len(WATCHLIST_RARITIES) // WATCHLIST_PAIRS_PER_REQUEST), "sheets_writes": 2 if watchlist else 0},
+                             DAEMON_JOB_INTERVAL_MINUTES["update_watchlist"] * 60, f"{sales_due} giocatori con vendite da aggiornare"))
+
+    total_requests = sum(stage['requests'] for stage in stages)
+    total_writes = sum(stage['writes'] for stage in stages)
+    total_seconds = sum(stage['seconds'] for stage in stages)
+    write_budget = max(1, SHEETS_WRITES_PER_MINUTE // SHARD_COUNT)
+    print(f"\nTOTALE: ~{total_requests} richieste Sorare, ~{total_writes} scritture Sheets (almeno {total_writes / write_budget:.1f} min di quota a {write_budget}/min), ~{total_seconds:.0f}s.")
+
+# Moduli e funzioni in cui il tempo "proprio" è attesa di rete o attesa pura (sleep, lock, select)
+PROFILE_NETWORK_MARKERS = ("requests", "urllib3", "socket.py", "ssl.py", "http/client.py", "gspread", "google/auth", "websockets", "_socket.socket", "_ssl._SSLSocket", "getaddrinfo")
+PROFILE_WAIT_MARKERS = ("time.sleep", "_thread.lock", "_thread.RLock", "_queue.SimpleQueue", "threading.py", "select.", "selectors.py", "queue.py")
+
+def profile_category(function_key):
+    filename, _, name = function_key
+    location = f"{filename}:{name}".replace("\\", "/")
+    if any(marker in location for marker in PROFILE_NETWORK_MARKERS):
+        return "rete"
+    if any(marker in location for marker in PROFILE_WAIT_MARKERS):
+        return "attesa"
+    return "cpu"
+
+def write_profile_report(label, stats, wall_seconds, cpu_seconds, peak_bytes, snapshot):
+    """Scrive il report testuale e il dump pstats (apribile con snakeviz o pstats)."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base_path = os.path.join(PROFILE_DIR, f"{label}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    stats.dump_stats(f"{base_path}.prof")
+    by_category = {"rete": 0.0, "attesa": 0.0, "cpu": 0.0}
+    own_code = []
+    for function_key, (_, _, tottime, cumtime, _) in stats.stats.items():
+        by_category[profile_category(function_key)] += tottime
+        if function_key[0].endswith(("gestionale.py", "check_lineups.py")):
+            own_code.append((tottime, cumtime, function_key))
+    with open(f"{base_path}.txt", "w") as f:
+        f.write(f"== Profilo: {label} ({datetime.now().strftime('%Y-%m-%d %H:%M:%S')}) ==\n")
+        f.write(f"Tempo reale: {wall_seconds:.2f}s | CPU del processo: {cpu_seconds:.2f}s | in attesa (rete, sleep, lock): {max(wall_seconds - cpu_seconds, 0):.2f}s\n")
+        f.write("Tempo proprio per categoria (somma su tutti i thread, che si sovrappongono):\n")
+        for category, seconds in by_category.items():
+            f.write(f"  {category:<7} {seconds:9.2f}s\n")
+        f.write(f"Picco memoria (tracemalloc): {peak_bytes / 1024 / 1024:.1f} MB\n\n")
+        f.write("-- Funzioni del gestionale per tempo proprio (CPU: build_sales_history_row, parse_price, ...) --\n")
+        for tottime, cumtime, (filename, lineno, name) in sorted(own_code, reverse=True)[:PROFILE_TOP_FUNCTIONS]:
+            f.write(f"  {tottime:9.3f}s proprio  {cumtime:9.3f}s cumulativo  {name} ({os.path.basename(filename)}:{lineno})\n")
+        f.write(f"\n-- Top {PROFILE_TOP_ALLOCATIONS} siti di allocazione (memoria ancora allocata a fine esecuzione) --\n")
+        for statistic in snapshot.statistics('lineno')[:PROFILE_TOP_ALLOCATIONS]:
+            f.write(f"  {statistic}\n")
+        f.write(f"\n-- Top {PROFILE_TOP_FUNCTIONS} funzioni per tempo cumulativo --\n")
+        stats.stream = f
+        stats.sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+    print(f"Profilo salvato in {base_path}.txt ({base_path}.prof)")
+
+def run_profiled(label, function):
+    """
+    --profile: esegue il comando sotto cProfile (deterministico, inclusi i thread di lavoro)
+    con tracemalloc attivo, poi scrive tempo cumulativo per funzione, picco di memoria,
+    siti di allocazione e la divisione tra attesa di rete e CPU.
+    """
+    import cProfile
+    import pstats
+    import tracemalloc
+    profiles = [cProfile.Profile()]
+    if sys.version_info < (3, 12):
+        # Fino a Python 3.11 cProfile vede solo il thread che lo attiva: un profiler per ogni nuovo thread
+        def start_thread_profiler(frame, event, arg):
+            profile = cProfile.Profile()
+            profiles.append(profile)
+            profile.enable()
+        threading.setprofile(start_thread_profiler)
+    tracemalloc.start(5)
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    profiles[0].enable()
+    try:
+        function()
+    finally:
+        profiles[0].disable()
+        threading.setprofile(None)
+        wall_seconds, cpu_seconds = time.perf_counter() - wall_start, time.process_time() - cpu_start
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            try:
+                stats.add(profile)
+            except TypeError:
+                pass  # thread senza chiamate registrate
+        write_profile_report(label, stats, wall_seconds, cpu_seconds, peak_bytes, snapshot)
+
+def install_shutdown_handlers():
+    """SIGTERM/SIGINT non interrompono a metà: impostano SHUTDOWN_EVENT e il ciclo esce pulito."""
+    def request_shutdown(signum, frame):
+        print(f"Segnale {signum} ricevuto: arresto dopo il lavoro in corso...")
+        SHUTDOWN_EVENT.set()
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
+
+def extract_event_cards(payload):
+    """Carte presenti in un evento (qualsiasi nodo con slug e player), ovunque si trovino nel payload."""
+    found = []
+    def walk(node):
+        if isinstance(node, dict):
+            if isinstance(node.get("slug"), str) and isinstance(node.get("player"), dict):
+                found.append(node)
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for item in node:
+                walk(item)
+    walk(payload)
+    return found
+
+async def listen_sorare_updates(subscriptions, on_data, should_stop):
+    """
+    Client ActionCable per il websocket GraphQL di Sorare: un canale GraphqlChannel per
+    sottoscrizione ({nome: (query, variabili)}), on_data(nome, dati) per ogni risultato.
+    Ritorna quando should_stop() è vero; solleva in caso di disconnessione.
+    """
+    headers = {"APIKEY": SORARE_API_KEY} if SORARE_API_KEY else {}
+    async with websockets.connect(SORARE_WS_URL, additional_headers=headers, subprotocols=["actioncable-v1-json"]) as ws:
+        channels = {}
+        for name, (query, variables) in subscriptions.items():
+            identifier = json.dumps({"channel": "GraphqlChannel", "channelId": f"{name}-{int(time.time() * 1000)}"})
+            channels[identifier] = (name, query, variables)
+            await ws.send(json.dumps({"command": "subscribe", "identifier": identifier}))
+        while not should_stop():
+            try:
+                message = json.loads(await asyncio.wait_for(ws.recv(), timeout=1))
+            except asyncio.TimeoutError:
+                continue
+            message_type = message.get("type")
+            if message_type == "disconnect":
+                raise ConnectionError(f"Disconnessione dal server: {message.get('reason')}")
+            channel = channels.get(message.get("identifier"))
+            if message_type in ("welcome", "ping") or not channel:
+                continue
+            name, query, variables = channel
+            if message_type == "confirm_subscription":
+                await ws.send(json.dumps({"command": "message", "identifier": message["identifier"], "data": json.dumps({"query": query, "variables": variables, "action": "execute"})}))
+                print(f"Sottoscrizione '{name}' attiva.")
+            elif message_type == "reject_subscription":
+                print(f"ERRORE: sottoscrizione '{name}' rifiutata.")
+            elif isinstance(message.get("message"), dict):
+                result = message["message"].get("result") or {}
+                if result.get("errors"):
+                    print(f"ERRORE GraphQL ({name}): {result['errors']}")
+                if result.get("data"):
+                    on_data(name, result["data"])
+
+def run_listener():
+    """
+    Listener in tempo reale: si sottoscrive agli aggiornamenti di carte e offerte dei giocatori
+    della galleria e applica le modifiche a blocchi (LISTENER_FLUSH_EVERY_UPDATES eventi o
+    LISTENER_FLUSH_INTERVAL_SECONDS secondi) alle stesse righe prodotte da
+    build_updated_card_row() e build_sales_history_row(). Il polling resta come riconciliazione.
+    """
+    if websockets is None:
+        print("ERRORE: il listener richiede il pacchetto 'websockets' (pip install websockets).")
+        return
+    print(f"--- AVVIO LISTENER WEBSOCKET ({SORARE_WS_URL}) ---")
+    start_time = time.time()
+    try:
+        spreadsheet = open_spreadsheet()
+        main_sheet = open_worksheet(spreadsheet, MAIN_SHEET_NAME)
+        sales_sheet = None
+        if SALES_LAYOUT != "ledger":
+            try:
+                sales_sheet = open_worksheet(spreadsheet, SALES_HISTORY_SHEET_NAME)
+            except gspread.WorksheetNotFound:
+                print("Foglio vendite non trovato: le vendite restano al polling.")
+    except Exception as e:
+        print(f"ERRORE CRITICO GSheets: {e}")
+        return
+    gallery_players = {record.get('Player API Slug') for record in read_sheet_records(main_sheet) if record.get('Player API Slug')}
+    print(f"{len(gallery_players)} giocatori della galleria sotto osservazione.")
+    pending = {"cards": {}, "players": set(), "pairs": set(), "events": 0}
+    totals = {"rows": 0, "sales_rows": 0}
+
+    def on_data(name, data):
+        offer_status = str((data.get("tokenOfferWasUpdated") or {}).get("status", "")).lower()
+        for card in extract_event_cards(data):
+            player_slug = card["player"].get("slug")
+            if player_slug not in gallery_players:
+                continue
+            pending["players"].add(player_slug)
+            if name == "cards" and "liveSingleSaleOffer" in card:
+                pending["cards"][card["slug"]] = card
+            if name == "offers" and offer_status == "accepted" and card.get("rarity"):
+                pending["pairs"].add((player_slug, str(card["rarity"]).lower()))
+            pending["events"] += 1
+
+    def take_pending():
+        """Stacca gli eventi accumulati; va chiamata nel thread del loop, lo stesso di on_data."""
+        batch = (pending["cards"], pending["players"], pending["pairs"])
+        pending.update({"cards": {}, "players": set(), "pairs": set(), "events": 0})
+        return batch
+
+    def flush(cards, players, pairs):
+        """Applica un blocco di eventi già staccato da take_pending (gira in un thread a parte)."""
+        rates = {"eth_to_eur": get_eth_rate()}
+        rates.update(get_currency_rates())
+        records = read_sheet_records(main_sheet)
+        floors_by_player = fetch_floors_for_players(players) if ENABLED_COLUMNS.intersection(FLOOR_COLUMN_ALIASES) else {}
+        # Carte con un evento: colonne market (prezzo e, se disponibili, floor); le altre carte
+        # degli stessi giocatori: solo floor. Il SheetsSink colloca le righe per Slug al flush.
+        sheet_sink = main_sheet_sink(main_sheet)
+        card_rows = []
+        for record in records:
+            event_card = cards.get(record.get('Slug'))
+            if not event_card:
+                continue
+            player_info = floors_by_player.get(record.get('Player API Slug'))
+            values = dict(zip(MAIN_SHEET_HEADERS, build_updated_card_row(record, event_card, player_info or {}, None, rates, ("market",))))
+            record_listing_sample(record.get('Slug'), values["Sale Price (EUR)"])
+            headers = CARD_TIER_COLUMNS["market"] if player_info else ["Sale Price (EUR)"]
+            card_rows.append({"Slug": record.get('Slug'), **{header: values[header] if header in ENABLED_COLUMNS else '' for header in headers}})
+        emit_rows("cards", [{header: value for header, value in row.items() if header == "Slug" or header in ENABLED_COLUMNS} for row in card_rows])
+        sheet_sink.write("cards", card_rows)
+        floor_rows = write_floor_updates(main_sheet, records, floors_by_player, rates, skip_slugs={row["Slug"] for row in card_rows}, sink=sheet_sink)
+        if card_rows:
+            print(f"📝 Listener: {len(card_rows)} carte aggiornate...")
+        sheet_sink.flush()
+        totals["rows"] += len(card_rows) + floor_rows
+
+        if pairs and sales_sheet is not None:
+            headers = build_sales_history_headers()
+            existing_sales_map = {f"{rec.get('Player API Slug')}::{rec.get('Rarity Searched')}": {"row_index": i + 2, "record": rec} for i, rec in enumerate(read_sheet_records(sales_sheet))}
+            sales_updates = []
+            for player_slug, rarity in sorted(pairs):
+                existing_info = existing_sales_map.get(f"{player_slug}::{rarity}")
+                if not existing_info:
+                    continue  # coppia nuova: la crea il polling
+                SHARED_CACHE.pop(('token_prices', (player_slug, rarity)), None)  # vendita appena avvenuta: niente cache
+                api_data = fetch_token_prices(player_slug, rarity, MAX_SALES_FROM_API)
+                pair = {"slug": player_slug, "rarity": rarity, "name": existing_info["record"].get("Player Name")}
+                updated_row = merge_sales_history(pair, api_data, existing_info, headers)
+                sales_updates.append({'range': f'A{existing_info["row_index"]}', 'values': [updated_row]})
+                emit_rows("sales", [dict(zip(headers, updated_row))])
+                patch_sheet_snapshot(sales_sheet, existing_info["row_index"], dict(zip(headers, updated_row)))
+            if sales_updates:
+                print(f"📝 Listener: {len(sales_updates)} righe vendite aggiornate...")
+                sheets_batch_update(sales_sheet, sales_updates, value_input_option='USER_ENTERED')
+                totals["sales_rows"] += len(sales_updates)
+        flush_timeseries()
+
+    def should_stop():
+        return stop_requested() or (LISTENER_MAX_RUNTIME_SECONDS and time.time() - start_time > LISTENER_MAX_RUNTIME_SECONDS)
+
+    async def listen_loop():
+        subscriptions = {
+            "cards": (CARD_UPDATES_SUBSCRIPTION, {"playerSlugs": sorted(gallery_players)}),
+            "offers": (OFFER_UPDATES_SUBSCRIPTION, {}),
+        }
+        while not should_stop():
+            try:
+                await listen_sorare_updates(subscriptions, on_data, should_stop)
+            except Exception as e:
+                print(f"Connessione websocket persa ({e}): nuovo tentativo tra {LISTENER_RECONNECT_DELAY_SECONDS}s.")
+                await asyncio.sleep(LISTENER_RECONNECT_DELAY_SECONDS)
+
+    async def flush_loop():
+        last_flush = time.time()
+        while not should_stop():
+            await asyncio.sleep(1)
+            if pending["events"] and (pending["events"] >= LISTENER_FLUSH_EVERY_UPDATES or time.time() - last_flush >= LISTENER_FLUSH_INTERVAL_SECONDS):
+                try:
+                    await asyncio.to_thread(flush, *take_pending())
+                except Exception as e:
+                    print(f"Errore durante il flush del listener: {e}")
+                last_flush = time.time()
+
+    async def main():
+        await asyncio.gather(listen_loop(), flush_loop())
+
+    install_shutdown_handlers()
+    asyncio.run(main())
+    if pending["events"]:
+        flush(*take_pending())
+    print(f"--- LISTENER ARRESTATO: {totals['rows']} righe carte e {totals['sales_rows']} righe vendite aggiornate ---")
+
+def run_check_lineups():
+    # check_lineups importa la sessione Sheets da qui: evita una seconda copia del modulo se eseguito come script
+    sys.modules.setdefault('gestionale', sys.modules[__name__])
+    import check_lineups
+    check_lineups.main()
+
+def run_daemon():
+    """
+    Modalità residente: esegue i job secondo il proprio intervallo tenendo calde
+    sessione HTTP, client Sheets, cache e snapshot dei fogli. SIGTERM/SIGINT
+    fermano il ciclo: il job in corso salva la continuazione e lo stato del
+    daemon viene salvato un'ultima volta.
+    """
+    print("--- AVVIO MODALITÀ DAEMON ---")
+    jobs = {
+        "sync_galleria": lambda: run_for_targets(sync_galleria),
+        "update_floors": lambda: run_for_targets(update_floors),
+        "update_cards": lambda: run_for_targets(update_cards),
+        "update_sales": lambda: run_for_targets(update_sales),
+        "update_watchlist": lambda: run_for_targets(update_watchlist),
+        "backfill_sales": lambda: run_for_targets(backfill_sales),
+        "check_lineups": run_check_lineups,
+        "create_charts": lambda: run_for_targets(create_so5_charts),
+    }
+    intervals = dict(DAEMON_JOB_INTERVAL_MINUTES)
+    if DAEMON_INTERVALS_JSON:
+        try:
+            intervals.update({name: None if minutes is None else float(minutes) for name, minutes in json.loads(DAEMON_INTERVALS_JSON).items() if name in jobs})
+        except (json.JSONDecodeError, TypeError, ValueError) as e:
+            print(f"ERRORE: DAEMON_INTERVALS non valido, uso i valori di default: {e}")
+
+    install_shutdown_handlers()
+
+    def checkpoint(last_runs):
+        root_state = load_state_file()
+        root_state['daemon_last_runs'] = last_runs
+        save_state_file(root_state)
+
+    last_runs = load_state_file().get('daemon_last_runs', {})
+    while not stop_requested():
+        for name, job in jobs.items():
+            if stop_requested():
+                break
+            if intervals.get(name) is None or time.time() - last_runs.get(name, 0) < intervals[name] * 60:
+                continue
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Avvio job '{name}'")
+            try:
+                job()
+            except Exception as e:
+                print(f"ERRORE nel job '{name}': {e}")
+                reset_sheets_cache()
+            last_runs[name] = time.time()
+            checkpoint(last_runs)
+            save_sheets_session()
+        SHUTDOWN_EVENT.wait(timeout=DAEMON_TICK_SECONDS)
+    checkpoint(last_runs)
+    print("--- DAEMON ARRESTATO ---")
+
 if __name__ == "__main__":
+    profile_run = "--profile" in sys.argv
+    if profile_run:
+        sys.argv.remove("--profile")
+    try:
+        shard = parse_shard_argument(sys.argv[2:])
+    except ValueError as e:
+        print(f"Errore: {e}")
+        sys.exit(1)
+    if shard:
+        if len(sys.argv) < 2 or sys.argv[1] not in ("update_cards", "update_sales", "plan"):
+            print("Errore: --shard è supportato solo da update_cards, update_sales e plan.")
+            sys.exit(1)
+        use_shard(*shard)
+    try:
+        backfill_requests = [parse_backfill_request(arg) for arg in sys.argv[2:]] if sys.argv[1:2] == ["backfill_sales"] else []
+    except ValueError as e:
+        print(f"Errore: {e}")
+        sys.exit(1)
+    try:
+        price_history_args = (sys.argv[2], float(sys.argv[3]) if len(sys.argv) > 3 else 168) if sys.argv[1:2] == ["price_history"] else ()
+    except (IndexError, ValueError):
+        print("Errore: uso price_history <slug giocatore o carta> [ore].")
+        sys.exit(1)
+    commands = {
+        "sync_galleria": lambda: run_for_targets(sync_galleria),
+        "update_cards": lambda: run_for_targets(update_cards),
+        "update_sales": lambda: run_for_targets(update_sales),
+        "update_floors": lambda: run_for_targets(update_floors),
+        "update_watchlist": lambda: run_for_targets(update_watchlist),
+        "backfill_sales": lambda: run_for_targets(lambda: backfill_sales(backfill_requests)),
+        "create_charts": lambda: run_for_targets(create_so5_charts),
+        "price_history": lambda: price_history(*price_history_args),
+        "plan": lambda: run_for_targets(plan),
+        "daemon": run_daemon,
+        "listen": run_listener,
+    }
     if len(sys.argv) > 1:
         function_to_run = sys.argv[1]
-        if function_to_run == "sync_galleria": 
-            sync_galleria()
-        elif function_to_run == "update_cards": 
-            update_cards()
-        elif function_to_run == "update_sales": 
-            update_sales()
-        elif function_to_run == "update_floors": 
-            update_floors()
-        elif function_to_run == "create_charts": 
-            create_so5_charts()
-        else: 
+        if function_to_run not in commands: 
             print(f"Errore: Funzione '{function_to_run}' non riconosciuta.")
+        elif profile_run:
+            run_profiled(function_to_run, commands[function_to_run])
+        else:
+            commands[function_to_run]()
     else:
-        print("Nessuna funzione specificata. Le funzioni disponibili sono: sync_galleria, update_cards, update_sales, update_floors, create_charts.")
+        print(f"Nessuna funzione specificata. Le funzioni disponibili sono: {', '.join(commands)}. Opzioni: --shard i/N per update_cards/update_sales/plan, --profile per tutte; backfill_sales accetta coppie player-slug:rarità, price_history uno slug (giocatore o carta) e le ore.")
@@ -0,0 +1,92 @@
+"""Listener websocket: un server ActionCable locale al posto di ws.sorare.com verifica framing e sottoscrizioni."""
+import asyncio
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gestionale
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+
+class ActionCableStandIn:
+    """Emula il GraphqlChannel di Sorare: welcome, conferma o rifiuto, risultati, ping, disconnect."""
+
+    def __init__(self, reject=(), results=None):
+        self.reject = set(reject)
+        self.results = results or {}
+        self.received = []
+        self.headers = None
+
+    async def handler(self, ws):
+        self.headers = ws.request.headers
+        await ws.send(json.dumps({"type": "welcome"}))
+        pending = set(self.results)
+        async for raw in ws:
+            message = json.loads(raw)
+            self.received.append(message)
+            name = json.loads(message["identifier"])["channelId"].split("-")[0]
+            if message["command"] == "subscribe":
+                await ws.send(json.dumps({"type": "reject_subscription" if name in self.reject else "confirm_subscription", "identifier": message["identifier"]}))
+            elif message["command"] == "message":
+                await ws.send(json.dumps({"type": "ping", "message": 1}))
+                await ws.send(json.dumps({"identifier": message["identifier"], "message": {"result": {"data": self.results[name]}, "more": True}}))
+                pending.discard(name)
+            if not pending:
+                await ws.send(json.dumps({"type": "disconnect", "reason": "server_restart", "reconnect": True}))
+
+
+@unittest.skipIf(websockets is None, "pacchetto websockets non installato")
+class ListenSorareUpdatesTest(unittest.TestCase):
+
+    def run_listener(self, server, subscriptions):
+        received = []
+
+        async def scenario():
+            async with websockets.serve(server.handler, "127.0.0.1", 0, subprotocols=["actioncable-v1-json"]) as ws_server:
+                port = ws_server.sockets[0].getsockname()[1]
+                gestionale.SORARE_WS_URL = f"ws://127.0.0.1:{port}/cable"
+                await asyncio.wait_for(gestionale.listen_sorare_updates(subscriptions, lambda name, data: received.append((name, data)), lambda: False), timeout=10)
+
+        original_url, original_key = gestionale.SORARE_WS_URL, gestionale.SORARE_API_KEY
+        gestionale.SORARE_API_KEY = "test-key"
+        try:
+            with self.assertRaises(ConnectionError):
+                asyncio.run(scenario())
+        finally:
+            gestionale.SORARE_WS_URL, gestionale.SORARE_API_KEY = original_url, original_key
+        return received
+
+    def test_subscribe_execute_and_results(self):
+        data = {"aCardWasUpdated": {"slug": "card-1", "liveSingleSaleOffer": None, "player": {"slug": "player-1"}}}
+        server = ActionCableStandIn(results={"cards": data})
+        received = self.run_listener(server, {"cards": ("subscription { aCardWasUpdated { slug } }", {"playerSlugs": ["player-1"]})})
+
+        self.assertEqual(received, [("cards", data)])
+        self.assertEqual(server.headers["APIKEY"], "test-key")
+        subscribe, execute = server.received
+        self.assertEqual(subscribe["command"], "subscribe")
+        self.assertEqual(json.loads(subscribe["identifier"])["channel"], "GraphqlChannel")
+        self.assertEqual(execute["command"], "message")
+        self.assertEqual(execute["identifier"], subscribe["identifier"])
+        # data è una stringa JSON annidata, come vuole ActionCable
+        self.assertEqual(json.loads(execute["data"]), {"query": "subscription { aCardWasUpdated { slug } }", "variables": {"playerSlugs": ["player-1"]}, "action": "execute"})
+
+    def test_rejected_subscription_is_not_executed(self):
+        data = {"tokenOfferWasUpdated": {"status": "accepted"}}
+        server = ActionCableStandIn(reject={"cards"}, results={"offers": data})
+        received = self.run_listener(server, {"cards": ("subscription { a }", {}), "offers": ("subscription { b }", {})})
+
+        self.assertEqual(received, [("offers", data)])
+        executed = [json.loads(message["identifier"])["channelId"].split("-")[0] for message in server.received if message["command"] == "message"]
+        self.assertEqual(executed, ["offers"])
+
+
+if __name__ == "__main__":
+    unittest.main()
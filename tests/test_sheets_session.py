@@ -0,0 +1,56 @@
+"""
+Ripristino di Spreadsheet/Worksheet dalla sessione salvata: usa interni di gspread (__new__,
+_properties, costruttore di Worksheet). Se la versione fissata in requirements.txt li cambia,
+questi test falliscono invece di rompere in silenzio le esecuzioni con la cache.
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gestionale
+
+
+class FakeHTTPClient(gestionale.gspread.http_client.HTTPClient):
+    """Registra le chiamate che gspread inoltra al client HTTP (nessuna sessione reale)."""
+
+    def __init__(self):
+        self.calls = []
+
+    def values_get(self, spreadsheet_id, range_name, params=None):
+        self.calls.append((spreadsheet_id, range_name))
+        return {"range": range_name, "majorDimension": "ROWS", "values": [["Slug"]]}
+
+
+@unittest.skipUnless(gestionale.GSPREAD_RESTORE_SUPPORTED, "ripristino disattivato per questa versione di gspread")
+class RestoreFromSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.original_client = gestionale.SHEETS_CLIENT
+        self.http_client = FakeHTTPClient()
+        gestionale.SHEETS_CLIENT = type("Client", (), {"http_client": self.http_client})()
+
+    def tearDown(self):
+        gestionale.SHEETS_CLIENT = self.original_client
+
+    def test_spreadsheet_routes_calls_through_the_client(self):
+        spreadsheet = gestionale.restore_spreadsheet("sheet-id", "Gestionale")
+        self.assertEqual((spreadsheet.id, spreadsheet.title), ("sheet-id", "Gestionale"))
+        spreadsheet.values_get("Foglio1!A1")
+        self.assertEqual(self.http_client.calls, [("sheet-id", "Foglio1!A1")])
+
+    def test_worksheet_round_trip(self):
+        spreadsheet = gestionale.restore_spreadsheet("sheet-id", "Gestionale")
+        properties = {"sheetId": 7, "title": "Foglio1", "index": 0, "gridProperties": {"rowCount": 120, "columnCount": 37}}
+        worksheet = gestionale.restore_worksheet(spreadsheet, properties)
+
+        self.assertEqual((worksheet.id, worksheet.title, worksheet.row_count, worksheet.col_count), (7, "Foglio1", 120, 37))
+        self.assertIs(worksheet.spreadsheet, spreadsheet)
+        self.assertEqual(gestionale.worksheet_properties(worksheet), properties)
+        self.assertEqual(worksheet.get("A1"), [["Slug"]])
+        self.assertEqual(self.http_client.calls[-1][0], "sheet-id")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+"""SheetsSink di Foglio1: righe collocate per Slug sulla colonna attuale e solo le colonne previste."""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gestionale
+
+
+class FakeSheet:
+    """Foglio1 in memoria: la colonna Slug riflette l'ordine attuale delle righe."""
+
+    def __init__(self, slugs):
+        self.slugs = slugs
+        self.updates = []
+        self.spreadsheet = type("Spreadsheet", (), {"id": "test"})()
+        self.title = gestionale.MAIN_SHEET_NAME
+
+    def col_values(self, col):
+        return ["Slug"] + self.slugs
+
+    def batch_update(self, updates, **kwargs):
+        self.updates.extend(updates)
+
+
+class SheetsSinkTest(unittest.TestCase):
+
+    def test_dashboard_columns_only(self):
+        sheet = FakeSheet(["card-a"])
+        row = {header: f"v{i}" for i, header in enumerate(gestionale.MAIN_SHEET_HEADERS)}
+        row["Slug"] = "card-a"
+        sink = gestionale.SheetsSink(sheet, gestionale.SHEETS_DASHBOARD_COLUMNS)
+        sink.write("cards", [row])
+        sink.flush()
+
+        written = {}
+        for update in sheet.updates:
+            first, last = update["range"].split(":")
+            first_col = gestionale.gspread.utils.a1_to_rowcol(first)[1]
+            last_col = gestionale.gspread.utils.a1_to_rowcol(last)[1]
+            self.assertEqual(len(update["values"][0]), last_col - first_col + 1)
+            written.update(zip(gestionale.MAIN_SHEET_HEADERS[first_col - 1:last_col], update["values"][0]))
+        expected = set(gestionale.SHEETS_DASHBOARD_COLUMNS) - set(gestionale.CARD_IDENTITY_COLUMNS)
+        self.assertEqual(set(written), expected)
+        self.assertTrue(all(written[header] == row[header] for header in written))
+
+    def test_missing_row_is_not_written(self):
+        sheet = FakeSheet(["card-other"])
+        sink = gestionale.SheetsSink(sheet, gestionale.MAIN_SHEET_HEADERS)
+        sink.write("cards", [{"Slug": "card-gone", "Sale Price (EUR)": 1.0}])
+        sink.flush()
+        self.assertEqual(sheet.updates, [])
+
+
+class WriteFloorUpdatesTest(unittest.TestCase):
+
+    def test_rows_located_by_current_slug_column(self):
+        # Lo snapshot ha card-a in riga 2, ma nel frattempo sync_galleria ha inserito card-new sopra
+        records = [{"Slug": "card-a", "Player API Slug": "player-1"}, {"Slug": "card-b", "Player API Slug": "player-2"}]
+        sheet = FakeSheet(["card-new", "card-a", "card-b"])
+        gestionale.write_floor_updates(sheet, records, {"player-1": {"L_ANY": 1.0}}, {"eth_to_eur": 1})
+
+        floor_headers = [header for header in gestionale.MAIN_SHEET_HEADERS if header in gestionale.FLOOR_COLUMN_ALIASES]
+        self.assertEqual([update["range"] for update in sheet.updates], [gestionale.columns_range(3, floor_headers)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+"""Serie storiche locali: più processi che salvano lo stesso file non si cancellano i campioni."""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gestionale
+
+
+class TimeSeriesStoreMergeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "floors.bin")
+        self.now = 1_800_000_000
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def open_store(self):
+        store = gestionale.TimeSeriesStore(self.path)
+        store.load()
+        return store
+
+    def test_concurrent_writers_keep_each_others_samples(self):
+        first, second = self.open_store(), self.open_store()
+        first.append("player|L_ANY", 10.0, self.now - 600)
+        second.append("player|L_ANY", 12.0, self.now - 300)
+        second.append("other|L_ANY", 5.0, self.now - 300)
+        first.save(self.now)
+        second.save(self.now)
+
+        store = self.open_store()
+        self.assertEqual(store.range("player|L_ANY"), [(self.now - 600, 10.0), (self.now - 300, 12.0)])
+        self.assertEqual(store.range("other|L_ANY"), [(self.now - 300, 5.0)])
+
+    def test_downsampled_buckets_are_not_counted_twice(self):
+        old = self.now - 3 * 86400
+        store = self.open_store()
+        store.append("player|L_ANY", 10.0, old)
+        store.save(self.now)
+        # Un secondo processo aveva caricato lo stesso campione prima del downsampling
+        stale = gestionale.TimeSeriesStore(self.path)
+        stale.series = {"player|L_ANY": gestionale.TimeSeriesStore.empty_series()}
+        stale.append("player|L_ANY", 10.0, old)
+        stale.save(self.now)
+
+        hourly = self.open_store().series["player|L_ANY"]["hourly"]
+        self.assertEqual(list(hourly["count"]), [1])
+
+    def test_sample_crossing_raw_cutoff_between_saves_is_counted_once(self):
+        # Campione a 47,5 ore: al primo salvataggio è ancora raw, al secondo (2 ore dopo) va nei bucket
+        store = self.open_store()
+        store.append("player|L_ANY", 10.0, self.now - int(47.5 * 3600))
+        store.save(self.now)
+        later = self.open_store()
+        later.append("player|L_ANY", 11.0, self.now + 7200)
+        later.save(self.now + 7200)
+
+        series = self.open_store().series["player|L_ANY"]
+        self.assertEqual(list(series["hourly"]["count"]), [1])
+        self.assertEqual(list(series["raw"]["ts"]), [self.now + 7200])
+
+    def test_stale_raw_sample_already_bucketed_on_disk_is_counted_once(self):
+        sample_ts = self.now - int(47.5 * 3600)
+        store = self.open_store()
+        store.append("player|L_ANY", 10.0, sample_ts)
+        store.save(self.now)
+        # Due processi caricano lo stesso file; il primo salva dopo il cutoff e aggrega il campione
+        first, second = self.open_store(), self.open_store()
+        first.append("player|L_ANY", 11.0, self.now + 7000)
+        first.save(self.now + 7200)
+        second.append("player|L_ANY", 12.0, self.now + 7100)
+        second.save(self.now + 7200)
+
+        series = self.open_store().series["player|L_ANY"]
+        self.assertEqual(list(series["hourly"]["count"]), [1])
+        self.assertEqual(list(series["raw"]["ts"]), [self.now + 7000, self.now + 7100])
+
+
+if __name__ == "__main__":
+    unittest.main()